@@ -35,7 +35,9 @@
  * the DMA addresses of each chunk as well as total memory
  * available. Another procfs interface is provided allowing userspace
  * to read/write to the buffer.  Userspace can use this for debugging
- * and try to warm the caches with the buffer contents.
+ * and try to warm the caches with the buffer contents.  The same
+ * procfs file can be mmap()ed to access the buffer directly, without
+ * copying through read()/write().
  *
  * The buffers are DMA mapped to the NFP PCI device.  We obtain the
  * device handle by calling into the main NFP PCI device driver.
@@ -47,6 +49,7 @@
 
 #include <linux/version.h>
 #include <linux/module.h>
+#include <linux/mm.h>
 #include <linux/pci.h>
 #include <linux/proc_fs.h>
 #include <linux/seq_file.h>
@@ -297,12 +300,56 @@ static ssize_t npb_buf_write(struct file *file, const char __user *buf,
 	return npb_buf_op(file, (char __user *)buf, count, offp, 1);
 }
 
+/*
+ * Map (part of) the buffer into userspace.  The chunks are physically
+ * contiguous but not contiguous with each other, so each chunk
+ * overlapping the requested range is remapped separately.  The normal
+ * (cached) page protection is kept, as userspace uses the mapping to
+ * warm the caches.
+ */
+static int npb_buf_mmap(struct file *file, struct vm_area_struct *vma)
+{
+	struct nfp_pciebench *npb = file->private_data;
+	unsigned long off = vma->vm_pgoff << PAGE_SHIFT;
+	unsigned long size = vma->vm_end - vma->vm_start;
+	unsigned long addr = vma->vm_start;
+	unsigned long chunk_off, len, pfn;
+	int chunk_idx;
+	int err;
+
+	if (off >= NFP_PCIEBENCH_MAX_MEM ||
+	    size > NFP_PCIEBENCH_MAX_MEM - off)
+		return -EINVAL;
+
+	while (size) {
+		chunk_idx = off / NFP_PCIEBENCH_CHUNK_SZ;
+		chunk_off = off % NFP_PCIEBENCH_CHUNK_SZ;
+
+		len = min_t(unsigned long, size,
+			    NFP_PCIEBENCH_CHUNK_SZ - chunk_off);
+		pfn = (virt_to_phys(npb->buf[chunk_idx]) + chunk_off) >>
+			PAGE_SHIFT;
+
+		err = remap_pfn_range(vma, addr, pfn, len, vma->vm_page_prot);
+		if (err)
+			return err;
+
+		addr += len;
+		off += len;
+		size -= len;
+	}
+
+	vma->vm_flags |= VM_DONTEXPAND | VM_DONTDUMP;
+	return 0;
+}
+
 static const struct file_operations npb_buf_fops = {
 	.owner          = THIS_MODULE,
 	.open           = npb_buf_open,
 	.release        = npb_buf_release,
 	.read           = npb_buf_read,
 	.write          = npb_buf_write,
+	.mmap           = npb_buf_mmap,
 };
 
 
@@ -0,0 +1,338 @@
+#! /usr/bin/env python
+#
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Benchmark the host side of running a test point: talking to the
+device, decoding results and journals, computing statistics and
+writing the output.  A simulated device which completes every test
+immediately stands in for the NFP, so all time measured is spent on
+the host.
+
+The timings can be saved as a JSON baseline and later runs compared
+against it."""
+
+import array
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from pciebench.nfpbench import NFPBench
+from pciebench.simdev import SimDevice
+from pciebench.store import ResultStore
+from pciebench.transport import _exec_cmd
+from pciebench.tablewriter import TableWriter
+from pciebench.stats import ListStats, histo2cdf
+import pciebench.stats
+
+# PCIEBENCH_LAT_TRANS and PCIEBENCH_JOURNAL_SZ
+SIZES = [2 * 1024 * 1024, 16 * 1024 * 1024]
+QUICK_SIZES = [256 * 1024]
+
+# Number of operations timed for the per-call phases
+OPS = 1000
+
+# Stand-in for the C helper, to measure the cost of spawning it
+HELPER = "/bin/true"
+
+BENCH_FMT = [("phase", 14, "%s"), ("size", 9, "%d"), ("ops", 6, "%d"),
+             ('', 0, ''),
+             ("total", 8, "%.3f"), ("per op", 9, "%t"),
+             ("ops/s", 10, "%.0f"), ("MB/s", 8, "%.1f")]
+
+CMP_FMT = [("phase", 14, "%s"), ("size", 9, "%d"), ('', 0, ''),
+           ("base", 9, "%t"), ("now", 9, "%t"), ("ratio", 6, "%.2f"),
+           ("note", 6, "%s")]
+
+BASELINE_VERSION = 1
+
+
+def _journal(num, seed=0):
+    """Return an array of @num latency like values (in cycles)"""
+    rng = random.Random(seed)
+    vals = [int(rng.lognormvariate(6.5, 0.1)) for _ in range(4096)]
+    if hasattr(rng, 'choices'):
+        return array.array('I', rng.choices(vals, k=num))
+    # Python 2, picks the same values as choices()
+    return array.array('I', [vals[int(rng.random() * len(vals))]
+                             for _ in range(num)])
+
+
+def _best(func, ops, repeat, setup=None):
+    """Run @func @ops times, @repeat times over, and return the
+    shortest time taken in seconds.  @setup is called, untimed, before
+    every repeat."""
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.time()
+        for _ in range(ops):
+            func()
+        took = time.time() - start
+        if best is None or took < best:
+            best = took
+    return best
+
+
+class _Quiet(object):
+    """Context manager discarding anything written to stdout"""
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+class ControlBench(object):
+    """The benchmarks.  Every phase method returns a list of
+    (phase, size, ops, seconds, bytes) tuples."""
+
+    PHASES = ["params", "poll", "result", "run_test", "helper", "journal",
+              "stats", "cdf", "table"]
+
+    def __init__(self, sizes, repeat, tmpdir):
+        self.sizes = sizes
+        self.repeat = repeat
+        self.tmpdir = tmpdir
+        self.dev = SimDevice(lat_trans=1, bw_trans=1)
+        self.nfp = NFPBench(0, None, None, self.dev)
+        self.nfp.load_fw()
+        self.test_params = [NFPBench.FLAGS_RANDOM, 64, 8192, 0, 0]
+        self.journals = dict((num, _journal(num)) for num in sizes)
+
+    def close(self):
+        """Release the simulated device"""
+        self.dev.close()
+
+    def _per_call(self, phase, func, ops=OPS):
+        """Time @ops calls of @func"""
+        return [(phase, 0, ops, _best(func, ops, self.repeat), 0)]
+
+    def params(self):
+        """Writing the test parameters"""
+        return self._per_call("params",
+                              lambda: self.nfp._set_params(*self.test_params))
+
+    def poll(self):
+        """One poll of the test control"""
+        return self._per_call("poll", self.nfp._get_test_ctrl)
+
+    def result(self):
+        """Reading and decoding the test result"""
+        return self._per_call("result", self.nfp._get_result)
+
+    def run_test(self):
+        """A whole test with inline polling, excluding the journal"""
+        return self._per_call("run_test", lambda: self.nfp.run_test(
+            NFPBench.LAT_DMA_RD, self.test_params))
+
+    def helper(self):
+        """Spawning the helper (with a stand-in binary)"""
+        cmd = HELPER + " -n 0 -c i32._test_ctrl -t 3 -w 0 " + \
+              "-p i32._test_params -r i32._test_result -f 1200"
+        # _exec_cmd() echoes the command
+        with _Quiet():
+            return self._per_call("helper", lambda: _exec_cmd(cmd),
+                                  OPS // 10)
+
+    def journal(self):
+        """Reading and decoding the journal"""
+        res = []
+        for num in self.sizes:
+            self.dev.journal = self.journals[num]
+            took = _best(lambda: self.nfp.get_journal(num, nullcheck=True),
+                         1, self.repeat)
+            res.append(("journal", num, 1, took, num * 4))
+            if pciebench.stats.numpy is not None:
+                took = _best(lambda: self.nfp.get_journal(
+                    num, nullcheck=True, as_numpy=True), 1, self.repeat)
+                res.append(("journal_np", num, 1, took, num * 4))
+        self.dev.journal = array.array('I')
+        return res
+
+    def stats(self):
+        """The statistics NFPBench.lat_test() computes, and a histogram
+        as the detailed tests use"""
+        res = []
+        for num in self.sizes:
+            journal = self.journals[num]
+            def _lat():
+                stats = ListStats(journal)
+                stats.percentiles([50, 95, 99])
+                return stats.min(), stats.avg(), stats.max()
+            res.append(("stats", num, 1, _best(_lat, 1, self.repeat),
+                        num * 4))
+            took = _best(lambda: ListStats(journal).hdr_histo(), 1,
+                         self.repeat)
+            res.append(("hdr_histo", num, 1, took, num * 4))
+        return res
+
+    def cdf(self):
+        """Computing CDFs from a histogram"""
+        res = []
+        for num in self.sizes:
+            stats = ListStats(self.journals[num])
+            histo = stats.histo()
+            hdr = stats.hdr_histo()
+            res.append(("histo2cdf", num, 1,
+                        _best(lambda: histo2cdf(histo), 1, self.repeat), 0))
+            res.append(("hdr_cdf", num, 1,
+                        _best(hdr.cdf, 1, self.repeat), 0))
+        return res
+
+    def table(self):
+        """Writing rows to the text, gnuplot and CSV files, directly
+        (table_*) or through a results store (table_*_s).  The
+        batched (*_b) store exports run in the background and are
+        waited for outside the timed part."""
+        lat_row = ("LAT_DMA_RD", "cold", "rnd", 8192, 64, 0, 0,
+                   512.0, 530.3, 520.0, 600.0, 700.0, 2000.0)
+        cdf_fmt = [("cycles", 8, "%d"), ("ns", 8, "%.0f"),
+                   ("cdf", 10, "%.8f")]
+        store = ResultStore(os.path.join(self.tmpdir, "results"),
+                            create=True)
+        res = []
+        for phase, fmt, row, batched, tstore in \
+            [("table_lat", NFPBench.lat_fmt, lat_row, False, None),
+             ("table_cdf", cdf_fmt, (600, 500.0, 0.5), False, None),
+             ("table_cdf_b", cdf_fmt, (600, 500.0, 0.5), True, None),
+             ("table_cdf_s", cdf_fmt, (600, 500.0, 0.5), False, store),
+             ("table_cdf_sb", cdf_fmt, (600, 500.0, 0.5), True, store)]:
+            def _rows():
+                twr = TableWriter(fmt, stdout=False, store=tstore,
+                                  batched=batched)
+                twr.open(os.path.join(self.tmpdir, phase), TableWriter.ALL)
+                for _ in range(OPS):
+                    twr.out(row)
+                twr.close(TableWriter.ALL)
+            res.append((phase, 0, OPS,
+                        _best(_rows, 1, self.repeat, TableWriter.sync), 0))
+        store.close()
+        return res
+
+    def run(self, phases=None):
+        """Run the benchmark @phases (default: all) and return the
+        results"""
+        res = []
+        for phase in phases or self.PHASES:
+            res += getattr(self, phase)()
+        return res
+
+
+def baseline(results):
+    """Return the JSON baseline for @results"""
+    numpy = pciebench.stats.numpy
+    return {'version': BASELINE_VERSION,
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__ if numpy is not None else None,
+            'results': dict(("%s:%d" % (phase, size),
+                             {'ops': ops, 'seconds': took,
+                              'per_op_ns': took * 1e9 / ops})
+                            for phase, size, ops, took, _ in results)}
+
+
+def compare(twr, base, results, tolerance):
+    """Compare @results with the baseline @base.  Returns the number
+    of phases which got slower by more than @tolerance."""
+    if base.get('version') != BASELINE_VERSION:
+        print("Baseline has an unsupported version")
+        return 1
+    twr.msg("\nCompared to the baseline from %s (Python %s, NumPy %s)\n" %
+            (base.get('host'), base.get('python'), base.get('numpy')))
+    twr.sec()
+    slower = 0
+    for phase, size, ops, took, _ in results:
+        ref = base['results'].get("%s:%d" % (phase, size))
+        if not ref:
+            continue
+        now = took * 1e9 / ops
+        ratio = now / ref['per_op_ns'] if ref['per_op_ns'] else 0.0
+        note = ""
+        if ratio > 1 + tolerance:
+            note = "slower"
+            slower += 1
+        elif ratio < 1 - tolerance:
+            note = "faster"
+        twr.out((phase, size, ref['per_op_ns'], now, ratio, note))
+    return slower
+
+
+def main():
+    """Main function"""
+    usage = """usage: %prog [options]"""
+    parser = OptionParser(usage)
+    parser.add_option('-n', '--samples', type='int', action='append',
+                      dest='sizes', metavar='NUM',
+                      help='Journal size (may be repeated)')
+    parser.add_option('-q', '--quick', action='store_true', default=False,
+                      help='Use small journals for a quick run')
+    parser.add_option('-p', '--phase', action='append', dest='phases',
+                      choices=ControlBench.PHASES, metavar='PHASE',
+                      help='Only run PHASE (may be repeated): ' +
+                      ', '.join(ControlBench.PHASES))
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='Repeat each measurement and report the best')
+    parser.add_option('-s', '--save', metavar='FILE',
+                      help='Save the results as a JSON baseline')
+    parser.add_option('-c', '--compare', metavar='FILE',
+                      help='Compare the results with a JSON baseline')
+    parser.add_option('-t', '--tolerance', type='float', default=0.1,
+                      help='Compare: relative slowdown to flag ' + \
+                           '(default 0.1)')
+    (options, _) = parser.parse_args()
+
+    sizes = options.sizes or (QUICK_SIZES if options.quick else SIZES)
+    tmpdir = tempfile.mkdtemp(prefix="pciebench-bench-")
+    bench = ControlBench(sizes, options.repeat, tmpdir)
+    try:
+        results = bench.run(options.phases)
+    finally:
+        bench.close()
+        shutil.rmtree(tmpdir)
+
+    twr = TableWriter(BENCH_FMT)
+    twr.msg("Host side cost of the control path\n")
+    twr.sec()
+    for phase, size, ops, took, nbytes in results:
+        took = max(took, 1e-9)
+        twr.out((phase, size, ops, took, took * 1e9 / ops, ops / took,
+                 nbytes / took / (1024 * 1024)))
+
+    if options.save:
+        with open(options.save, 'w') as outf:
+            json.dump(baseline(results), outf, indent=1, sort_keys=True)
+            outf.write('\n')
+
+    if options.compare:
+        with open(options.compare, 'r') as inf:
+            base = json.load(inf)
+        slower = compare(TableWriter(CMP_FMT), base, results,
+                         options.tolerance)
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
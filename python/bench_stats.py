@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+#
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Benchmark the pure Python and the NumPy ListStats implementations
+on synthetic journals of the sizes produced by the latency tests,
+against the original ListStats (BaselineStats) as the baseline"""
+
+import array
+import math
+import random
+import sys
+import time
+from optparse import OptionParser
+
+from pciebench.tablewriter import TableWriter
+import pciebench.stats
+from pciebench.stats import ListStats, DEFAULT_PCTS
+
+# PCIEBENCH_LAT_TRANS and PCIEBENCH_JOURNAL_SZ
+SIZES = [2 * 1024 * 1024, 16 * 1024 * 1024]
+
+BENCH_FMT = [("impl", 6, "%s"), ("samples", 9, "%d"), ('', 0, ''),
+             ("init", 8, "%.3f"), ("avg+max", 8, "%.3f"),
+             ("median", 8, "%.3f"), ("pcts", 8, "%.3f"),
+             ("all", 8, "%.3f")]
+
+
+class BaselineStats(object):
+    """The original ListStats, before the NumPy and pure Python
+    fallback implementations, kept as the baseline"""
+
+    def __init__(self, inlist):
+        """Initialise a stats object with a list of items"""
+        self.list = inlist
+        self.sorted_list = sorted(self.list)
+
+    def avg(self):
+        """Return the average of the list."""
+        if not self.list:
+            return 0.0
+        return float(sum(self.list))/len(self.list)
+
+    def median(self):
+        """Return the median of the values."""
+        if not self.list:
+            return 0
+        length = len(self.sorted_list)
+        if not length % 2:
+            return (self.sorted_list[int(length / 2)] +
+                    self.sorted_list[int(length / 2 - 1)]) / 2.0
+        return self.sorted_list[int(length / 2)]
+
+    def min(self):
+        """Return the minimum value in the list"""
+        return min(self.list)
+
+    def max(self):
+        """Return the maximum value in the list"""
+        return max(self.list)
+
+    def percentile(self, percentile):
+        """Return the nth the percentile from a list of values."""
+        # from http://code.activestate.com/recipes/511478/
+        if not self.list:
+            return 0
+        idx = (len(self.sorted_list) - 1) * (percentile / 100.0)
+        floor = math.floor(idx)
+        ceil = math.ceil(idx)
+        if floor == ceil:
+            return self.sorted_list[int(idx)]
+        val0 = self.sorted_list[int(floor)] * (ceil - idx)
+        val1 = self.sorted_list[int(ceil)] * (idx - floor)
+        return val0 + val1
+
+
+def _journal(num, seed=0):
+    """Return an array of @num latency like values (in cycles)"""
+    rng = random.Random(seed)
+    vals = [int(rng.lognormvariate(6.5, 0.1)) for _ in range(4096)]
+    if hasattr(rng, 'choices'):
+        return array.array('I', rng.choices(vals, k=num))
+    # Python 2, picks the same values as choices()
+    return array.array('I', [vals[int(rng.random() * len(vals))]
+                             for _ in range(num)])
+
+
+def _timed(func):
+    """Run @func and return the time it took in seconds"""
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def _percentiles(stats, pcts):
+    """Return the percentiles @pcts of @stats, one at a time for
+    BaselineStats, which has no percentiles()"""
+    if isinstance(stats, BaselineStats):
+        return [stats.percentile(pct) for pct in pcts]
+    return stats.percentiles(pcts)
+
+
+def bench(journal, make):
+    """Time the common operations on @journal, with the stats objects
+    returned by make(journal). Each operation uses a fresh object so
+    that lazily sorted data isn't shared."""
+    t_init = _timed(lambda: make(journal))
+
+    stats = make(journal)
+    t_avg = _timed(lambda: (stats.avg(), stats.max()))
+    stats = make(journal)
+    t_med = _timed(stats.median)
+    stats = make(journal)
+    t_pct = _timed(lambda: _percentiles(stats, DEFAULT_PCTS))
+
+    # What NFPBench.lat_test() needs
+    def _all():
+        stats = make(journal)
+        _percentiles(stats, [50, 95, 99])
+        return stats.min(), stats.avg(), stats.max()
+    t_all = _timed(_all)
+    return t_init, t_avg, t_med, t_pct, t_all
+
+
+def main():
+    """Main function"""
+    usage = """usage: %prog [options]"""
+    parser = OptionParser(usage)
+    parser.add_option('-n', '--samples', type='int', action='append',
+                      dest='sizes', metavar='NUM',
+                      help='Number of samples (may be repeated)')
+    (options, _) = parser.parse_args()
+
+    impls = [("base", BaselineStats),
+             ("python", lambda journal: ListStats(journal, False))]
+    if pciebench.stats.numpy is not None:
+        impls.append(("numpy", lambda journal: ListStats(journal, True)))
+    else:
+        print("NumPy not available, only benchmarking the baseline and pure "
+              "Python")
+
+    twr = TableWriter(BENCH_FMT)
+    twr.msg("ListStats timings in seconds\n")
+    for num in options.sizes or SIZES:
+        journal = _journal(num)
+        twr.sec()
+        for name, make in impls:
+            twr.out((name, num) + bench(journal, make))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+#
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Compare the results of two runs and flag latency and bandwidth
+regressions"""
+
+import sys
+from optparse import OptionParser
+
+from pciebench.compare import Comparison
+from pciebench.store import open_store
+
+
+def main():
+    """Main function"""
+    usage = """usage: %prog [options] <base dir> <new dir>"""
+    parser = OptionParser(usage)
+    parser.add_option('-t', '--threshold', type='float', default=0.05,
+                      help='Relative change to flag (default 0.05)')
+    parser.add_option('-a', '--alpha', type='float', default=0.01,
+                      help='False discovery rate for the latency ' + \
+                           'sample tests (default 0.01)')
+    parser.add_option('-e', '--min-effect', type='float', default=0.147,
+                      help="Smallest Cliff's delta to flag (default 0.147)")
+    parser.add_option('-b', '--resamples', type='int', default=1000,
+                      help='Bootstrap resamples (default 1000)')
+    parser.add_option('--seed', type='int', default=0,
+                      help='Seed for the bootstrap')
+    parser.add_option('-f', '--flagged', action='store_true', default=False,
+                      help='Only list the points flagged')
+    parser.add_option('-o', '--out', default=None, metavar='BASE',
+                      help='Also write BASE_lat and BASE_bw .txt/.csv')
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error("Two results directories are needed")
+
+    base, new = open_store(args[0]), open_store(args[1])
+    for key in ['placement', 'link']:
+        if None not in (base.info(key), new.info(key)) and \
+           base.info(key) != new.info(key):
+            print("Warning: the runs differ in %s: %s vs %s" %
+                  (key, base.info(key), new.info(key)))
+    cmp_res = Comparison(base, new, options.threshold, options.alpha,
+                         options.min_effect, options.resamples, options.seed)
+    cmp_res.run()
+    cmp_res.write(options.out, options.flagged)
+    print("\n%d points compared, %d slower, %d faster; " \
+          "%d only in %s, %d only in %s" %
+          (len(cmp_res.lat) + len(cmp_res.bw), cmp_res.slower,
+           cmp_res.faster, cmp_res.only_base, args[0], cmp_res.only_new,
+           args[1]))
+    base.close()
+    new.close()
+    return 1 if cmp_res.slower else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+#
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Convert raw latency sample files between the binary and text formats"""
+
+import sys
+from optparse import OptionParser
+
+from pciebench.rawsamples import RawSampleReader, FILE_MAGIC, \
+     to_text, from_text
+
+
+def main():
+    """Main function"""
+    usage = """usage: %prog [options] <input> [<output>]
+
+Binary files (*_raw.bin) are converted to text, text files (*_raw.dat)
+to binary.  Without <output>, a binary file's blocks are listed."""
+    parser = OptionParser(usage)
+    parser.add_option('-f', '--freq', type='int', default=None,
+                      metavar='MHZ',
+                      help='ME frequency in MHz (required for text input)')
+    (options, args) = parser.parse_args()
+    if len(args) not in [1, 2]:
+        parser.error("Wrong number of arguments")
+
+    with open(args[0], 'rb') as inf:
+        binary = inf.read(len(FILE_MAGIC)) == FILE_MAGIC
+
+    if len(args) == 1:
+        if not binary:
+            parser.error("No output file given")
+        rdr = RawSampleReader(args[0])
+        print("ME frequency: %dMHz" % (rdr.freq_hz // (1000 * 1000)))
+        for blk in rdr.blocks:
+            print("%-45s %9d samples %10d bytes" %
+                  (blk.label, blk.count, blk.nbytes))
+        rdr.close()
+    elif binary:
+        to_text(args[0], args[1])
+    else:
+        if not options.freq:
+            parser.error("Converting text needs the ME frequency (-f)")
+        from_text(args[0], args[1], options.freq * 1000 * 1000)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,6 +21,9 @@ import sys
 from optparse import OptionParser
 
 from pciebench.nfpbench import NFPBench
+from pciebench.transport import open_transport
+from pciebench.nfpcache import NFPCache
+from pciebench.simdev import SimDevice
 from pciebench.tablewriter import TableWriter
 from pciebench.stats import histo2cdf
 import pciebench.debug
@@ -44,6 +47,28 @@ def main():
     parser.add_option('-u', '--user-helper', dest='helper',
                       default="../user/nfp-pciebench-helper", action='store', metavar='HELPER',
                       help='Path to helper binary')
+    parser.add_option('-t', '--transport',
+                      default='auto', action='store', metavar='TRANSPORT',
+                      choices=['auto', 'libnfp', 'rtsym'],
+                      help='How to access the NFP: auto|libnfp|rtsym ' + \
+                           '(default auto)')
+    parser.add_option('--run-test',
+                      action="store_true", dest='run_test', default=False,
+                      help='Run a DMA test from the host and exit')
+    parser.add_option('--dbg-wr',
+                      action="store_true", dest="dbg_bw_wr", default=False,
+                      help='Run test: Use DMA writes (default read)')
+    parser.add_option('--reload-fw',
+                      action="store_true", dest='reload_fw', default=False,
+                      help='Always reload the firmware, even if it is ' + \
+                           'already loaded and idle')
+    parser.add_option('--sim',
+                      action="store_true", dest='sim', default=False,
+                      help='Run against a simulated NFP (no hardware needed)')
+    parser.add_option('--sim-trans', type='int',
+                      default=None, metavar='NUM', dest='sim_trans',
+                      help='Sim: Transactions per latency test ' + \
+                           '(default as firmware)')
     parser.add_option('-s', '--short',
                       action="store_true", dest='short', default=False,
                       help='Run a subset of the benchmarks')
@@ -79,29 +104,48 @@ def main():
 
     # System information
     pciebench.sysinfo.collect(outdir, options.nfp)
-    nfp = NFPBench(options.nfp, options.fwfile, options.helper)
-
-    # Reload fw
-    nfp._reload_fw()
-    # Set up a page
-    # (currently, this is done separately)
-
-    # Set dma addr to the ME
-    # (currently, this uses the separately allocated page addrs)
-    nfp._set_dma_addrs()
-
-    while True:
-        pass
-    # Up to here is the real role of the server. From here, the ME has to
-    # automatically initiate DMA from its side.
-    # for testing purpose, however,
-    # we can control DMA read / write with python.
-
-    # Test DMA
-    #test_no = nfp.BW_DMA_WR # RD / RW
-    #flags = 0
-    #nfp.dma_test(test_no, flags, options.dbg_winsz, options.dbg_transsz,
-    #    options.dbg_hoff, options.dbg_doff)
+    if options.sim:
+        transport = SimDevice(options.nfp)
+        if options.sim_trans:
+            transport.lat_trans = options.sim_trans
+            transport.bw_trans = options.sim_trans
+        # The C helper can't talk to a simulated device
+        options.helper = None
+        cache = None
+    else:
+        transport = open_transport(options.nfp, options.transport)
+        cache = NFPCache.open(options.nfp)
+    try:
+        nfp = NFPBench(options.nfp, options.fwfile, options.helper, transport,
+                       cache)
+
+        # Load fw (if needed)
+        nfp.load_fw(options.reload_fw)
+        # Set up a page
+        # (currently, this is done separately)
+
+        # Set dma addr to the ME
+        # (currently, this uses the separately allocated page addrs)
+        nfp._set_dma_addrs()
+
+        # Up to here is the real role of the server. From here, the ME has to
+        # automatically initiate DMA from its side.
+        # for testing purpose, however,
+        # we can control DMA read / write with python.
+        if not (options.run_test or options.sim):
+            while True:
+                pass
+
+        # Test DMA
+        test_no = nfp.BW_DMA_WR if options.dbg_bw_wr else nfp.BW_DMA_RD
+        flags = 0
+        twr = TableWriter(nfp.bw_fmt)
+        twr.open(outdir + "dma_test", TableWriter.ALL)
+        nfp.bw_test(twr, test_no, flags, options.dbg_winsz,
+                    options.dbg_transsz, options.dbg_hoff, options.dbg_doff)
+        twr.close(TableWriter.ALL)
+    finally:
+        transport.close()
 
     return
 
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+#
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""List, query and export the tables of a results store"""
+
+import os
+import sys
+from optparse import OptionParser
+
+from pciebench.store import open_store
+from pciebench.tablewriter import TableWriter
+
+
+def main():
+    """Main function"""
+    usage = """usage: %prog [options] <output or results dir>"""
+    parser = OptionParser(usage)
+    parser.add_option('-o', '--outdir', default=None, metavar='DIR',
+                      help='Export tables to DIR')
+    parser.add_option('-t', '--table', action='append', dest='tables',
+                      metavar='NAME',
+                      help='Only export table NAME (may be repeated)')
+    parser.add_option('-f', '--format', default='all',
+                      choices=['all', 'txt', 'dat', 'csv'],
+                      help='Format to export: all, txt, dat or csv')
+    parser.add_option('-l', '--list', action='store_true', default=False,
+                      help='List the tables in the store')
+    parser.add_option('-p', '--point', metavar='TEST:CACHE:ACCESS:WIN:' + \
+                      'SIZE:HOFF:DOFF',
+                      help='Print the results for a test point')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("No results directory given")
+
+    store = open_store(args[0])
+
+    if options.list:
+        for table in store.tables():
+            print("%-40s %5d rows" % (table,
+                                      store.meta['tables'][table]['rows']))
+
+    if options.point:
+        dims = options.point.split(':')
+        if len(dims) != 7:
+            parser.error("A test point has 7 dimensions")
+        for table, row in store.find(*dims[:3] + [int(x) for x in dims[3:]]):
+            samples = store.samples(table, row)
+            print("%s[%d]: %s%s" % (table, row, store.row(table, row),
+                                    "" if samples is None else
+                                    " (%d samples)" % len(samples)))
+
+    if options.outdir:
+        mask = {'all': TableWriter.ALL, 'txt': TableWriter.TXT,
+                'dat': TableWriter.GNP, 'csv': TableWriter.CSV}
+        if options.tables:
+            if not os.path.isdir(options.outdir):
+                os.makedirs(options.outdir)
+            for table in options.tables:
+                store.export(table, options.outdir + '/' + table,
+                             mask[options.format])
+        else:
+            store.export_all(options.outdir, mask[options.format])
+
+    store.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
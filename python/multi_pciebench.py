@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+#
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Run a set of PCIe micro-benchmarks on several NFPs in parallel"""
+
+import sys
+import time
+from optparse import OptionParser
+
+from pciebench.fleet import Fleet, MODES, MODE_SAME
+from pciebench.plan import hms
+import pciebench.options
+import pciebench.debug
+import pciebench.sysinfo
+
+
+def main():
+    """Main function"""
+    usage = """usage: %prog [options] -n NUM,NUM,..."""
+    parser = OptionParser(usage)
+    pciebench.options.add_common_options(parser)
+    parser.add_option('-n', '--nfp', default=None, metavar='LIST',
+                      help='NFP devices to use, e.g. 0,1,2')
+    parser.add_option('-m', '--mode', choices=MODES, default=MODE_SAME,
+                      help='same: run all points on every NFP, split: ' + \
+                           'spread the points across the NFPs ' + \
+                           '(default same)')
+
+    (options, _) = parser.parse_args()
+    if not options.nfp:
+        parser.error("No NFPs given (-n)")
+    try:
+        nums = [int(num) for num in options.nfp.split(',')]
+    except ValueError:
+        parser.error("-n: a comma separated list of NFP numbers")
+    pciebench.options.check_common_options(parser, options)
+    pciebench.debug.VLVL = options.verbose
+
+    outdir = options.outdir
+    plan = pciebench.options.make_plan(options)
+
+    fleet = Fleet(plan, nums, options.mode, outdir,
+                  {'fwfile': options.fwfile, 'helper': options.helper,
+                   'transport': options.transport, 'pin': options.pin,
+                   'thrash': options.thrash,
+                   'thrash_cpus': options.thrash_cpus,
+                   'reload_fw': options.reload_fw, 'sim': options.sim,
+                   'sim_trans': options.sim_trans,
+                   'sim_time': options.sim_time})
+    print(plan.summary())
+    print(fleet.summary())
+    if options.plan:
+        return 0
+
+    pciebench.sysinfo.collect(outdir)
+    start = time.time()
+    fleet.run()
+    print("Ran on %d NFPs in %s" % (len(nums), hms(time.time() - start)))
+    fleet.merge()
+    pciebench.sysinfo.end(outdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
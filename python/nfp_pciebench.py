@@ -21,384 +21,33 @@ import sys
 from optparse import OptionParser
 
 from pciebench.nfpbench import NFPBench
+from pciebench.transport import open_transport
+from pciebench.nfpcache import NFPCache
+from pciebench.simdev import SimDevice
 from pciebench.tablewriter import TableWriter
-from pciebench.stats import histo2cdf
+from pciebench.histogram import save_histograms
+from pciebench.rawsamples import RawSampleWriter, make_label
+from pciebench.checkpoint import Checkpoint
+from pciebench.store import ResultStore, RESULTS_DIR
+from pciebench.sweep import AdaptiveSweep
+from pciebench.plan import PLAN_FMT, LAT_TEST_CDF_FMT, write_cdf
+import pciebench.options
+from pciebench.trace import span, traced
+from pciebench.progress import Progress, serve
+import pciebench.trace
 import pciebench.debug
 import pciebench.sysinfo
 
 
-def run_lat_cmd(nfp, outdir):
-    """Run basic Latency tests for different sizes using the PCIe commands"""
-    twr = TableWriter(nfp.lat_fmt)
-    twr.open(outdir + "lat_cmd_sizes", TableWriter.ALL)
-
-    twr.msg("\nPCIe CMD Latency with different transfer sizes")
-
-    win_sz = 4096
-    trans_szs = [4, 8, 16, 24, 32, 48, 64]
-
-    flags = nfp.FLAGS_HOSTWARM
-
-    for test_no in [nfp.LAT_CMD_RD, nfp.LAT_CMD_WRRD]:
-        twr.sec()
-        for trans_sz in trans_szs:
-            _ = nfp.lat_test(twr, test_no, flags, win_sz, trans_sz, 0, 0)
-
-    twr.close(TableWriter.ALL)
-
-
-def run_lat_cmd_sweep(nfp, outdir):
-    """Run Latency tests to determine any cache or IO-MMU effects"""
-    twr = TableWriter(nfp.lat_fmt)
-
-    win_szs = [x * 1024 for x in [1, 4, 16, 256, 512]] + \
-              [x * 1024 * 1024 for x in [1, 1.5, 2, 3, 4, 8, 16, 32, 64]]
-    trans_szs = [8, 64]
-    access = nfp.FLAGS_RANDOM
-
-    for test_no in [nfp.LAT_CMD_RD, nfp.LAT_CMD_WRRD]:
-        for trans_sz in trans_szs:
-
-            out_name = "lat_cmd_sweep_"
-            out_name += "rd_" if test_no == nfp.LAT_CMD_RD else "wrrd_"
-            out_name += "seq_" if access == 0 else "rnd_"
-            out_name += "%02d" % trans_sz
-
-            twr.open(outdir + out_name, TableWriter.ALL)
-            twr.msg("\n\nPCIe CMD %s latency over different windows "
-                    "sizes with %s access" %
-                    ("Read" if test_no == nfp.LAT_CMD_RD else "Write/Read",
-                     "sequential" if access == 0 else "random"))
-
-            for flags in [0, nfp.FLAGS_THRASH,
-                          nfp.FLAGS_WARM, nfp.FLAGS_HOSTWARM]:
-
-                twr.sec()
-                for win_sz in win_szs:
-                    _ = nfp.lat_test(twr, test_no, access | flags,
-                                     win_sz, trans_sz, 0, 0)
-
-            twr.close(TableWriter.ALL)
-
-def run_lat_cmd_off(nfp, outdir):
-    """Run Latency tests to with different host offset"""
-    twr = TableWriter(nfp.lat_fmt)
-
-    win_szs = [4096, 8 * 1024 * 1024]
-    trans_szs = [8, 64]
-
-    for test_no in [nfp.LAT_CMD_RD, nfp.LAT_CMD_WRRD]:
-        out_name = "lat_cmd_off_%s" % \
-                   ("rd" if test_no == nfp.LAT_CMD_RD else "wrrd")
-        twr.open(outdir + out_name, TableWriter.ALL)
-        twr.msg("\nPCIe CMD %s latency with different host offset" %
-                ("Read" if test_no == nfp.LAT_CMD_RD else "Write/Read"))
-
-        for trans_sz in trans_szs:
-            for win_sz in win_szs:
-                for flags in [0, nfp.FLAGS_HOSTWARM]:
-                    twr.sec()
-                    for off in [0, 1, 2, 3, 4, 6, 8, 16, 32, 48]:
-                        _ = nfp.lat_test(twr, test_no, flags,
-                                         win_sz, trans_sz, off, 0)
-
-        twr.close(TableWriter.ALL)
-
-
-def run_lat_dma(nfp, outdir):
-    """Run basic Latency tests for different sizes using the PCIe commands"""
-    twr = TableWriter(nfp.lat_fmt)
-    twr.open(outdir + "lat_dma_sizes", TableWriter.ALL)
-
-    twr.msg("\nPCIe DMA Latency with different transfer sizes")
-    win_sz = 8192
-    flags = nfp.FLAGS_HOSTWARM
-    trans_szs = [4, 8, 16, 24, 32, 48, 64,
-                 128, 256, 512, 768, 1024, 1280, 1520, 2048]
-
-    for test_no in [nfp.LAT_DMA_RD, nfp.LAT_DMA_WRRD]:
-        twr.sec()
-        for trans_sz in trans_szs:
-            _ = nfp.lat_test(twr, test_no, flags, win_sz, trans_sz, 0, 0)
-
-    twr.close(TableWriter.ALL)
-
-def run_lat_dma_byte(nfp, outdir):
-    """Run basic Latency tests for different sizes using the PCIe commands"""
-    twr = TableWriter(nfp.lat_fmt)
-    twr.open(outdir + "lat_dma_sizes_byte_inc", TableWriter.ALL)
-
-    twr.msg("\nPCIe DMA Latency with different transfer sizes")
-    win_sz = 8192
-    flags = nfp.FLAGS_HOSTWARM
-
-    for mid_sz in [256, 1024]:
-        trans_szs = range(mid_sz - 16, mid_sz + 16)
-
-        for test_no in [nfp.LAT_DMA_RD, nfp.LAT_DMA_WRRD]:
-            twr.sec()
-            for trans_sz in trans_szs:
-                _ = nfp.lat_test(twr, test_no, flags, win_sz, trans_sz, 0, 0)
-
-    twr.close(TableWriter.ALL)
-
-
-def run_lat_dma_sweep(nfp, outdir):
-    """Run Latency tests to determine any cache or IO-MMU effects"""
-    twr = TableWriter(nfp.lat_fmt)
-
-    win_szs = [x * 1024 for x in [8, 64, 256, 512]] + \
-              [x * 1024 * 1024 for x in [1, 1.5, 2, 4, 8, 16, 32, 64]]
-    trans_sz = 64
-
-    access = nfp.FLAGS_RANDOM
-
-    for test_no in [nfp.LAT_DMA_RD, nfp.LAT_DMA_WRRD]:
-        out_name = "lat_dma_sweep_"
-        out_name += "rd_" if test_no == nfp.LAT_DMA_RD else "wrrd_"
-        out_name += "seq_" if access == 0 else "rnd_"
-        out_name += "%02d" % trans_sz
-
-        twr.open(outdir + out_name, TableWriter.ALL)
-        twr.msg("\n\nPCIe DMA %s latency over different windows "
-                "sizes with %s access" %
-                ("Read" if test_no == nfp.LAT_DMA_RD else "Write/Read",
-                 "sequential" if access == 0 else "random"))
-
-        for flags in [0, nfp.FLAGS_THRASH,
-                      nfp.FLAGS_WARM, nfp.FLAGS_HOSTWARM]:
-            twr.sec()
-            for win_sz in win_szs:
-                _ = nfp.lat_test(twr, test_no, access | flags,
-                                 win_sz, trans_sz, 0, 0)
-
-        twr.close(TableWriter.ALL)
-
-
-def run_lat_dma_off(nfp, outdir):
-    """Run Latency tests to with different host offset"""
-    twr = TableWriter(nfp.lat_fmt)
-
-    flags = nfp.FLAGS_HOSTWARM
-    win_sz = 8192
-    trans_szs = [64, 128, 256, 407, 416, 1024, 2048]
-    offsets = [0, 1, 2, 3, 4, 6, 8, 12, 16, 20, 25, 32, 41, 48, 63]
-
-    for test_no in [nfp.LAT_DMA_RD, nfp.LAT_DMA_WRRD]:
-        out_name = "lat_dma_off_%s" % \
-                   ("rd" if test_no == nfp.LAT_DMA_RD else "wrrd")
-
-        twr.open(outdir + out_name, TableWriter.ALL)
-        twr.msg("\nPCIe DMA %s latency with different host offset" %
-                ("Read" if test_no == nfp.LAT_DMA_RD else "Write/Read"))
-
-        for trans_sz in trans_szs:
-            twr.sec()
-            for off in offsets:
-                _ = nfp.lat_test(twr, test_no, flags,
-                                 win_sz, trans_sz, off, 0)
-            twr.sec()
-            for off in offsets:
-                _ = nfp.lat_test(twr, test_no, flags,
-                                 win_sz, trans_sz, 0, off)
-
-        twr.close(TableWriter.ALL)
-
-LAT_TEST_CDF_FMT = [("cycles", 8, "%d"), ("ns", 8, "%.0f"),
-                    ("cdf", 10, "%.8f")]
-def run_lat_details(nfp, outdir):
-    """Run a longer test and perform some analysis"""
-
-    win_szs = [8192, 64 * 1024 * 1024]
-    common_flags = nfp.FLAGS_LONG | nfp.FLAGS_RANDOM
-
-    # Commands latencies
-    trans_szs = [8]
-    twr = TableWriter(nfp.lat_fmt)
-    twr.open(outdir + "lat_cmd_details", TableWriter.ALL)
-    cdfwr = TableWriter(LAT_TEST_CDF_FMT, stdout=False)
-    cdfwr.open(outdir + "lat_cmd_details_cdf", TableWriter.ALL)
-    raw = open(outdir + "lat_cmd_details_raw.dat", 'w')
-    twr.msg("\nPCIe CMD latencies with more details")
-
-    for test_no in [nfp.LAT_CMD_RD, nfp.LAT_CMD_WRRD]:
-        twr.sec()
-        for trans_sz in trans_szs:
-            for win_sz in win_szs:
-                for flags in [common_flags, common_flags | nfp.FLAGS_HOSTWARM]:
-                    lat_stats = nfp.lat_test(
-                        twr, test_no, flags, win_sz, trans_sz, 0, 0)
-
-                    h_cyc = lat_stats.histo()
-                    cdf_cyc = histo2cdf(h_cyc)
-
-                    vals = sorted(cdf_cyc.keys())
-                    cdfwr.sec("test=%s trans_sz=%d win_sz=%d cache=%s" %
-                              (nfp.TEST_NAMES[test_no], trans_sz, win_sz,
-                               "hwarm" if flags & nfp.FLAGS_HOSTWARM \
-                               else "cold"))
-                    cdfwr.out((vals[0], nfp.cyc2ns(vals[0]), 0))
-                    for val in vals:
-                        cdfwr.out((val, nfp.cyc2ns(val), cdf_cyc[val]))
-
-                    # write raw data
-                    raw.write("# %s %s Winsz=%d trans_sz=%d (values in ns)\n" %
-                              (nfp.TEST_NAMES[test_no],
-                               "Warm" if flags & nfp.FLAGS_HOSTWARM else "Cold",
-                               win_sz, trans_sz))
-                    for t in lat_stats.list:
-                        raw.write("%.0f\n" % nfp.cyc2ns(t))
-                    raw.write("\n\n")
-
-    cdfwr.close(TableWriter.ALL)
-    twr.close(TableWriter.ALL)
-    raw.close()
-
-    # DMA latencies
-    trans_szs = [64, 2048]
-    twr = TableWriter(nfp.lat_fmt)
-    twr.open(outdir + "lat_dma_details", TableWriter.ALL)
-    cdfwr = TableWriter(LAT_TEST_CDF_FMT, stdout=False)
-    cdfwr.open(outdir + "lat_dma_details_cdf", TableWriter.ALL)
-    raw = open(outdir + "lat_dma_details_raw.dat", 'w')
-    twr.msg("\nPCIe DMA latencies with more details")
-
-    for test_no in [nfp.LAT_DMA_RD, nfp.LAT_DMA_WRRD]:
-        twr.sec()
-        for trans_sz in trans_szs:
-            for win_sz in win_szs:
-                for flags in [common_flags, common_flags | nfp.FLAGS_HOSTWARM]:
-                    lat_stats = nfp.lat_test(
-                        twr, test_no, flags, win_sz, trans_sz, 0, 0)
-
-                    h_cyc = lat_stats.histo()
-                    cdf_cyc = histo2cdf(h_cyc)
-
-                    vals = sorted(cdf_cyc.keys())
-                    cdfwr.sec("test=%s trans_sz=%d win_sz=%d cache=%s" %
-                              (nfp.TEST_NAMES[test_no], trans_sz, win_sz,
-                               "hwarm" if flags & nfp.FLAGS_HOSTWARM \
-                               else "cold"))
-                    cdfwr.out((vals[0], nfp.cyc2ns(vals[0]), 0))
-                    for val in vals:
-                        cdfwr.out((val, nfp.cyc2ns(val), cdf_cyc[val]))
-
-                    # write raw data
-                    raw.write("# %s %s Winsz=%d trans_sz=%d (values in ns)\n" %
-                              (nfp.TEST_NAMES[test_no],
-                               "Warm" if flags & nfp.FLAGS_HOSTWARM else "Cold",
-                               win_sz, trans_sz))
-                    for t in lat_stats.list:
-                        raw.write("%.0f\n" % nfp.cyc2ns(t))
-                    raw.write("\n\n")
-
-    cdfwr.close(TableWriter.ALL)
-    twr.close(TableWriter.ALL)
-    raw.close()
-
-def run_bw_dma_sz_sweep(nfp, outdir):
-    """Run Bandwidth tests across different DMA sizes"""
-    twr = TableWriter(nfp.bw_fmt)
-
-    win_sz = 8192
-    # kinda assume MPS of 256
-    trans_szs = [16, 32, 63, 64, 65,
-                 127, 128, 129, 192,
-                 255, 256, 257,
-                 320, 384, 511, 512, 513,
-                 576, 640, 704, 767, 768, 769,
-                 832, 896, 960, 1023, 1024, 1025,
-                 1279, 1280, 1281,
-                 1535, 1536, 1537,
-                 1791, 1792, 1793,
-                 2047, 2048]
-
-    flags = nfp.FLAGS_RANDOM | nfp.FLAGS_HOSTWARM
-
-    out_name = "bw_dma_sz_sweep"
-    twr.open(outdir + out_name, TableWriter.ALL)
-
-    for test_no in [nfp.BW_DMA_RD, nfp.BW_DMA_WR, nfp.BW_DMA_RW]:
-        twr.sec()
-        for trans_sz in trans_szs:
-            nfp.bw_test(twr, test_no, flags, win_sz, trans_sz, 0, 0)
-
-    twr.close(TableWriter.ALL)
-
-
-def run_bw_dma_win_sweep(nfp, outdir):
-    """Run Bandwidth tests with differnt windows sizes"""
-    twr = TableWriter(nfp.bw_fmt)
-
-    win_szs = [x * 1024 for x in [4, 16, 256, 512]] + \
-              [x * 1024 * 1024 for x in [1, 1.5, 2, 3, 4, 8, 16, 32, 64]]
-    trans_szs = [64, 128, 256, 512]
-    access = nfp.FLAGS_RANDOM
-
-    for test_no in [nfp.BW_DMA_RD, nfp.BW_DMA_WR]:
-        for trans_sz in trans_szs:
-
-            out_name = "bw_dma_win_sweep_"
-            out_name += "rd" if test_no == nfp.BW_DMA_RD else "wr"
-            out_name += "_rnd_"
-            out_name += "%02d" % trans_sz
-
-            twr.open(outdir + out_name, TableWriter.ALL)
-            twr.msg("\n\nPCIe DMA %s bandwidth over different windows "
-                    "sizes with Random access" %
-                    ("Read" if test_no == nfp.BW_DMA_RD else "Write"))
-            for flags in [0, nfp.FLAGS_THRASH,
-                          nfp.FLAGS_WARM, nfp.FLAGS_HOSTWARM]:
-
-                twr.sec()
-                for win_sz in win_szs:
-                    nfp.bw_test(twr, test_no, flags | access,
-                                win_sz, trans_sz, 0, 0)
-            twr.close(TableWriter.ALL)
-
-def run_bw_dma_off(nfp, outdir):
-    """Run Bandwidth tests to with different host offset"""
-    twr = TableWriter(nfp.bw_fmt)
-
-    win_sz = 8192
-    trans_szs = [64, 128, 256, 407, 416, 1024, 2048]
-    offsets = [0, 1, 2, 3, 4, 6, 8, 12, 16, 20, 25, 32, 41, 48, 63]
-
-    for flags in [0, nfp.FLAGS_HOSTWARM]:
-        for test_no in [nfp.BW_DMA_RD, nfp.BW_DMA_WR]:
-            out_name = "bw_dma_off_%s" % \
-                       ("rd" if test_no == nfp.BW_DMA_RD else "wr")
-
-            # With DDIO, no point in running cold/warm WRRD tests
-            if flags == 0 and test_no == nfp.LAT_DMA_WRRD:
-                continue
-
-            if flags == 0:
-                out_name += "_cold"
-
-            twr.open(outdir + out_name, TableWriter.ALL)
-            twr.msg("\nPCIe DMA %s Bandwidth with different host offset" %
-                    ("Read" if test_no == nfp.LAT_DMA_RD else "Write"))
-
-            for trans_sz in trans_szs:
-                twr.sec()
-                for off in offsets:
-                    _ = nfp.bw_test(twr, test_no, flags,
-                                    win_sz, trans_sz, off, 0)
-                twr.sec()
-                for off in offsets:
-                    _ = nfp.bw_test(twr, test_no, flags,
-                                    win_sz, trans_sz, 0, off)
-
-        twr.close(TableWriter.ALL)
-
+@traced
 def run_dbg_lat(nfp, dma, write_read, win_sz, trans_sz,
                 h_off, d_off, rnd, long_run, cache_flags, outdir):
     """Run latency debug test"""
-    twr = TableWriter(nfp.lat_fmt)
+    twr = TableWriter(nfp.lat_fmt, store=nfp.store)
     twr.open(outdir + "dbg_lat", TableWriter.ALL)
 
-    cdfwr = TableWriter(LAT_TEST_CDF_FMT, stdout=False)
+    cdfwr = TableWriter(LAT_TEST_CDF_FMT, stdout=False,
+                        store=nfp.store, batched=True)
     cdfwr.open(outdir + "dbg_lat_details_cdf", TableWriter.ALL)
 
     flags = cache_flags
@@ -421,22 +70,26 @@ def run_dbg_lat(nfp, dma, write_read, win_sz, trans_sz,
             test_no = nfp.LAT_CMD_RD
 
     lat_stats = nfp.lat_test(twr, test_no, flags, win_sz,
-                             trans_sz, h_off, d_off)
-
-    h_cyc = lat_stats.histo()
-    cdf_cyc = histo2cdf(h_cyc)
-
-    vals = sorted(cdf_cyc.keys())
-    cdfwr.sec("test=%s trans_sz=%d win_sz=%d" %
-              (nfp.TEST_NAMES[test_no], trans_sz, win_sz))
-    cdfwr.out((vals[0], nfp.cyc2ns(vals[0]), 0))
-    for val in vals:
-        cdfwr.out((val, nfp.cyc2ns(val), cdf_cyc[val]))
+                             trans_sz, h_off, d_off, keep=True)
+
+    head = "test=%s trans_sz=%d win_sz=%d" % \
+           (nfp.TEST_NAMES[test_no], trans_sz, win_sz)
+    hist = lat_stats.hdr_histo()
+    write_cdf(nfp, cdfwr, hist, head)
+    save_histograms(outdir + "dbg_lat_details_hist.json", {head: hist})
+
+    raw = RawSampleWriter(outdir + "dbg_lat_raw.bin", nfp.freq_hz)
+    raw.add(make_label(nfp.TEST_NAMES[test_no],
+                       flags & nfp.FLAGS_HOSTWARM, win_sz, trans_sz),
+            lat_stats.list, test=test_no, flags=flags, win_sz=win_sz,
+            trans_sz=trans_sz, h_off=h_off, d_off=d_off)
+    raw.close()
 
     cdfwr.close(TableWriter.ALL)
     twr.close(TableWriter.ALL)
 
 
+@traced
 def run_dbg_bw(nfp, wr_flag, rw_flag, win_sz, trans_sz,
                h_off, d_off, rnd, cache_flags, outdir):
     """Run bandwidth debug test"""
@@ -451,7 +104,7 @@ def run_dbg_bw(nfp, wr_flag, rw_flag, win_sz, trans_sz,
     else:
         test_no = nfp.BW_DMA_RD
 
-    twr = TableWriter(nfp.bw_fmt)
+    twr = TableWriter(nfp.bw_fmt, store=nfp.store)
     twr.open(outdir + "dbg_bw", TableWriter.ALL)
 
     flags = cache_flags
@@ -463,42 +116,50 @@ def run_dbg_bw(nfp, wr_flag, rw_flag, win_sz, trans_sz,
     twr.close(TableWriter.ALL)
 
 
-def run_dbg_mem(nfp, outdir):
-    """Debug memory, trying to hit the same cachelines over and over"""
-
-    twr = TableWriter(nfp.bw_fmt)
-    twr.open(outdir + "dbg_mem", TableWriter.ALL)
-
-    flags = nfp.FLAGS_HOSTWARM
-    test_no = nfp.BW_DMA_RD
-    trans_szs = [64, 128, 256, 512, 1024]
-    for trans_sz in trans_szs:
-            nfp.bw_test(twr, test_no, flags, trans_sz, trans_sz, 0, 0)
-            nfp.bw_test(twr, test_no, flags, 8192, trans_sz, 0, 0)
-    twr.close(TableWriter.ALL)
-
-
 def main():
     """Main function"""
 
     usage = """usage: %prog [options]"""
 
     parser = OptionParser(usage)
-    parser.add_option('-f', '--fwfile',
-                      default=None, action='store', metavar='FILE',
-                      help='Firmware file to use')
+    pciebench.options.add_common_options(parser)
     parser.add_option('-n', '--nfp',
                       default=0, action='store', type='int', metavar='NUM',
                       help='select NFP device')
-    parser.add_option('-o', '--outdir',
-                      default="./", action='store', metavar='DIRECTORY',
-                      help='Directory where to write data files')
-    parser.add_option('-u', '--user-helper', dest='helper',
-                      default=None, action='store', metavar='HELPER',
-                      help='Path to helper binary')
-    parser.add_option('-s', '--short',
-                      action="store_true", dest='short', default=False,
-                      help='Run a subset of the benchmarks')
+    parser.add_option('-r', '--resume',
+                      action="store_true", dest='resume', default=False,
+                      help='Resume a previous run in the output directory, ' + \
+                           'skipping completed test points')
+    parser.add_option('-a', '--adaptive',
+                      action="store_true", dest='adaptive', default=False,
+                      help='Refine window size sweeps around changes ' + \
+                           'instead of using a fixed list of sizes')
+    parser.add_option('--adaptive-threshold', type='float',
+                      default=0.05, metavar='FRAC', dest='adaptive_thresh',
+                      help='Adaptive: relative difference between ' + \
+                           'neighbouring points to refine (default 0.05)')
+    parser.add_option('--adaptive-points', type='int',
+                      default=None, metavar='NUM', dest='adaptive_points',
+                      help='Adaptive: maximum points per sweep ' + \
+                           '(default: as many as the fixed sweep)')
+    parser.add_option('--sysinfo-timeout', type='int',
+                      default=pciebench.sysinfo.DEFAULT_TIMEOUT,
+                      metavar='SECS', dest='sysinfo_timeout',
+                      help='Kill system information commands after ' + \
+                           'SECS seconds (default %d)' % \
+                           pciebench.sysinfo.DEFAULT_TIMEOUT)
+    parser.add_option('--sysinfo-no-cache',
+                      action="store_true", dest='sysinfo_nocache',
+                      default=False,
+                      help='Collect all system information again ' + \
+                           'instead of using cached static information')
+    parser.add_option('--trace', metavar='FILE', default=None,
+                      help='Trace where the time goes: write a Chrome ' + \
+                           'trace to FILE and print a summary')
+    parser.add_option('--progress', metavar='ADDR', default=None,
+                      help='Publish the progress of the suite over HTTP ' + \
+                           '([HOST:]PORT, Prometheus metrics) or a Unix ' + \
+                           'socket (path, JSON lines)')
 
 
     ##
@@ -559,23 +220,114 @@ def main():
                       help='Debug: Hit the same cachelines over and over ' + \
                            '[window = transfersize] (default None)')
 
-    parser.add_option("-v", '--verbose',
-                      action="count", help='set the verbosity level')
-
     (options, _) = parser.parse_args()
+    pciebench.options.check_common_options(parser, options)
 
     print(options)
     pciebench.debug.VLVL = options.verbose
 
     outdir = options.outdir
-    if not outdir.endswith('/'):
-        outdir += '/'
+
+    plan = make_plan(options)
+    if plan:
+        print(plan.summary())
+        if options.plan:
+            plan.write(TableWriter(PLAN_FMT))
+            return 0
+
+    # The progress exporter reports the span totals
+    if options.trace or options.progress:
+        pciebench.trace.start(keep=bool(options.trace))
+
+    progress = None
+    if options.progress and plan:
+        progress = Progress(plan.name, options.nfp)
+        exporter = serve(progress, options.progress)
+        print("Progress: %s" % exporter.url())
 
     # System information
-    pciebench.sysinfo.collect(outdir, options.nfp)
+    with span("sysinfo"):
+        pciebench.sysinfo.collect(outdir, options.nfp,
+                                  options.sysinfo_timeout,
+                                  None if options.sysinfo_nocache else
+                                  pciebench.sysinfo.CACHE_DIR)
+
+    if options.sim:
+        transport = SimDevice(options.nfp, time_scale=options.sim_time)
+        if options.sim_trans:
+            transport.lat_trans = options.sim_trans
+            transport.bw_trans = options.sim_trans
+        # The C helper can't talk to a simulated device
+        options.helper = None
+        cache = None
+    else:
+        transport = open_transport(options.nfp, options.transport)
+        cache = NFPCache.open(options.nfp)
+    try:
+        nfp = NFPBench(options.nfp, options.fwfile, options.helper, transport,
+                       cache)
+        print("Placement: %s" % nfp.pin(options.pin))
+        nfp.thrash = options.thrash
+        nfp.thrash_cpus = options.thrash_cpus
+
+        # Load the firmware (if needed) and tell it about the host buffers
+        nfp.load_fw(options.reload_fw)
+        nfp._set_dma_addrs()
+
+        # Record completed test points
+        nfp.checkpoint = Checkpoint(outdir, nfp.fingerprint(), options.resume)
+
+        # Results are kept in a columnar store, the text, gnuplot and CSV
+        # files are exported from it
+        nfp.store = ResultStore(outdir + RESULTS_DIR, create=True)
+        nfp.store.set_info('placement', nfp.placement.as_dict())
+        nfp.store.set_info('link', nfp.link.as_dict() if nfp.link else None)
+        nfp.store.set_info('freq_hz', nfp.freq_hz)
+
+        failed = True
+        try:
+            run(nfp, options, outdir, plan, progress)
+            failed = False
+        finally:
+            # Also on the debug runs and failures
+            with span("store"):
+                nfp.store.close()
+            if progress:
+                progress.finish(failed)
+                exporter.close()
+            if options.trace:
+                pciebench.trace.write(options.trace, outdir + "trace_summary")
+            else:
+                pciebench.trace.stop()
+    finally:
+        transport.close()
+
+
+def make_plan(options):
+    """Return the Plan of the spec selected by @options, or None for
+    the single point debug runs"""
+    if options.dbg_bw:
+        name, only = "bw_dma", ["bw_dma_sz_sweep"]
+    elif options.dbg_lat_cmd or options.dbg_lat_dma or options.dbg_bw_dma:
+        return None
+    elif options.dbg_details:
+        name, only = "lat_details", None
+    elif options.dbg_mem:
+        name, only = "dbg_mem", None
+    else:
+        name, only = None, None
 
-    nfp = NFPBench(options.nfp, options.fwfile, options.helper)
+    adaptive = None
+    if options.adaptive:
+        adaptive = AdaptiveSweep(options.adaptive_thresh,
+                                 options.adaptive_points)
+    return pciebench.options.make_plan(options, name, only, adaptive)
 
+
+def run(nfp, options, outdir, plan, progress=None):
+    """Run the benchmarks selected by @options: @plan or one of the
+    single point debug runs.  @progress is updated while running
+    @plan."""
     cache_vals = {'hwarm' : nfp.FLAGS_HOSTWARM,
                   'dwarm' : nfp.FLAGS_WARM,
                   'thrash' : nfp.FLAGS_THRASH}
@@ -584,18 +336,14 @@ def main():
     if options.dbg_cache:
         cache_flags = cache_vals[options.dbg_cache]
 
-    if options.dbg_bw:
-        run_bw_dma_sz_sweep(nfp, outdir)
-        return
-
-    if options.dbg_lat_cmd:
+    if options.dbg_lat_cmd and not plan:
         run_dbg_lat(nfp, False, options.dbg_lat_wrrd,
                     options.dbg_winsz, options.dbg_transsz,
                     options.dbg_hoff, 0, options.dbg_rnd, options.dbg_long,
                     cache_flags, outdir)
         return
 
-    if options.dbg_lat_dma:
+    if options.dbg_lat_dma and not plan:
         run_dbg_lat(nfp, True, options.dbg_lat_wrrd,
                     options.dbg_winsz, options.dbg_transsz,
                     options.dbg_hoff, options.dbg_doff,
@@ -603,41 +351,17 @@ def main():
                     cache_flags, outdir)
         return
 
-    if options.dbg_bw_dma:
+    if options.dbg_bw_dma and not plan:
         run_dbg_bw(nfp, options.dbg_bw_wr, options.dbg_bw_rw,
                    options.dbg_winsz, options.dbg_transsz,
                    options.dbg_hoff, options.dbg_doff,
                    options.dbg_rnd, cache_flags, outdir)
         return
 
-    if options.dbg_details:
-        run_lat_details(nfp, outdir)
-        return
-
-    if options.dbg_mem:
-        run_dbg_mem(nfp, outdir)
-        return
-
-    run_lat_cmd(nfp, outdir)
-    run_lat_cmd_sweep(nfp, outdir)
-    if not options.short:
-        run_lat_cmd_off(nfp, outdir)
-
-    run_lat_dma(nfp, outdir)
-    if not options.short:
-        run_lat_dma_byte(nfp, outdir)
-    run_lat_dma_sweep(nfp, outdir)
-    if not options.short:
-        run_lat_dma_off(nfp, outdir)
-
-    run_lat_details(nfp, outdir)
-
-    run_bw_dma_sz_sweep(nfp, outdir)
-    run_bw_dma_win_sweep(nfp, outdir)
-    if not options.short:
-        run_bw_dma_off(nfp, outdir)
+    plan.run(nfp, outdir, progress)
 
-    pciebench.sysinfo.end(outdir)
+    with span("sysinfo"):
+        pciebench.sysinfo.end(outdir, options.sysinfo_timeout)
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -0,0 +1,175 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Durable record of completed test points, used to resume runs.
+
+Every completed test point is appended to a JSON lines file and
+synced to disk before the next point starts.  A record holds the test
+parameters, the row written to the TableWriter and a fingerprint of
+the firmware and host.  Raw samples, if requested, are stored next to
+it in a binary file.
+
+When resuming, points recorded with the same fingerprint are not run
+again.  Instead the recorded row is written out, so the text, gnuplot
+and CSV outputs are rebuilt completely.
+"""
+
+import array
+import hashlib
+import json
+import os
+import platform
+import sys
+
+from .debug import dbg, warn
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+SAMPLES_DIR = "checkpoint-samples"
+
+
+def file_hash(path):
+    """Return the SHA-1 of the file @path or None if it can't be read"""
+    try:
+        with open(path, 'rb') as inf:
+            return hashlib.sha1(inf.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def host_fingerprint():
+    """Return a dictionary describing the host.  Only things which
+    survive a reboot but affect the results are included."""
+    res = {'hostname': platform.node(),
+           'kernel': platform.release()}
+    try:
+        with open("/proc/cmdline") as inf:
+            res['cmdline'] = inf.read().strip()
+    except (IOError, OSError):
+        pass
+    try:
+        with open("/proc/cpuinfo") as inf:
+            for line in inf:
+                if line.startswith("model name"):
+                    res['cpu'] = line.partition(':')[2].strip()
+                    break
+    except (IOError, OSError):
+        pass
+    return res
+
+
+def point_key(test_no, flags, win_sz, trans_sz, h_off, d_off):
+    """Return the key for a test point"""
+    return "%d:%#x:%d:%d:%d:%d" % (test_no, flags, int(win_sz), trans_sz,
+                                   h_off, d_off)
+
+
+class Checkpoint(object):
+    """Record completed test points in directory @outdir.  Points
+    recorded previously with the same @fingerprint are loaded if
+    @resume is set, otherwise any previous record is discarded."""
+
+    def __init__(self, outdir, fingerprint, resume=False):
+        self.outdir = outdir
+        self.path = os.path.join(outdir, CHECKPOINT_FILE)
+        self.fingerprint = fingerprint
+        self.fp_hash = hashlib.sha1(
+            json.dumps(fingerprint, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:16]
+
+        # Points completed by a previous run
+        self.done = {}
+        # Points completed by this run
+        self.added = {}
+        if resume and os.path.exists(self.path):
+            self._load()
+        self.outf = open(self.path, 'a' if resume else 'w')
+        return
+
+    def _load(self):
+        """Load the records with a matching fingerprint"""
+        skipped = 0
+        with open(self.path, 'r') as inf:
+            for line in inf:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # Partial record from an interrupted write
+                    continue
+                if rec.get('fp') != self.fp_hash:
+                    skipped += 1
+                    continue
+                self.done[rec['key']] = rec
+        if skipped:
+            warn("Checkpoint: ignoring %d points recorded with a different "
+                 "firmware or host" % skipped)
+        dbg("Checkpoint: %d points already done" % len(self.done))
+
+    def get(self, key):
+        """Return the record for @key if it was completed previously"""
+        return self.done.get(key)
+
+    def record(self, key):
+        """Return the record for @key, completed by this or a previous
+        run, or None"""
+        return self.added.get(key) or self.done.get(key)
+
+    def samples(self, rec):
+        """Return the raw samples stored with @rec as array('I'), or
+        None if no samples were stored"""
+        if not rec.get('samples'):
+            return None
+        res = array.array('I')
+        path = os.path.join(self.outdir, rec['samples'])
+        with open(path, 'rb') as inf:
+            res.fromfile(inf, os.fstat(inf.fileno()).st_size // res.itemsize)
+        if sys.byteorder == 'big':
+            res.byteswap()
+        return res
+
+    def add(self, key, row, value=None, samples=None):
+        """Record point @key as completed, with the TableWriter @row,
+        an optional summary @value and optional raw @samples"""
+        rec = {'key': key, 'fp': self.fp_hash, 'row': list(row)}
+        if value is not None:
+            rec['value'] = value
+        if samples is not None:
+            rec['samples'] = self._save_samples(key, samples)
+        self.added[key] = rec
+        self.outf.write(json.dumps(rec) + '\n')
+        self.outf.flush()
+        os.fsync(self.outf.fileno())
+
+    def _save_samples(self, key, samples):
+        """Durably store @samples and return the path relative to
+        @outdir"""
+        sdir = os.path.join(self.outdir, SAMPLES_DIR)
+        if not os.path.isdir(sdir):
+            os.makedirs(sdir)
+        name = os.path.join(SAMPLES_DIR, "%s-%s.bin" %
+                            (self.fp_hash, key.replace(':', '_')))
+        if not isinstance(samples, array.array):
+            samples = array.array('I', samples)
+        if sys.byteorder == 'big':
+            samples = array.array('I', samples)
+            samples.byteswap()
+        with open(os.path.join(self.outdir, name), 'wb') as outf:
+            samples.tofile(outf)
+            outf.flush()
+            os.fsync(outf.fileno())
+        return name
+
+    def close(self):
+        """Close the checkpoint file"""
+        self.outf.close()
@@ -0,0 +1,404 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Compare the results of two runs.
+
+Test points are matched by their test parameters through the index of
+the results stores (see store.py).  Points with raw latency samples on
+both sides are compared with a Mann-Whitney U test, Cliff's delta as
+the effect size and bootstrap confidence intervals for the change of
+the median and the 99th percentile.  The p-values are adjusted for the
+number of points compared (Benjamini-Hochberg).  Latency points
+without samples and bandwidth points are compared by their relative
+change only.
+
+The samples are compared as cycle counts and only the confidence
+intervals are converted to ns, with the ME frequency recorded in the
+store (or, for older stores, derived from the base row's Min column),
+so tied cycle counts stay tied.  Only runs on MEs with different
+frequencies are compared in ns.
+
+The samples are reduced to their distinct values and counts first.
+Latencies are integer cycle counts with few distinct values, so the
+tests and the bootstrap work on arrays of a few hundred or thousand
+entries, however many samples were taken.  A bootstrap resample is a
+draw of new counts from a multinomial distribution.
+"""
+
+import bisect
+import math
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .debug import err
+from .store import DIMS
+from .tablewriter import TableWriter
+
+LAT_CMP_FMT = [("Test", 12, "%s"), ("Cache", 6, "%s"), ("Access", 6, "%s"),
+               ("Win", 8, "%z"), ("Size", 5, "%d"),
+               ("HOff", 4, "%d"), ("DOff", 4, "%d"), ('', 0, ''),
+               ("Median", 7, "%.0f"), ("New", 7, "%.0f"), ("d%", 6, "%.1f"),
+               ("99%", 7, "%.0f"), ("New", 7, "%.0f"), ("d%", 6, "%.1f"),
+               ("Delta", 6, "%.3f"), ("q", 8, "%.2g"),
+               ("Med-", 6, "%.0f"), ("Med+", 6, "%.0f"),
+               ("99-", 6, "%.0f"), ("99+", 6, "%.0f"), ("Note", 6, "%s")]
+
+BW_CMP_FMT = [("Test", 12, "%s"), ("Cache", 6, "%s"), ("Access", 6, "%s"),
+              ("Win", 8, "%z"), ("Size", 5, "%d"),
+              ("HOff", 4, "%d"), ("DOff", 4, "%d"), ('', 0, ''),
+              ("Gb/s", 7, "%.2f"), ("New", 7, "%.2f"), ("d%", 6, "%.1f"),
+              ("Note", 6, "%s")]
+
+# Percentiles with bootstrap confidence intervals
+CI_PCTS = [50, 99]
+
+
+def value_counts(samples, scale=None):
+    """Return the distinct values of @samples and how often they occur,
+    both sorted by value.  If @scale is given, the values are
+    multiplied by it (e.g. to convert cycles to ns)."""
+    if numpy is not None:
+        # Signed, the store returns uint32 and differences can be negative
+        vals, cnts = numpy.unique(numpy.asarray(samples, dtype=numpy.int64),
+                                  return_counts=True)
+        if scale is not None:
+            vals = vals * float(scale)
+        return vals, cnts.astype(numpy.int64)
+    counts = {}
+    for val in samples:
+        counts[val] = counts.get(val, 0) + 1
+    vals = sorted(counts.keys())
+    cnts = [counts[val] for val in vals]
+    if scale is not None:
+        vals = [val * float(scale) for val in vals]
+    return vals, cnts
+
+
+def ns_per_cycle(freq_hz, counts=None, low=None):
+    """Return the ns per ME cycle at @freq_hz.  If the frequency is
+    unknown, derive it from the value counts @counts (in cycles) whose
+    smallest value is @low ns."""
+    if freq_hz:
+        return 1e9 / freq_hz
+    if counts is None or not len(counts[0]) or not counts[0][0]:
+        return 1.0
+    return float(low) / float(counts[0][0])
+
+
+def _merge(base, new):
+    """Return the distinct values of the value counts @base and @new
+    and the counts of each side for them"""
+    if numpy is not None:
+        vals = numpy.union1d(base[0], new[0])
+        cnt_b = numpy.zeros(len(vals), dtype=numpy.int64)
+        cnt_n = numpy.zeros(len(vals), dtype=numpy.int64)
+        cnt_b[numpy.searchsorted(vals, base[0])] = base[1]
+        cnt_n[numpy.searchsorted(vals, new[0])] = new[1]
+        return vals, cnt_b, cnt_n
+    merged = {}
+    for side, (vals, cnts) in enumerate([base, new]):
+        for val, cnt in zip(vals, cnts):
+            merged.setdefault(val, [0, 0])[side] += cnt
+    vals = sorted(merged.keys())
+    return vals, [merged[val][0] for val in vals], \
+        [merged[val][1] for val in vals]
+
+
+def mann_whitney(base, new):
+    """Mann-Whitney U test of the value counts @base against @new.
+    Returns (p, delta): the two sided p-value (normal approximation
+    with tie and continuity correction) and Cliff's delta, which is
+    positive if values in @new tend to be larger."""
+    _, cnt_b, cnt_n = _merge(base, new)
+    if numpy is not None:
+        tot = (cnt_b + cnt_n).astype(numpy.float64)
+        # mid-rank of each distinct value
+        ranks = numpy.cumsum(tot) - (tot - 1) / 2.0
+        rank_n = float(numpy.dot(ranks, cnt_n))
+        ties = float(numpy.sum(tot ** 3 - tot))
+        num_b, num_n = float(cnt_b.sum()), float(cnt_n.sum())
+    else:
+        rank_n = ties = 0.0
+        seen = 0
+        for c_b, c_n in zip(cnt_b, cnt_n):
+            tot = float(c_b + c_n)
+            rank_n += (seen + (tot + 1) / 2.0) * c_n
+            ties += tot ** 3 - tot
+            seen += tot
+        num_b, num_n = float(sum(cnt_b)), float(sum(cnt_n))
+    if not num_b or not num_n:
+        return 1.0, 0.0
+    u_n = rank_n - num_n * (num_n + 1) / 2
+    mean = num_b * num_n / 2
+    num = num_b + num_n
+    var = num_b * num_n / 12 * ((num + 1) - ties / (num * (num - 1)))
+    delta = 2 * u_n / (num_b * num_n) - 1
+    if var <= 0:
+        return 1.0, delta
+    z = max(abs(u_n - mean) - 0.5, 0.0) / math.sqrt(var)
+    return math.erfc(z / math.sqrt(2)), delta
+
+
+def _pct_rank(num, pct):
+    """Nearest rank (1 based) of percentile @pct of @num values"""
+    return max(int(math.ceil(pct / 100.0 * num)), 1)
+
+
+def _resample(vals, cnts, pcts, resamples, rng):
+    """Return, for each of @pcts, a list of the percentile in
+    @resamples bootstrap resamples of the value counts @vals/@cnts"""
+    num = int(sum(cnts))
+    if numpy is not None:
+        draws = rng.multinomial(num, numpy.asarray(cnts) / float(num),
+                                size=resamples)
+        cum = numpy.cumsum(draws, axis=1)
+        vals = numpy.asarray(vals)
+        return [vals[numpy.minimum((cum < _pct_rank(num, pct)).sum(axis=1),
+                                   len(vals) - 1)]
+                for pct in pcts]
+    cum = []
+    tot = 0
+    for cnt in cnts:
+        tot += cnt
+        cum.append(tot)
+    res = [[] for _ in pcts]
+    for _ in range(resamples):
+        draw = [0] * len(vals)
+        for _ in range(num):
+            draw[bisect.bisect_right(cum, rng.random() * num)] += 1
+        seen = 0
+        idx = 0
+        for i, pct in enumerate(pcts):
+            rank = _pct_rank(num, pct)
+            while seen + draw[idx] < rank:
+                seen += draw[idx]
+                idx += 1
+            res[i].append(vals[idx])
+    return res
+
+
+def bootstrap(base, new, pcts=CI_PCTS, resamples=1000, conf=0.95,
+              seed=0):
+    """Bootstrap confidence intervals, at level @conf, for the change
+    of the percentiles @pcts from the value counts @base to @new.
+    Returns a list of (low, high) tuples."""
+    if numpy is not None:
+        rng = numpy.random.RandomState(seed)
+    else:
+        rng = random.Random(seed)
+    res_b = _resample(base[0], base[1], pcts, resamples, rng)
+    res_n = _resample(new[0], new[1], pcts, resamples, rng)
+    lo_pct, hi_pct = 50 * (1 - conf), 50 * (1 + conf)
+    res = []
+    for vals_b, vals_n in zip(res_b, res_n):
+        if numpy is not None:
+            diff = numpy.asarray(vals_n) - numpy.asarray(vals_b)
+            lo, hi = numpy.percentile(diff, [lo_pct, hi_pct])
+        else:
+            diff = sorted(v_n - v_b for v_b, v_n in zip(vals_b, vals_n))
+            lo = diff[int(lo_pct / 100 * (len(diff) - 1))]
+            hi = diff[int(math.ceil(hi_pct / 100 * (len(diff) - 1)))]
+        res.append((float(lo), float(hi)))
+    return res
+
+
+def fdr(pvals):
+    """Return the Benjamini-Hochberg adjusted p-values (q-values) of
+    @pvals"""
+    num = len(pvals)
+    order = sorted(range(num), key=lambda i: pvals[i])
+    res = [1.0] * num
+    qval = 1.0
+    for rank in range(num, 0, -1):
+        i = order[rank - 1]
+        qval = min(qval, pvals[i] * num / rank)
+        res[i] = qval
+    return res
+
+
+def _key_dims(key):
+    """Sort key for an index key"""
+    parts = key.split(':')
+    return parts[:3] + [int(part) for part in parts[3:]]
+
+
+def _rel(old, new):
+    """Relative change from @old to @new in %"""
+    if not old:
+        return 0.0
+    return 100.0 * (new - old) / old
+
+
+class Comparison(object):
+    """Compare the results stores @base and @new.
+
+    @threshold:  Relative change (e.g. 0.05) of a median, 99th
+                 percentile or bandwidth to consider
+    @alpha:      False discovery rate for the sample tests
+    @min_effect: Smallest absolute Cliff's delta to flag
+    @resamples:  Number of bootstrap resamples
+    """
+
+    def __init__(self, base, new, threshold=0.05, alpha=0.01,
+                 min_effect=0.147, resamples=1000, seed=0):
+        self.base = base
+        self.new = new
+        self.threshold = threshold
+        self.alpha = alpha
+        self.min_effect = min_effect
+        self.resamples = resamples
+        self.seed = seed
+        self.lat = []
+        self.bw = []
+        self.only_base = 0
+        self.only_new = 0
+        self.slower = 0
+        self.faster = 0
+
+    @staticmethod
+    def _points(store):
+        """Map the index keys of @store to a (table, row, samples)
+        tuple, preferring rows with samples"""
+        res = {}
+        for key, ents in store.index.items():
+            for table, row in ents:
+                samples = store.samples(table, row)
+                if key not in res or \
+                   (samples is not None and res[key][2] is None):
+                    res[key] = (table, row, samples)
+        return res
+
+    def run(self):
+        """Match and compare the points"""
+        base = self._points(self.base)
+        new = self._points(self.new)
+        self.only_base = len(set(base) - set(new))
+        self.only_new = len(set(new) - set(base))
+
+        # Stores written before the frequency was recorded are assumed
+        # to come from a ME with the frequency of the other side
+        freq_b = self.base.info('freq_hz') or self.new.info('freq_hz')
+        freq_n = self.new.info('freq_hz') or freq_b
+        tested = []
+        for key in sorted(set(base) & set(new), key=_key_dims):
+            tab_b, row_b, smp_b = base[key]
+            tab_n, row_n, smp_n = new[key]
+            vals_b = self.base.row(tab_b, row_b)
+            vals_n = self.new.row(tab_n, row_n)
+            cols = [col[0] for col in self.base.meta['tables'][tab_b]['fmt']
+                    if col[0]]
+            dims = vals_b[:len(DIMS)]
+            if "Gb/s" in cols:
+                col = cols.index("Gb/s")
+                self.bw.append([dims, vals_b[col], vals_n[col]])
+                continue
+            med, p99 = cols.index("Median"), cols.index("99%")
+            ent = [dims, vals_b[med], vals_n[med], vals_b[p99], vals_n[p99],
+                   None, None, None]
+            if smp_b is not None and smp_n is not None and \
+               len(smp_b) and len(smp_n):
+                # samples are in cycles, the Min column in ns
+                cnt_b = value_counts(smp_b)
+                cnt_n = value_counts(smp_n)
+                scale = ns_per_cycle(freq_b, cnt_b, vals_b[len(DIMS)])
+                if freq_b != freq_n:
+                    # different clocks, compare in ns
+                    cnt_b = value_counts(smp_b, scale)
+                    cnt_n = value_counts(smp_n, ns_per_cycle(
+                        freq_n, cnt_n, vals_n[len(DIMS)]))
+                    scale = 1.0
+                pval, ent[5] = mann_whitney(cnt_b, cnt_n)
+                ent[7] = [(lo * scale, hi * scale) for lo, hi in
+                          bootstrap(cnt_b, cnt_n, resamples=self.resamples,
+                                    seed=self.seed)]
+                tested.append((ent, pval))
+            self.lat.append(ent)
+
+        for (ent, _), qval in zip(tested, fdr([pval for _, pval in tested])):
+            ent[6] = qval
+
+        for ent in self.lat:
+            ent.append(self._lat_note(ent))
+        for ent in self.bw:
+            ent.append(self._bw_note(ent))
+        notes = [ent[-1] for ent in self.lat + self.bw]
+        self.slower = notes.count("slower")
+        self.faster = notes.count("faster")
+
+    def _lat_note(self, ent):
+        """Classify a latency comparison"""
+        _, med_b, med_n, p99_b, p99_n, delta, qval, cis = ent
+        thr = 100.0 * self.threshold
+        if delta is None:
+            changes = [_rel(med_b, med_n), _rel(p99_b, p99_n)]
+            if max(changes) > thr:
+                return "slower"
+            if min(changes) < -thr:
+                return "faster"
+            return ""
+        if qval >= self.alpha or abs(delta) < self.min_effect:
+            return ""
+        # the interval of a percentile change must clear the threshold
+        if any(lo > thr / 100 * old
+               for (lo, _), old in zip(cis, [med_b, p99_b])):
+            return "slower"
+        if any(hi < -thr / 100 * old
+               for (_, hi), old in zip(cis, [med_b, p99_b])):
+            return "faster"
+        return ""
+
+    def _bw_note(self, ent):
+        """Classify a bandwidth comparison"""
+        change = _rel(ent[1], ent[2])
+        if change < -100.0 * self.threshold:
+            return "slower"
+        if change > 100.0 * self.threshold:
+            return "faster"
+        return ""
+
+    def write(self, outbase=None, flagged=False):
+        """Write the comparisons (only those flagged if @flagged is
+        set), also to @outbase_lat and @outbase_bw if given"""
+        nan = float('nan')
+        for name, fmt, ents in [("lat", LAT_CMP_FMT, self.lat),
+                                ("bw", BW_CMP_FMT, self.bw)]:
+            if flagged:
+                ents = [ent for ent in ents if ent[-1]]
+            if not ents:
+                continue
+            twr = TableWriter(fmt)
+            if outbase:
+                twr.open("%s_%s" % (outbase, name),
+                         TableWriter.TXT | TableWriter.CSV)
+            twr.sec()
+            for ent in ents:
+                if name == "bw":
+                    dims, old, new, note = ent
+                    twr.out(tuple(dims) + (old, new, _rel(old, new), note))
+                    continue
+                dims, med_b, med_n, p99_b, p99_n, delta, qval, cis, note = ent
+                if delta is None:
+                    delta = qval = nan
+                    cis = [(nan, nan)] * len(CI_PCTS)
+                twr.out(tuple(dims) +
+                        (med_b, med_n, _rel(med_b, med_n),
+                         p99_b, p99_n, _rel(p99_b, p99_n), delta, qval) +
+                        cis[0] + cis[1] + (note,))
+            if outbase:
+                twr.close(TableWriter.TXT | TableWriter.CSV)
@@ -0,0 +1,279 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Running a sweep on several NFPs in parallel.
+
+Each device is run by its own worker process, which opens the device,
+loads the firmware, sets up the DMA buffers and runs its test points.
+The workers share a HostLock (see scheduler.py), so thrashing and
+warming the host caches for a test doesn't overlap with any test of
+another device.  A worker writes the results
+of its device to a store in the 'nfpN' sub-directory of the output
+directory, with one table for the latency and one for the bandwidth
+results, in the order of its points.
+
+Points are spread across the devices in one of two modes:
+
+  same   every device runs all points, to measure the variance from
+         card to card
+  split  the points (in the order of the plan) are cut into one
+         contiguous run per device, balanced by estimated time, to
+         finish the sweep sooner
+
+Once all workers are done, the tables of the spec are written from the
+device stores with an extra 'NFP' column, to the output directory and
+a merged store.  In 'same' mode a table of the spread between the
+cards of each point is added.
+"""
+
+import multiprocessing
+import os
+
+from .debug import err, log
+from .nfpbench import NFPBench
+from .nfpcache import NFPCache
+from .plan import hms
+from .scheduler import HostLock
+from .simdev import SimDevice
+from .store import ResultStore, RESULTS_DIR
+from .sweep import RowBuffer
+from .tablewriter import TableWriter
+from .transport import open_transport
+
+MODE_SAME = "same"
+MODE_SPLIT = "split"
+MODES = [MODE_SAME, MODE_SPLIT]
+
+# Name of the spread table written in 'same' mode
+VARIANCE_TABLE = "card_variance"
+
+VARIANCE_FMT = [("Test", 12, "%s"), ("Cache", 6, "%s"), ("Access", 6, "%s"),
+                ("Win", 8, "%z"), ("Size", 5, "%d"),
+                ("HOff", 4, "%d"), ("DOff", 4, "%d"), ('', 0, ''),
+                ("Metric", 6, "%s"), ("Cards", 5, "%d"),
+                ("Min", 8, "%.2f"), ("Median", 8, "%.2f"),
+                ("Max", 8, "%.2f"), ("Spread%", 7, "%.1f")]
+
+# Column compared across cards, by test kind
+VARIANCE_COLS = {True: "Median", False: "Gb/s"}
+
+
+def dev_dir(outdir, num):
+    """Output directory of device @num"""
+    return os.path.join(outdir, "nfp%d" % num, "")
+
+
+def split(points, count, cost):
+    """Cut @points into @count contiguous runs with about the same
+    total @cost (a function returning the time of a point)"""
+    costs = [cost(pt) for pt in points]
+    total = sum(costs)
+    res = [[] for _ in range(count)]
+    idx = 0
+    acc = 0.0
+    for pt, secs in zip(points, costs):
+        if idx < count - 1 and res[idx] and \
+           acc >= total * (idx + 1) / count:
+            idx += 1
+        res[idx].append(pt)
+        acc += secs
+    return res
+
+
+def run_device(num, points, outdir, opts, lock=None):
+    """Run @points, a list of (test point arguments, keep samples)
+    tuples, on NFP @num and write the results to its store.  @opts is
+    a dictionary of: fwfile, helper, thrash, thrash_cpus, transport,
+    pin, reload_fw, sim, sim_trans and sim_time.  @lock is the
+    HostLock shared with the other workers."""
+    if opts['sim']:
+        trans = opts['sim_trans']
+        kwargs = {'lat_trans': trans, 'bw_trans': trans} if trans else {}
+        # Each simulated card gets its own random numbers
+        transport = SimDevice(num, time_scale=opts['sim_time'], seed=num,
+                              **kwargs)
+        helper, cache = None, None
+    else:
+        transport = open_transport(num, opts['transport'])
+        helper, cache = opts['helper'], NFPCache.open(num)
+    try:
+        nfp = NFPBench(num, opts['fwfile'], helper, transport, cache)
+        log("NFP %d: placement: %s" % (num, nfp.pin(opts['pin'])))
+        nfp.thrash = opts['thrash']
+        nfp.thrash_cpus = opts['thrash_cpus']
+        nfp.host_lock = lock
+        nfp.load_fw(opts['reload_fw'])
+        nfp._set_dma_addrs() # pylint: disable=protected-access
+
+        store = ResultStore(dev_dir(outdir, num) + RESULTS_DIR, create=True)
+        store.set_info('placement', nfp.placement.as_dict())
+        store.set_info('link', nfp.link.as_dict() if nfp.link else None)
+        store.set_info('freq_hz', nfp.freq_hz)
+        tables = {True: store.create_table("lat", NFPBench.lat_fmt, 0),
+                  False: store.create_table("bw", NFPBench.bw_fmt, 0)}
+        buf = RowBuffer()
+        for args, keep in points:
+            is_lat = args[0] in NFPBench.LAT_TESTS
+            if is_lat:
+                nfp.lat_test(buf, *args, keep=keep)
+            else:
+                nfp.bw_test(buf, *args)
+            tables[is_lat].append(buf.rows[-1], buf.samples[-1])
+        for table in tables.values():
+            table.close()
+        store.close()
+        log("NFP %d: ran %d test points" % (num, len(points)))
+    finally:
+        transport.close()
+
+
+def _point_dims(pt):
+    """Return the store dimensions of the spec.Point @pt"""
+    access = "rnd" if pt.flags & NFPBench.FLAGS_RANDOM else "seq"
+    return (NFPBench.TEST_NAMES[pt.test], pt.cache, access, pt.win_sz,
+            pt.trans_sz, pt.h_off, pt.d_off)
+
+
+class Fleet(object):
+    """Runs the Plan @plan on the NFPs @nums in @mode (one of MODES),
+    writing to @outdir.  @opts are passed to run_device()."""
+
+    def __init__(self, plan, nums, mode, outdir, opts):
+        if mode not in MODES:
+            err("Unknown mode %s" % mode)
+        if len(set(nums)) != len(nums):
+            err("Each device can only be listed once")
+        self.plan = plan
+        self.nums = list(nums)
+        self.mode = mode
+        self.outdir = outdir
+        self.opts = opts
+
+        # Points per device, devices per point (by key)
+        if mode == MODE_SAME:
+            runs = [list(plan.order) for _ in self.nums]
+        else:
+            runs = split(plan.order, len(self.nums), plan.model.point)
+        self.points = dict(zip(self.nums, runs))
+        self.owners = {}
+        for num in self.nums:
+            for pt in self.points[num]:
+                self.owners.setdefault(pt.key, []).append(num)
+        self.stores = {}
+        self.rows = {}
+
+    def summary(self):
+        """Return a description of the work per device"""
+        return "\n".join("NFP %d: %d test points, estimated %s" %
+                         (num, len(self.points[num]),
+                          hms(self.plan.model.estimate(self.points[num])))
+                         for num in self.nums)
+
+    def run(self):
+        """Run the workers and wait for them"""
+        lock = HostLock(procs=True)
+        procs = []
+        for num in self.nums:
+            points = [(pt.args(), pt.key in self.plan.keep)
+                      for pt in self.points[num]]
+            proc = multiprocessing.Process(
+                target=run_device, name="nfp%d" % num,
+                args=(num, points, self.outdir, self.opts, lock))
+            proc.start()
+            procs.append((num, proc))
+        failed = []
+        for num, proc in procs:
+            proc.join()
+            if proc.exitcode != 0:
+                failed.append(num)
+        if failed:
+            err("The workers of NFP %s failed" %
+                ", ".join("%d" % num for num in failed))
+
+    def _lookup(self, num, pt):
+        """Return the row and samples of point @pt on device @num"""
+        store = self.stores[num]
+        table, row = self.rows[num][pt.key]
+        return store.row(table, row), store.samples(table, row)
+
+    def merge(self):
+        """Write the tables of the plan, and in 'same' mode the spread
+        between the cards, from the device stores"""
+        self.stores = dict((num, ResultStore(dev_dir(self.outdir, num) +
+                                             RESULTS_DIR))
+                           for num in self.nums)
+        # The workers append the rows in the order of their points.
+        # The index can't be used, it doesn't tell long runs apart.
+        for num in self.nums:
+            count = {True: 0, False: 0}
+            rows = self.rows[num] = {}
+            for pt in self.points[num]:
+                is_lat = pt.is_lat()
+                rows[pt.key] = ("lat" if is_lat else "bw", count[is_lat])
+                count[is_lat] += 1
+        merged = ResultStore(self.outdir + RESULTS_DIR, create=True)
+        merged.set_info('fleet', {'mode': self.mode, 'nfps': self.nums})
+        freqs = set(store.info('freq_hz') for store in self.stores.values())
+        if len(freqs) == 1:
+            merged.set_info('freq_hz', freqs.pop())
+        merged.set_info('devices', dict(
+            ("%d" % num, {'placement': store.info('placement'),
+                          'link': store.info('link')})
+            for num, store in self.stores.items()))
+
+        for table in self.plan.tables:
+            twr = TableWriter(table.fmt + [("NFP", 4, "%d")], stdout=False,
+                              store=merged)
+            twr.open(self.outdir + table.name, TableWriter.ALL)
+            if table.msg:
+                twr.msg(table.msg)
+            for sec in table.sections:
+                twr.sec()
+                for pt in sec.points:
+                    for num in self.owners[pt.key]:
+                        row, samples = self._lookup(num, pt)
+                        twr.out(tuple(row) + (num,),
+                                samples if table.details else None)
+            twr.close(TableWriter.ALL)
+
+        if self.mode == MODE_SAME and len(self.nums) > 1:
+            twr = TableWriter(VARIANCE_FMT, store=merged)
+            twr.open(self.outdir + VARIANCE_TABLE, TableWriter.ALL)
+            twr.msg("\nSpread of the results between the cards\n")
+            twr.sec()
+            self.write_variance(twr)
+            twr.close(TableWriter.ALL)
+
+        merged.close()
+        for store in self.stores.values():
+            store.close()
+
+    def write_variance(self, twr):
+        """Write the spread between the cards of every point to @twr
+        (set up with VARIANCE_FMT)"""
+        for pt in self.plan.order:
+            is_lat = pt.is_lat()
+            metric = VARIANCE_COLS[is_lat]
+            fmt = NFPBench.lat_fmt if is_lat else NFPBench.bw_fmt
+            cols = [col[0] for col in fmt
+                    if not (col[0] == '' and col[1] == 0)]
+            vals = sorted(self._lookup(num, pt)[0][cols.index(metric)]
+                          for num in self.owners[pt.key])
+            mid = len(vals) // 2
+            med = vals[mid] if len(vals) % 2 else \
+                  (vals[mid - 1] + vals[mid]) / 2.0
+            spread = 100.0 * (vals[-1] - vals[0]) / med if med else 0.0
+            twr.out(_point_dims(pt) +
+                    (metric, len(vals), vals[0], med, vals[-1], spread))
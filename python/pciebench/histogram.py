@@ -0,0 +1,255 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""A log-linear (HDR style) histogram for latency values.
+
+Values below 2^@precision are counted exactly.  Above that, each power
+of two range is split into 2^(@precision - 1) equally sized buckets,
+so the relative error of any value reported is bounded by
+2^-(@precision - 1).  With the default precision of 8 this is <0.8%,
+and latencies of up to ~255 cycles are exact.
+
+The number of buckets is small and fixed (a few thousand for 64bit
+values), so histograms are cheap to keep, merge and store, regardless
+of the number of samples recorded.
+"""
+
+import array
+import collections
+import json
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .debug import err
+
+DEFAULT_PRECISION = 8
+
+# Largest value which can be recorded, in bits
+_VALUE_BITS = 64
+
+
+class LogLinearHistogram(object):
+    """A mergeable histogram with bounded relative error"""
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        """Create an empty histogram.  @precision is the number of
+        significant bits kept for each value."""
+        if precision < 2 or precision > 16:
+            err("Histogram precision must be between 2 and 16")
+        self.precision = precision
+        self.sub = 1 << precision
+        self.half = self.sub >> 1
+        nbuckets = self.sub + (_VALUE_BITS - precision) * self.half
+        try:
+            self.counts = array.array('Q', [0]) * nbuckets
+        except ValueError:
+            # Python 2 has no 'Q', 'L' is 64bit on LP64 systems
+            self.counts = array.array('L', [0]) * nbuckets
+        self.total = 0
+        self.vmin = None
+        self.vmax = None
+        return
+
+    def _index(self, val):
+        """Return the bucket index for @val"""
+        if val < self.sub:
+            return val
+        shift = val.bit_length() - self.precision
+        return self.sub + (shift - 1) * self.half + \
+            ((val >> shift) - self.half)
+
+    def _bucket(self, idx):
+        """Return the lowest value and the width of bucket @idx"""
+        if idx < self.sub:
+            return idx, 1
+        shift = (idx - self.sub) // self.half + 1
+        top = (idx - self.sub) % self.half + self.half
+        return top << shift, 1 << shift
+
+    def _value(self, idx):
+        """Return a representative value for bucket @idx: the middle
+        of the bucket, clamped to the values seen"""
+        low, width = self._bucket(idx)
+        val = low + (width >> 1)
+        return max(self.vmin, min(self.vmax, val))
+
+    def _update_range(self, vmin, vmax):
+        """Update the minimum and maximum value seen"""
+        self.vmin = vmin if self.vmin is None else min(self.vmin, vmin)
+        self.vmax = vmax if self.vmax is None else max(self.vmax, vmax)
+
+    def record(self, val, count=1):
+        """Record @count occurrences of the (non-negative integer) @val"""
+        val = int(val)
+        self.counts[self._index(val)] += count
+        self.total += count
+        self._update_range(val, val)
+
+    def record_values(self, vals):
+        """Record all values from the list/array @vals in one pass.  If
+        @vals is a NumPy array the work is fully vectorised, otherwise
+        the distinct values are counted first."""
+        if not len(vals):
+            return
+        if numpy is not None and isinstance(vals, numpy.ndarray):
+            self._record_numpy(vals)
+            return
+        for val, count in collections.Counter(vals).items():
+            self.counts[self._index(int(val))] += count
+        self.total += len(vals)
+        self._update_range(int(min(vals)), int(max(vals)))
+
+    def _record_numpy(self, vals):
+        """Vectorised version of record_values()"""
+        vals = vals.astype(numpy.uint64, copy=False)
+        bits = numpy.zeros(len(vals), dtype=numpy.int64)
+        # bit_length() for the values above the linear range.  frexp()
+        # is exact for values which fit the float mantissa.
+        big = vals >= self.sub
+        if big.any():
+            _, bits[big] = numpy.frexp(vals[big].astype(numpy.float64))
+        shift = numpy.maximum(bits - self.precision, 0)
+        idx = numpy.where(
+            big,
+            self.sub + (shift - 1) * self.half +
+            ((vals >> shift.astype(numpy.uint64)).astype(numpy.int64) -
+             self.half),
+            vals.astype(numpy.int64))
+        binned = numpy.bincount(idx, minlength=len(self.counts))
+        for i in numpy.nonzero(binned)[0]:
+            self.counts[int(i)] += int(binned[i])
+        self.total += len(vals)
+        self._update_range(int(vals.min()), int(vals.max()))
+
+    def merge(self, other):
+        """Add the counts of histogram @other to this histogram"""
+        if other.precision != self.precision:
+            err("Can't merge histograms with different precision")
+        if not other.total:
+            return self
+        for idx, count in enumerate(other.counts):
+            if count:
+                self.counts[idx] += count
+        self.total += other.total
+        self._update_range(other.vmin, other.vmax)
+        return self
+
+    def _buckets(self):
+        """Yield (index, count) for all non-empty buckets in order"""
+        for idx, count in enumerate(self.counts):
+            if count:
+                yield idx, count
+
+    def min(self):
+        """Return the smallest value recorded"""
+        return self.vmin if self.total else 0
+
+    def max(self):
+        """Return the largest value recorded"""
+        return self.vmax if self.total else 0
+
+    def avg(self):
+        """Return the (approximate) average of the values recorded"""
+        if not self.total:
+            return 0.0
+        acc = 0
+        for idx, count in self._buckets():
+            acc += self._value(idx) * count
+        return float(acc) / self.total
+
+    def percentiles(self, pcts):
+        """Return a list of values for the list of percentiles @pcts
+        (in the range 0-100) in one pass over the buckets"""
+        if not self.total:
+            return [0 for _ in pcts]
+        order = sorted(range(len(pcts)), key=lambda i: pcts[i])
+        res = [0] * len(pcts)
+        pos = 0
+        acc = 0
+        for idx, count in self._buckets():
+            acc += count
+            while pos < len(order) and \
+                  acc >= pcts[order[pos]] / 100.0 * self.total:
+                res[order[pos]] = self._value(idx)
+                pos += 1
+            if pos == len(order):
+                break
+        for i in order[pos:]:
+            res[i] = self.vmax
+        return res
+
+    def percentile(self, pct):
+        """Return the value at percentile @pct (in the range 0-100)"""
+        return self.percentiles([pct])[0]
+
+    def median(self):
+        """Return the median"""
+        return self.percentile(50)
+
+    def histo(self):
+        """Return a dictionary with representative values as keys and
+        the number of occurrences as values (see ListStats.histo())"""
+        res = {}
+        for idx, count in self._buckets():
+            res[self._value(idx)] = count
+        return res
+
+    def cdf(self):
+        """Return a dictionary with representative values as keys and
+        the CDF as values, in the range of 0-1.0 (see histo2cdf())"""
+        res = {}
+        acc = 0
+        for idx, count in self._buckets():
+            acc += count
+            res[self._value(idx)] = float(acc) / self.total
+        return res
+
+    def to_dict(self):
+        """Return a JSON serialisable representation"""
+        return {'precision': self.precision,
+                'total': self.total,
+                'min': self.vmin,
+                'max': self.vmax,
+                'counts': [[idx, count] for idx, count in self._buckets()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a histogram from the output of to_dict()"""
+        hist = cls(data['precision'])
+        for idx, count in data['counts']:
+            hist.counts[idx] = count
+        hist.total = data['total']
+        hist.vmin = data['min']
+        hist.vmax = data['max']
+        return hist
+
+
+def save_histograms(path, hists):
+    """Save a dictionary of named histograms to the file @path"""
+    with open(path, 'w') as outf:
+        json.dump(dict((name, hist.to_dict()) for name, hist in hists.items()),
+                  outf, sort_keys=True)
+
+
+def load_histograms(path):
+    """Load a dictionary of named histograms saved with
+    save_histograms()"""
+    with open(path, 'r') as inf:
+        data = json.load(inf)
+    return dict((name, LogLinearHistogram.from_dict(hist))
+                for name, hist in data.items())
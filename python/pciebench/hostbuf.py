@@ -0,0 +1,151 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Access to the host DMA buffers exported by the kernel module.
+
+The kernel module exports the buffers as /proc/pciebench_buffer-N.  If
+the module supports it, the file is mmap()ed and the buffer accessed
+directly.  Otherwise (older modules) every access goes through read()
+and write() on the procfs file.
+
+Any regular file of the right size works as a stand-in for the procfs
+file, e.g. the one created by the simulated device (see simdev.py).
+"""
+
+import mmap
+import os
+import struct
+
+from .debug import err, dbg
+
+PROC_BUF_SZ = "%s/pciebench_buf_sz-%d"
+PROC_BUFFER = "%s/pciebench_buffer-%d"
+
+PAGE_SZ = 4096
+
+# Pattern written when warming the cache (as the C helper does)
+WARM_PATTERN = 0xf00d0001
+WARM_PASSES = 4
+
+
+def _pattern(word, length):
+    """Return @length bytes of the little endian 32bit @word repeated"""
+    page = struct.pack('<I', word) * (PAGE_SZ // 4)
+    num = (length - 1) // PAGE_SZ + 1
+    return (page * num)[:length]
+
+
+class HostBuffer(object):
+    """The host buffer of NFP @nfp_num.  The procfs files are looked
+    for in @procdir.  If @use_mmap is False, or the buffer can't be
+    mapped, procfs read()/write() is used instead."""
+
+    def __init__(self, nfp_num=0, procdir="/proc", use_mmap=True):
+        self.nfp_num = nfp_num
+        self.path = PROC_BUFFER % (procdir, nfp_num)
+
+        with open(PROC_BUF_SZ % (procdir, nfp_num), 'r') as inf:
+            self.size = int(inf.read().strip(), 0)
+
+        self.fd = os.open(self.path, os.O_RDWR)
+        self.mem = None
+        if use_mmap:
+            try:
+                self.mem = mmap.mmap(self.fd, self.size, mmap.MAP_SHARED,
+                                     mmap.PROT_READ | mmap.PROT_WRITE)
+            except (mmap.error, OSError, ValueError) as exc:
+                dbg("Can't mmap %s (%s), using read/write" % (self.path, exc))
+        dbg("Host buffer %s: %d bytes, %s" %
+            (self.path, self.size, "mmap" if self.mem else "procfs"))
+
+    @property
+    def mapped(self):
+        """True if the buffer is accessed through mmap"""
+        return self.mem is not None
+
+    def _range(self, offset, length):
+        """Check and return the range @offset, @length (None: the rest
+        of the buffer)"""
+        if length is None:
+            length = self.size - offset
+        if offset < 0 or length < 0 or offset + length > self.size:
+            err("Host buffer access %d+%d out of range (size %d)" %
+                (offset, length, self.size))
+        return offset, length
+
+    def read(self, offset=0, length=None):
+        """Return @length bytes from @offset"""
+        offset, length = self._range(offset, length)
+        if self.mem is not None:
+            return self.mem[offset:offset + length]
+        os.lseek(self.fd, offset, os.SEEK_SET)
+        res = bytearray()
+        while len(res) < length:
+            data = os.read(self.fd, length - len(res))
+            if not data:
+                err("Short read from %s" % self.path)
+            res += data
+        return bytes(res)
+
+    def write(self, data, offset=0):
+        """Write the bytes like object @data at @offset"""
+        offset, length = self._range(offset, len(data))
+        if self.mem is not None:
+            self.mem[offset:offset + length] = data
+            return
+        data = memoryview(data)
+        os.lseek(self.fd, offset, os.SEEK_SET)
+        pos = 0
+        while pos < length:
+            pos += os.write(self.fd, data[pos:])
+
+    def fill(self, word, offset=0, length=None):
+        """Fill @length bytes at @offset with the 32bit @word"""
+        offset, length = self._range(offset, length)
+        self.write(_pattern(word, length), offset)
+
+    def verify(self, word, offset=0, length=None):
+        """Check that @length bytes at @offset contain the 32bit @word.
+        Returns the offset of the first mismatching byte or -1."""
+        offset, length = self._range(offset, length)
+        data = self.read(offset, length)
+        expect = _pattern(word, length)
+        if data == expect:
+            return -1
+        for idx in range(0, length, PAGE_SZ):
+            if data[idx:idx + PAGE_SZ] != expect[idx:idx + PAGE_SZ]:
+                for pos in range(idx, min(idx + PAGE_SZ, length)):
+                    if data[pos] != expect[pos]:
+                        return offset + pos
+        return -1
+
+    def warm(self, win_sz, passes=WARM_PASSES):
+        """Warm the host caches with the first @win_sz bytes of the
+        buffer (rounded up to a full page) by writing to them @passes
+        times"""
+        length = ((int(win_sz) - 1) // PAGE_SZ + 1) * PAGE_SZ
+        length = min(length, self.size)
+        data = _pattern(WARM_PATTERN, length)
+        for _ in range(passes):
+            self.write(data)
+
+    def close(self):
+        """Unmap and close the buffer"""
+        if self.mem is not None:
+            self.mem.close()
+            self.mem = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
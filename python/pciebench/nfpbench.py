@@ -15,18 +15,33 @@
 
 """Main functions/class to control the NFP ME firmware"""
 
-import subprocess
+import array
 import struct
 import math
+import re
+import subprocess
+import sys
 import time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from .stats import ListStats
 from .debug import err, warn, dbg, trc, log
+from .transport import open_transport, _exec_cmd
+from .checkpoint import point_key, file_hash, host_fingerprint
+from .hostbuf import HostBuffer
+from .results import decode
+from .pcie import PCIeModel, link_config, BW_RD, BW_WR, BW_RW
+from .numa import Placement, place, set_affinity
+from .trace import span, add_span, traced
 
 # procfs files exported by the kernel module
-_PROC_DMA_ADDRS = "/proc/pciebench_dma_addrs-%d"
-_PROC_BUF_SZ = "/proc/pciebench_buf_sz-%d"
-_PROC_BUFFER = "/proc/pciebench_buffer-%d"
+# (relative to the procfs directory of the transport)
+_PROC_DMA_ADDRS = "%s/pciebench_dma_addrs-%d"
+_PROC_BUF_SZ = "%s/pciebench_buf_sz-%d"
 
 # Symbol names for interacting with the FW
 _NFP6000_ME_TEST_CTRL = "i32._test_ctrl"
@@ -50,62 +65,101 @@ _TEST_JOURNAL = None
 # Firmware image name
 FW_FILE = "./pciebench.fw"
 
-
-def _exec_cmd(cmd):
-    """Execute a command and return a tuple of return code and output"""
+# Number of journal entries read at a time by NFPBench.iter_journal()
+JOURNAL_CHUNK = 1024 * 1024
+
+# Timing report printed by the C helper
+_HELPER_REPORT = re.compile(r'^helper: (.*)$', re.M)
+
+# Printed by the C helper (with -R) once the host caches are set up,
+# it then waits for a line on stdin before starting the test
+_HELPER_READY = b"helper: ready"
+
+# Four zero bytes, possibly a null journal entry
+_NULL_WORD = re.compile(b'\0\0\0\0')
+
+
+def _decode_words(mem, as_numpy=False):
+    """Decode little endian 32bit words from the bytes like object
+    @mem.  Returns an array('I') or, if @as_numpy is set, a NumPy
+    array sharing the memory of @mem."""
+    if as_numpy:
+        if numpy is None:
+            err("NumPy is not available")
+        return numpy.frombuffer(mem, dtype='<u4')
+    res = array.array('I')
+    if hasattr(res, 'frombytes'):
+        res.frombytes(mem)
+    else:
+        # Python 2, fromstring() only takes strings
+        res.fromstring(memoryview(mem).tobytes())
+    if sys.byteorder == 'big':
+        res.byteswap()
+    return res
+
+
+def _exec_helper(cmd, ready):
+    """Execute the C helper command @cmd, which includes -R, and
+    return a tuple of return code and output, as _exec_cmd().  ready()
+    is called as soon as the helper reports that the host caches are
+    set up, the helper starts the test once it returns."""
     trc(cmd)
     print(cmd)
     proc = subprocess.Popen(cmd, bufsize=16384, shell=True, close_fds=True,
                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE)
-
-    # wait for process to terminate
+    out = b""
+    for line in iter(proc.stdout.readline, b""):
+        if line.rstrip() == _HELPER_READY:
+            ready()
+            proc.stdin.write(b"go\n")
+            proc.stdin.flush()
+            break
+        out += line
     res_data, _ = proc.communicate(None)
-    ret = proc.returncode
-
-    return ret, res_data
-
-# Utility functions
-# We have pretty good python support for accessing the NFP, but these
-# are part of other packages.  Below we define a number of functions
-# which are deliberately simple and cut corners in order to reduce
-# dependencies on other package.
-
-def _get_hwinfo(nfp_num):
-    """Execute nfp-hwinfo and return the result as a dictionary"""
-    ret = {}
-    _, out = _exec_cmd("/opt/netronome/bin/nfp-hwinfo -n %d" % nfp_num)
-    out = out.decode('ascii')
-    lines = out.split('\n')
-    for line in lines:
-        line = line.strip()
-        key, _, val = line.partition("=")
-        ret[key] = val
-
-    return ret
-
-class _Symbol(object):
-    """A struct, really"""
-    def __init__(self, off, size):
-        self.off = off
-        self.size = size
-        return
+    return proc.returncode, out + res_data
+
+
+def _count_nulls(vals):
+    """Count the 0 entries in an array('I') or NumPy array"""
+    if numpy is not None and isinstance(vals, numpy.ndarray):
+        return len(vals) - int(numpy.count_nonzero(vals))
+    # Without NumPy, screen the raw buffer for four consecutive zero
+    # bytes first.  This avoids a per-entry loop in the common case
+    # of a journal without null entries.
+    if not _NULL_WORD.search(vals):
+        return 0
+    return vals.count(0)
+
 
 class NFPBench(object):
     """A class to interact the pciebench firmware"""
 
     # Tests (Keep this in sync with enum pciebench_tests in pciebench.h)
+    LAT_CMD_RD = 1
+    LAT_CMD_WRRD = 2
+    LAT_DMA_RD = 3
+    LAT_DMA_WRRD = 4
     BW_DMA_RD = 5
     BW_DMA_WR = 6
     BW_DMA_RW = 7
 
     TESTS = [BW_DMA_RD, BW_DMA_WR, BW_DMA_RW]
-
-    TEST_NAMES = {BW_DMA_RD : "BW_DMA_RD",
+    BW_TESTS = TESTS
+    LAT_TESTS = [LAT_CMD_RD, LAT_CMD_WRRD, LAT_DMA_RD, LAT_DMA_WRRD]
+
+    TEST_NAMES = {LAT_CMD_RD : "LAT_CMD_RD",
+                  LAT_CMD_WRRD : "LAT_CMD_WRRD",
+                  LAT_DMA_RD : "LAT_DMA_RD",
+                  LAT_DMA_WRRD : "LAT_DMA_WRRD",
+                  BW_DMA_RD : "BW_DMA_RD",
                   BW_DMA_WR : "BW_DMA_WR",
                   BW_DMA_RW : "BW_DMA_RW",
                   }
 
+    # Maximum transfer size for PCIe commands (PCIEBENCH_MAX_CMD_SZ)
+    MAX_CMD_SZ = 64
+
     # Test flags
     FLAGS_WARM = 1 << 0       # Try to warm the window from the device
     FLAGS_THRASH = 1 << 1     # Try to thrash the cache from the device
@@ -116,12 +170,43 @@ class NFPBench(object):
             FLAGS_LONG | FLAGS_HOSTWARM
     _FLAGS_CACHE = FLAGS_WARM | FLAGS_THRASH | FLAGS_HOSTWARM
 
-    def __init__(self, nfp_num=0, fwfile=None, helper=None):
+    # TableWriter formats for the latency and bandwidth tests
+    lat_fmt = [("Test", 12, "%s"), ("Cache", 6, "%s"), ("Access", 6, "%s"),
+               ("Win", 8, "%z"), ("Size", 5, "%d"),
+               ("HOff", 4, "%d"), ("DOff", 4, "%d"), ('', 0, ''),
+               ("Min", 7, "%.0f"), ("Avg", 7, "%.0f"), ("Median", 7, "%.0f"),
+               ("95%", 7, "%.0f"), ("99%", 7, "%.0f"), ("Max", 8, "%.0f")]
+
+    bw_fmt = [("Test", 12, "%s"), ("Cache", 6, "%s"), ("Access", 6, "%s"),
+              ("Win", 8, "%z"), ("Size", 5, "%d"),
+              ("HOff", 4, "%d"), ("DOff", 4, "%d"), ('', 0, ''),
+              ("Trans", 9, "%d"), ("Time", 9, "%t"),
+              ("Gb/s", 7, "%.2f"), ("Mtps", 7, "%.2f"), ("Eff%", 5, "%.1f")]
+
+    # Cache thrash modes of the C helper (-T)
+    THRASH_FAST = "fast"
+    THRASH_LEGACY = "legacy"
+    THRASH_NONE = "none"
+    THRASH_MODES = [THRASH_FAST, THRASH_LEGACY, THRASH_NONE]
+
+    # Direction of the bandwidth tests in the PCIe model
+    PCIE_DIRS = {BW_DMA_RD : BW_RD,
+                 BW_DMA_WR : BW_WR,
+                 BW_DMA_RW : BW_RW,
+                 }
+
+    def __init__(self, nfp_num=0, fwfile=None, helper=None, transport=None,
+                 cache=None):
         """Initialise the class
 
         @nfp_num    NFP device number
         @fwfile     Path to firmware
         @helper     Optional path to a C helper program
+        @transport  Optional Transport object used to access the NFP.
+                    By default libnfp is used if available, nfp-rtsym
+                    otherwise.
+        @cache      Optional NFPCache for the hardware information,
+                    symbol table and firmware state (see load_fw())
         """
 
         global _ME_TEST_CTRL
@@ -132,11 +217,31 @@ class NFPBench(object):
 
         self.nfp_num = nfp_num
 
-        self.hwinfo = _get_hwinfo(self.nfp_num)
+        if transport is None:
+            transport = open_transport(self.nfp_num)
+        self.transport = transport
+        self.cache = cache
+
+        self.hwinfo = cache.hwinfo() if cache else None
+        if self.hwinfo is None:
+            self.hwinfo = self.transport.hwinfo()
+            if cache:
+                cache.set_hwinfo(self.hwinfo)
         self.freq_mhz = int(self.hwinfo['me.speed'])
         self.freq_hz = self.freq_mhz * 1000 * 1000
 
-	self.nfp6000 = True
+        # The PCIe link, to compare the bandwidth achieved with a
+        # model of what the link allows
+        self.link = self.transport.pcie_link() or link_config(nfp_num)
+        self.pcie = PCIeModel(self.link) if self.link else None
+        if self.link:
+            log("PCIe link: %s" % self.link)
+            if self.link.degraded():
+                warn("The PCIe link of the NFP is degraded: %s" % self.link)
+        else:
+            warn("Can't determine the PCIe link, no bandwidth efficiency")
+
+        self.nfp6000 = True
         #self.nfp6000 = self.hwinfo["chip.model"].startswith("NFP6") or \
         #               self.hwinfo["chip.model"].startswith("NFP4")
 
@@ -152,81 +257,174 @@ class NFPBench(object):
             self.fw_name = FW_FILE
 
         self.helper = helper
+        # How the helper thrashes the host cache before each test, and
+        # from which CPUs (a cpulist, default: the pinned CPUs)
+        self.thrash = self.THRASH_FAST
+        self.thrash_cpus = None
 
         self.symtab = {}
+
+        # Optional Checkpoint object to record completed test points
+        self.checkpoint = None
+        self.hostbuf = None
+        self.store = None
+
+        # Where the host side runs, see pin()
+        self.placement = None
+
+        # HostLock shared with the NFPBench objects of other devices
+        # run concurrently on this host (see scheduler.py)
+        self.host_lock = None
         return
 
+    def fingerprint(self):
+        """Return a dictionary identifying the firmware, the NFP and
+        the host.  Results are only comparable with matching
+        fingerprints."""
+        return {'fw': file_hash(self.fw_name),
+                'nfp': dict((key, self.hwinfo.get(key)) for key in
+                            ['chip.model', 'assembly.serial', 'me.speed']),
+                'host': host_fingerprint(),
+                'link': self.link.as_dict() if self.link else None,
+                'placement': self.placement.as_dict() if self.placement
+                             else None}
+
+    def pin(self, mode):
+        """Run the host side of the tests (this process, the helper and
+        its cache thrashing threads) on the CPUs selected by @mode: the
+        NFP's node, a remote node or a node number (see numa.place()).
+        Returns the Placement."""
+        placement = place(self.nfp_num, mode)
+        if not set_affinity(placement):
+            placement = Placement(placement.mode, placement.nfp_node)
+        self.placement = placement
+        return placement
+
+    def _replay(self, twr, key):
+        """If test point @key was completed by a previous run, write
+        its result (and raw samples, if they were kept) to @twr.
+        Returns the checkpoint record and the samples."""
+        if not self.checkpoint:
+            return None, None
+        rec = self.checkpoint.get(key)
+        samples = None
+        if rec:
+            dbg("Skipping completed test point %s" % key)
+            samples = self.checkpoint.samples(rec)
+            twr.out(tuple(rec['row']), samples)
+        return rec, samples
+
     def cyc2ns(self, cycles):
         """Convert ME cycles to nanosecods"""
         return float(cycles) *  (1000 * 1000 * 1000) / self.freq_hz
 
-    def _sym_write(self, sym, val):
-        """Write value(s) to symbol"""
-        _, _ = _exec_cmd("/opt/netronome/bin/nfp-rtsym -n %d %s %s" % (self.nfp_num, sym, val))
+    def _sym_write(self, sym, vals):
+        """Write a list of 32bit value(s) to symbol"""
+        self.transport.write(sym, vals)
         return
 
-    def _sym_read(self, sym, length=None):
-        """Write value(s) to symbol"""
-        if length:
-            _, res_data = _exec_cmd("/opt/netronome/bin/nfp-rtsym -n %d -l %d -R %s" %
-                                    (self.nfp_num, length, sym))
-        else:
-            _, res_data = _exec_cmd("/opt/netronome/bin/nfp-rtsym -n %d -R %s" %
-                                    (self.nfp_num, sym))
-        return res_data
+    def _sym_read(self, sym, length=None, offset=0):
+        """Read @length bytes (default: all) from symbol, starting at
+        byte @offset"""
+        return self.transport.read(sym, length, offset)
 
+    @traced
     def _reload_fw(self):
         "Re-load the firmware image"
-        subprocess.call("/opt/netronome/bin/nfp-nffw unload -n %d --ignore-debugger 2> /dev/null" %
-                        self.nfp_num, shell=True)
-        subprocess.call("/opt/netronome/bin/nfp-nffw %s load -n %d --ignore-debugger" %
-                        (self.fw_name, self.nfp_num), shell=True)
+        self.transport.unload_fw()
+        self.transport.load_fw(self.fw_name)
+        self.symtab = {}
 
         self._get_symtab()
         return
 
+    @traced
+    def load_fw(self, force=False):
+        """Make sure the firmware is loaded.  With a cache, a reload is
+        skipped if the same firmware image was the last one loaded
+        since boot, its symbols are found on the device where the
+        cached symbol table has them and it is idle (the test control
+        is 0).  The symbol table is then taken from the cache too.
+        @force always reloads the firmware."""
+        fw_hash = file_hash(self.fw_name) if self.cache else None
+        if fw_hash and not force and self.cache.fw_loaded(fw_hash):
+            symtab = self.cache.symbols(fw_hash)
+            if symtab:
+                self.transport.symtab = symtab
+            self.symtab = {}
+            self._get_symtab()
+            try:
+                on_dev = self._fw_on_device()
+                idle = on_dev and self._get_test_ctrl() == 0
+            except Exception: # pylint: disable=broad-except
+                on_dev = idle = False
+            if idle:
+                log("Firmware %s already loaded, not reloading" %
+                    self.fw_name)
+                if not symtab:
+                    self.cache.set_symbols(fw_hash, self.symtab)
+                return
+            if on_dev:
+                dbg("Firmware %s loaded but not idle, reloading" %
+                    self.fw_name)
+            else:
+                dbg("Firmware %s not found on the NFP, reloading" %
+                    self.fw_name)
+
+        if fw_hash:
+            # A failed load must not leave the old state behind
+            self.cache.set_fw_loaded(None)
+        self._reload_fw()
+        if fw_hash:
+            self.cache.set_symbols(fw_hash, self.symtab)
+            self.cache.set_fw_loaded(fw_hash)
+        return
+
+    def _fw_on_device(self):
+        """True if the symbols used are found on the device (not in a
+        cache) with the addresses and sizes of the symbol table"""
+        for name in [_ME_TEST_CTRL, _ME_TEST_PARAMS, _ME_TEST_RESULT,
+                     _ME_DMA_ADDRS, _TEST_JOURNAL]:
+            sym = self.symtab.get(name)
+            live = self.transport.lookup(name)
+            if not sym or not live or \
+               (sym.off, sym.size) != (live.off, live.size):
+                return False
+        return True
+
     def _get_symtab(self):
-        """Extract some details from the symbol table from a fw file and
-        return a dict, indexed by name and containing _Symbol objects"""
+        """Extract some details from the symbol table from the loaded fw
+        and store it in a dict, indexed by name and containing Symbol
+        objects"""
 
         # No need to re-read the symbol table on every FW load.
         if len(self.symtab):
             return
-        _, out = _exec_cmd("/opt/netronome/bin/nfp-rtsym -n %d -L" % self.nfp_num)
-        out = out.decode('ascii')
-        for line in out.split("\n"):
-            elems = line.split()
-            if len(elems) == 0:
-                continue
-            if elems[0] == "Name":
-                continue
-            name = elems[0].strip()
-            off = int(elems[2], 16)
-            size = int(elems[3], 16)
-            trc("%s 0x%08x 0x%08x" % (name, off, size))
-            self.symtab[name] = _Symbol(off, size)
+        self.symtab = self.transport.symbols()
         return
 
+    @traced
     def _set_dma_addrs(self):
         """The kernel module exports a list of memory regions to be
         accessed by the NFP.  Read the list, validate it and write it
         to the NFP."""
         dma_addrs = []
 
-        dbg("Using: %s" % (_PROC_DMA_ADDRS % self.nfp_num))
-        inf = open(_PROC_DMA_ADDRS % self.nfp_num, 'r')
+        procdir = self.transport.procdir
+        dbg("Using: %s" % (_PROC_DMA_ADDRS % (procdir, self.nfp_num)))
+        inf = open(_PROC_DMA_ADDRS % (procdir, self.nfp_num), 'r')
         for line in inf:
             addr = int(line, 0)
             dma_addrs.append(addr)
         inf.close()
-        inf = open(_PROC_BUF_SZ % self.nfp_num, 'r')
+        inf = open(_PROC_BUF_SZ % (procdir, self.nfp_num), 'r')
         for line in inf:
             buf_sz = int(line)
         inf.close()
 
         # Sanity check (and debug)
         # The ME code makes some assumptions which we check here
-        chunk_sz = buf_sz / len(dma_addrs)
+        chunk_sz = buf_sz // len(dma_addrs)
         dbg("buf_sz=0x%x chunks=%d chunk_sz=0x%x" %
             (buf_sz, len(dma_addrs), chunk_sz))
         dbg("DMA addresses:")
@@ -242,33 +440,33 @@ class NFPBench(object):
                     start)
 
         loc_sym = self.symtab[_ME_DMA_ADDRS]
-        entries = loc_sym.size / 8 # entries are 64bit
+        entries = loc_sym.size // 8 # entries are 64bit
         nfp_addr = loc_sym.off
 
         entries = int(min(entries, len(dma_addrs)))
 
-        val = ""
+        val = []
         for entry in range(0, entries):
-            val += " 0x%x 0x%x" % (dma_addrs[entry] >> 32,
-                                  dma_addrs[entry] & 0xffffffff)
+            val += [dma_addrs[entry] >> 32, dma_addrs[entry] & 0xffffffff]
             trc("Write DMA address 0x%x to 0x%x" %
                 (dma_addrs[entry], nfp_addr))
         self._sym_write(_ME_DMA_ADDRS, val)
         return
 
+    @traced
     def _set_params(self, pm0, pm1, pm2, pm3, pm4):
         """Write the test parameters to the device"""
         loc_sym = self.symtab[_ME_TEST_PARAMS]
-        val = "0x%x 0x%x 0x%x 0x%x 0x%x" % (pm0, pm1, pm2, pm3, pm4)
-        trc("Write params to 0x%x -> %d %d %d %d %d (%s)" %
-            (loc_sym.off, pm0, pm1, pm2, pm3, pm4, val))
+        val = [int(pm0), int(pm1), int(pm2), int(pm3), int(pm4)]
+        trc("Write params to 0x%x -> %d %d %d %d %d" %
+            (loc_sym.off, pm0, pm1, pm2, pm3, pm4))
         self._sym_write(_ME_TEST_PARAMS, val)
         return
 
     def _set_test_ctrl(self, ctrl):
         """Write the test control to device"""
         loc_sym = self.symtab[_ME_TEST_CTRL]
-        val = "0x%x" % ctrl
+        val = [ctrl & 0xffffffff]
         trc("Write test control to 0x%x" % loc_sym.off)
         self._sym_write(_ME_TEST_CTRL, val)
         return
@@ -279,19 +477,20 @@ class NFPBench(object):
         mem = self._sym_read(_ME_TEST_CTRL)
         # the symbol can be 8B or 4B depending where it is located
         if loc_sym.size == 8:
-            res = struct.unpack('ii', mem)
+            res = struct.unpack('<ii', mem[:8])
         else:
-            res = struct.unpack('i', mem)
-        trc("Test Control: %s" % res)
+            res = struct.unpack('<i', mem[:4])
+        trc("Test Control: %s" % (res,))
         return res[0]
 
+    @traced
     def _get_result(self):
         """Get the result from the device
         returns time difference (in ME cycles) and a tuple of test results"""
         loc_sym = self.symtab[_ME_TEST_RESULT]
         mem = self._sym_read(_ME_TEST_RESULT)
 
-        tmp = struct.unpack('<%uIc' % (loc_sym.size / 4), mem)
+        tmp = struct.unpack('<%uI' % (loc_sym.size // 4), mem)
         trc("Test result: %s" % ' '.join([str(i) for i in tmp]))
         # first four words are time stamp
         start = (tmp[0] << 32) + tmp[1]
@@ -300,40 +499,151 @@ class NFPBench(object):
 
         return diff, [tmp[4], tmp[5], tmp[6], tmp[7]]
 
-    def _read_journal(self, name, count=None):
+    def _read_journal(self, name, count=None, offset=0, as_numpy=False):
         """The ME code maintains two journals, one for test data and
         one fro debug purposes.  This internal functions reads up to
-        @count values from the journal called @name.  If @count is
-        None, the whole journal is returned."""
+        @count values from the journal called @name, starting at entry
+        @offset.  If @count is None, the rest of the journal is
+        returned.
+
+        The values are returned as an array('I') or, with @as_numpy,
+        as a NumPy array sharing the memory of the data read."""
 
         loc_sym = self.symtab[name]
 
+        max_cnt = loc_sym.size - offset * 4
         if count == None:
-            byte_cnt = loc_sym.size
+            byte_cnt = max_cnt
         else:
-            byte_cnt = min(loc_sym.size, count * 4)
+            byte_cnt = min(max_cnt, count * 4)
 
-        mem = self._sym_read(name, byte_cnt)
-        res = struct.unpack('<%uIc' % (byte_cnt / 4), mem)
-        return res[:-1]
+        mem = self._sym_read(name, byte_cnt, offset * 4)
+        return _decode_words(mem, as_numpy)
 
-    def get_journal(self, count=None, nullcheck=False):
+    @traced
+    def get_journal(self, count=None, nullcheck=False, as_numpy=False):
         """Some tests uses a journal to store extra data.  This method
-        reads that journal and returns a tuple of 32bit values up to
+        reads that journal and returns an array of 32bit values up to
         @count if specified. If you expect the journal to be full and
-        don't expect 0 values, use @nullcheck"""
+        don't expect 0 values, use @nullcheck.
 
-        res = self._read_journal(_TEST_JOURNAL, count)
+        By default an array('I') is returned.  Set @as_numpy to get a
+        NumPy array instead (requires NumPy)."""
+
+        res = self._read_journal(_TEST_JOURNAL, count, 0, as_numpy)
 
         if nullcheck:
-            nullcount = 0
-            for i in res:
-                if i == 0:
-                    nullcount += 1
+            nullcount = _count_nulls(res)
             if not nullcount == 0:
                 warn("journal countains %d null entries" % nullcount)
         return res
 
+    def iter_journal(self, count=None, chunk=JOURNAL_CHUNK, as_numpy=False):
+        """Read the journal in chunks of @chunk entries, up to @count
+        entries in total, and yield an array (see @get_journal()) for
+        each chunk.  This keeps memory use bounded and allows
+        processing to start before the whole journal has been read.
+
+        If the transport can't read at an offset without reading
+        everything before it (nfp-rtsym), the entries are read in one
+        go and only the decoding is done in chunks."""
+        total = self.symtab[_TEST_JOURNAL].size // 4
+        if count is not None:
+            total = min(total, count)
+        mem = None
+        if not self.transport.offset_reads:
+            mem = memoryview(self._sym_read(_TEST_JOURNAL, total * 4))
+        offset = 0
+        while offset < total:
+            num = min(chunk, total - offset)
+            if mem is None:
+                yield self._read_journal(_TEST_JOURNAL, num, offset,
+                                         as_numpy)
+            else:
+                yield _decode_words(mem[offset * 4:(offset + num) * 4],
+                                    as_numpy)
+            offset += num
+
+    @traced
+    def _warm_host(self, win_sz):
+        """Warm the host buffers for a window of @win_sz bytes by
+        writing to them, like the C helper does.  The window size is
+        rounded up to the nearest full page."""
+        if self.hostbuf is None:
+            self.hostbuf = HostBuffer(self.nfp_num, self.transport.procdir)
+        self.hostbuf.warm(win_sz)
+        return
+
+    def _run_inline(self, test_no, warm, ready=None):
+        """Start a test and wait for it to finish without a C helper.
+        Unlike the helper this does not thrash the host cache.
+        ready() is called once the host buffers are warmed."""
+        if warm:
+            self._warm_host(warm)
+        if ready:
+            ready()
+
+        with span("poll") as spn:
+            self._set_test_ctrl(test_no)
+
+            polls = 1
+            delay = 0.0001
+            while self._get_test_ctrl() > 0:
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+                polls += 1
+            spn.set(polls=polls)
+        return
+
+    def _helper_report(self, out, start, end):
+        """Log the timing report of the C helper, which ran from
+        @start to @end (host time in seconds).  When tracing, record
+        the phases of the helper as spans, placed backwards from @end
+        as the report only has durations."""
+        match = _HELPER_REPORT.search(out.decode('utf-8', 'replace'))
+        if not match:
+            add_span("helper", start, end)
+            return
+        vals = dict(item.split('=', 1) for item in match.group(1).split())
+        wait = int(vals.get('wait_us', 0))
+        test = int(vals.get('test_us', 0))
+        log("Helper: waited %dus for a %dus test (expected %sus, "
+            "%s polls, %dus overhead)" %
+            (wait, test, vals.get('expected_us'), vals.get('polls'),
+             wait - test))
+        if 'thrash_us' in vals:
+            log("Helper: thrashed %sKB with %s threads in %sus" %
+                (vals['thrash_kb'], vals['thrash_threads'],
+                 vals['thrash_us']))
+        if int(vals.get('warm_us', 0)):
+            log("Helper: warmed the host buffers in %sus" % vals['warm_us'])
+
+        add_span("helper", start, end, **vals)
+        sleep = int(vals.get('sleep_us', 0)) / 1e6
+        run = end - wait / 1e6
+        add_span("helper.run", run, end)
+        add_span("helper.sleep", run, run + sleep)
+        add_span("helper.poll", run + sleep, end,
+                 polls=vals.get('polls'))
+        warm = run - int(vals.get('warm_us', 0)) / 1e6
+        add_span("helper.warm", warm, run)
+        thrash = warm - int(vals.get('thrash_us', 0)) / 1e6
+        add_span("helper.thrash", thrash, warm)
+        add_span("helper.setup", start, max(thrash, start))
+
+    def _disturbs_host(self, flags, warm):
+        """True if running a test with @flags, warming @warm bytes of
+        the host buffers, changes the state of the host caches: the
+        helper thrashes them (unless @thrash is THRASH_NONE), the
+        device thrashes them (FLAGS_THRASH) or the buffers are
+        warmed.  The thrashing and warming must not overlap with the
+        tests of other devices on the same host.  With a helper
+        thrashing the cache, this is every test."""
+        if warm or flags & self.FLAGS_THRASH:
+            return True
+        return bool(self.helper) and self.thrash != self.THRASH_NONE
+
+    @traced
     def run_test(self, test_no, params, warm=0):
         """Run the test with @test_no and the provided parameters (a
         list/tuple).
@@ -342,10 +652,25 @@ class NFPBench(object):
         "warm" the cache with the first @warm bytes of the dma buffers
         by writing to them.
 
+        If no C helper was configured the test is started and polled
+        directly through the transport.
+
+        If a @host_lock (a scheduler.HostLock) is set, it is held
+        while running the test, shared if the test doesn't disturb
+        the host caches (see _disturbs_host()).  Otherwise it is held
+        exclusively while the caches are thrashed and warmed and
+        shared while the device runs the test, or exclusively all
+        along if the device thrashes the caches (FLAGS_THRASH).
+        Before a test with a cold cache, the other devices waiting
+        to thrash the caches go first, so the devices thrash one
+        after the other and then run their tests together.  The
+        buffers warmed for a test are kept warm by holding on to the
+        lock until the test started.
+
         Returns time difference (in ME cycles) and a tuple of test results
         """
 
-	# Param0: cache flag(?), Param 1: size
+        # Param0: cache flag(?), Param 1: size
         #param 2: window size (?), param 3: h_off? param 4: d_off?
         pm0 = 0
         pm1 = 0
@@ -368,12 +693,32 @@ class NFPBench(object):
 
         self._set_params(pm0, pm1, pm2, pm3, pm4)
 
-        # If we have a C helper, use it
-        cmd = self.helper + " -n %d -c %s -t %d -w %d" % \
-	    (self.nfp_num, _ME_TEST_CTRL, test_no, warm)
-        ret, _ = _exec_cmd(cmd)
-        if not ret == 0:
-	    err("Test helper failed with %d" % (ret))
+        lock = self.host_lock
+        excl = self._disturbs_host(pm0, warm)
+        # Whether the lock is held exclusively, a list to be set from
+        # _ready()
+        held = [excl]
+        def _ready():
+            """The host caches are set up, let other tests run"""
+            held[0] = False
+            if warm:
+                lock.downgrade()
+                return
+            lock.release(True)
+            with span("host_wait", exclusive=False):
+                lock.acquire(False)
+
+        ready = None
+        if lock:
+            with span("host_wait", exclusive=excl):
+                lock.acquire(excl)
+            if excl and not pm0 & self.FLAGS_THRASH:
+                ready = _ready
+        try:
+            self._start_wait(test_no, warm, ready)
+        finally:
+            if lock:
+                lock.release(held[0])
 
         ret = self._get_test_ctrl()
         if ret < 0:
@@ -384,32 +729,172 @@ class NFPBench(object):
 
         return diff, res
 
+    def _start_wait(self, test_no, warm, ready=None):
+        """Start test @test_no, with the parameters already written,
+        and wait for it to finish, using the C helper if we have one.
+        If given, ready() is called once the host caches are thrashed
+        and warmed, before the test starts."""
+        if self.helper:
+            cmd = self.helper + " -n %d -c %s -t %d -w %d" % \
+                (self.nfp_num, _ME_TEST_CTRL, test_no, warm)
+            cmd += " -p %s -r %s -f %d" % \
+                (_ME_TEST_PARAMS, _ME_TEST_RESULT, self.freq_mhz)
+            cmd += " -T %s" % self.thrash
+            cpus = self.thrash_cpus
+            if not cpus and self.placement and self.placement.cpus:
+                cpus = self.placement.cpulist()
+            if cpus and self.thrash != self.THRASH_NONE:
+                cmd += " -C %s" % cpus
+            start = time.time()
+            if ready:
+                ret, out = _exec_helper(cmd + " -R", ready)
+            else:
+                ret, out = _exec_cmd(cmd)
+            self._helper_report(out, start, time.time())
+            if not ret == 0:
+                err("Test helper failed with %d" % (ret))
+        else:
+            self._run_inline(test_no, warm, ready)
+        return
+
+    def _check_args(self, flags, win_sz):
+        """Sanity check test arguments common to all tests"""
+        if win_sz % 64:
+            err("Window size must be a multiple of 64. Was %d" % win_sz)
+        if flags & ~self.FLAGS:
+            err("Illegal flags %#08x (valid %#08x)" % (flags, self.FLAGS))
+        if bin(flags & self._FLAGS_CACHE).count("1") > 1:
+            err("Only one cache related flag may be set")
+
+    def _flags_str(self, flags):
+        """Return a tuple of strings describing the cache and access
+        flags"""
+        if flags & self.FLAGS_HOSTWARM:
+            cache = "hwarm"
+        elif flags & self.FLAGS_WARM:
+            cache = "dwarm"
+        elif flags & self.FLAGS_THRASH:
+            cache = "thrash"
+        else:
+            cache = "cold"
+        access = "rnd" if flags & self.FLAGS_RANDOM else "seq"
+        return cache, access
+
+    def lat_test(self, twr, test_no, flags, win_sz, trans_sz, h_off, d_off,
+                 keep=False):
+        """Run a latency test:
+        @twr:      TableWriter object set up with @lat_fmt
+        @test_no:  Test to run. One of @LAT_TESTS
+        @flags:    Test flags. Combination of @FLAGS*
+        @win_sz:   Window size to access
+        @trans_sz: Transaction size
+        @h_off:    Host offset (from the start of a 64B cache line)
+        @d_off:    Device offset (from the start of a 64B cache line)
+
+        Returns a ListStats object of individual latencies (in cycles)
+        for further analysis.  When checkpointing, the latencies are
+        only stored if @keep is set.  If a completed point is skipped
+        and its latencies weren't kept, None is returned.
+        """
+        # Sanity checks
+        if not test_no in self.LAT_TESTS:
+            err("%s is not a latency test" % test_no)
+        if test_no in [self.LAT_CMD_RD, self.LAT_CMD_WRRD] and \
+           trans_sz > self.MAX_CMD_SZ:
+            err("PCIe commands can transfer at most %d bytes" %
+                self.MAX_CMD_SZ)
+        if self.nfp6000 and (trans_sz > 4096):
+            err("For NFP-6000 the transaction must be less than 4096")
+        self._check_args(flags, win_sz)
+
+        key = point_key(test_no, flags, win_sz, trans_sz, h_off, d_off)
+        with span("point", key=key) as spn:
+            rec, samples = self._replay(twr, key)
+            if rec:
+                spn.set(replayed=True)
+                return ListStats(samples) if samples is not None else None
+
+            params = [flags, trans_sz, win_sz, h_off, d_off]
+            cycles, res = self.run_test(
+                test_no, params, win_sz if flags & self.FLAGS_HOSTWARM else 0)
+            result = decode(test_no, self.TEST_NAMES[test_no], params,
+                            cycles, res, self.freq_hz)
+
+            lat_stats = ListStats(self.get_journal(result.samples,
+                                                   nullcheck=True))
+
+            with span("stats", samples=result.samples):
+                med, p95, p99 = lat_stats.percentiles([50, 95, 99])
+                lat_min, lat_avg = lat_stats.min(), lat_stats.avg()
+                lat_max = lat_stats.max()
+            cache, access = self._flags_str(flags)
+            row = (self.TEST_NAMES[test_no], cache, access,
+                   win_sz, trans_sz, h_off, d_off,
+                   self.cyc2ns(lat_min), self.cyc2ns(lat_avg),
+                   self.cyc2ns(med), self.cyc2ns(p95), self.cyc2ns(p99),
+                   self.cyc2ns(lat_max))
+            with span("output"):
+                twr.out(row, lat_stats.list if keep else None)
+                if self.checkpoint:
+                    self.checkpoint.add(
+                        key, row, samples=lat_stats.list if keep else None)
+        return lat_stats
+
+    def bw_test(self, twr, test_no, flags, win_sz, trans_sz, h_off, d_off):
+        """Run a bandwidth test and write the result to @twr, a
+        TableWriter object set up with @bw_fmt.  The other arguments
+        are as for @dma_test().
+
+        Returns the bandwidth in Gb/s
+        """
+        key = point_key(test_no, flags, win_sz, trans_sz, h_off, d_off)
+        with span("point", key=key) as spn:
+            rec, _ = self._replay(twr, key)
+            if rec:
+                spn.set(replayed=True)
+                return rec['value']
+
+            result = self.dma_test(test_no, flags, win_sz, trans_sz, h_off,
+                                   d_off)
+            log("%s" % result)
+            gbps = result.gbps
+            if self.pcie:
+                eff = 100.0 * result.efficiency(self.pcie.gbps(
+                    self.PCIE_DIRS[test_no], trans_sz, h_off))
+            else:
+                eff = float('nan')
+
+            cache, access = self._flags_str(flags)
+            row = (self.TEST_NAMES[test_no], cache, access,
+                   win_sz, trans_sz, h_off, d_off,
+                   result.trans, result.time_ns, gbps, result.mtps, eff)
+            with span("output"):
+                twr.out(row)
+                if self.checkpoint:
+                    self.checkpoint.add(key, row, gbps)
+        return gbps
+
     def dma_test(self, test_no, flags, win_sz, trans_sz, h_off, d_off):
         """Run a bandwidth test:
-        @twr:      TableWriter object set up with @bw_fmt
-        @test_no:  Test to run. One of @LAT_TESTS
+        @test_no:  Test to run. One of @BW_TESTS
         @flags:    Test flags. Combination of @FLAGS*
         @win_sz:   Window size to access
         @trans_sz: Transaction size
         @h_off:    Host offset (from the start of a 64B cache line)
         @d_off:    Device offset (from the start of a 64B cache line)
 
-        Returns a list of individual latencies for further analysis
+        Returns a BwResult
         """
         # Sanity checks
         if not test_no in self.TESTS:
             err("%s is not a bandwidth test" % test_no)
         if self.nfp6000 and (trans_sz > 4096):
             err("For NFP-6000 the transaction must be less than 4096")
-        if win_sz % 64:
-            err("Window size must be a multiple of 64. Was %d" % win_sz)
-        if flags & ~self.FLAGS:
-            err("Illegal flags %#08x (valid %#08x)" % (flags, self.FLAGS))
-        if bin(flags & self._FLAGS_CACHE).count("1") > 1:
-            err("Only one cache related flag may be set")
+        self._check_args(flags, win_sz)
 
+        params = [flags, trans_sz, win_sz, h_off, d_off]
         cycles, res = self.run_test(
-            test_no, [flags, trans_sz, win_sz, h_off, d_off],
-            win_sz if flags & self.FLAGS_HOSTWARM else 0)
+            test_no, params, win_sz if flags & self.FLAGS_HOSTWARM else 0)
 
-        return
+        return decode(test_no, self.TEST_NAMES[test_no], params, cycles, res,
+                      self.freq_hz)
@@ -0,0 +1,166 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""On-disk cache of what NFPBench learns about a NFP at startup.
+
+Starting a run involves executing nfp-hwinfo, unloading and loading
+the firmware and reading the symbol table.  This module caches the
+hardware information and the symbol table (per firmware image) of a
+card, identified by its PCIe device serial number, and remembers
+which firmware image was last loaded since the host booted.  With
+this NFPBench can skip all of it if the firmware is still loaded.
+
+The serial number is read from the PCIe configuration space in sysfs
+(this needs root).  If it can't be read, nothing is cached.
+"""
+
+import json
+import os
+import struct
+
+from .debug import dbg
+from .sysinfo import CACHE_ROOT, BOOT_ID, read_file
+from .transport import Symbol
+
+CACHE_DIR = os.path.join(CACHE_ROOT, "nfp")
+
+SYSFS_PCI = "/sys/bus/pci/devices"
+NFP_VENDOR = "0x19ee"
+
+# PCIe extended capability ID of the Device Serial Number
+_PCI_EXT_CAP_DSN = 0x3
+
+
+def _pcie_dsn(cfg):
+    """Return the device serial number from the PCIe configuration
+    space @cfg (bytes) as a hex string or None"""
+    off = 0x100
+    seen = set()
+    while off and off + 12 <= len(cfg) and off not in seen:
+        seen.add(off)
+        hdr = struct.unpack_from('<I', cfg, off)[0]
+        if hdr in [0, 0xffffffff]:
+            return None
+        if hdr & 0xffff == _PCI_EXT_CAP_DSN:
+            low, high = struct.unpack_from('<II', cfg, off + 4)
+            return "%08x%08x" % (high, low)
+        off = (hdr >> 20) & 0xffc
+    return None
+
+
+def nfp_pci_dev(nfp_num, sysdir=SYSFS_PCI):
+    """Return the sysfs directory of the physical function of NFP
+    @nfp_num (the @nfp_num-th NFP, as the helper counts them) or None"""
+    try:
+        devs = sorted(os.listdir(sysdir))
+    except OSError:
+        return None
+    idx = 0
+    for dev in devs:
+        path = os.path.join(sysdir, dev)
+        if read_file(os.path.join(path, "vendor")) != NFP_VENDOR or \
+           os.path.exists(os.path.join(path, "physfn")):
+            continue
+        if idx == nfp_num:
+            return path
+        idx += 1
+    return None
+
+
+def nfp_serial(nfp_num, sysdir=SYSFS_PCI):
+    """Return the PCIe serial number of NFP @nfp_num or None"""
+    path = nfp_pci_dev(nfp_num, sysdir)
+    if not path:
+        return None
+    try:
+        with open(os.path.join(path, "config"), 'rb') as inf:
+            return _pcie_dsn(inf.read())
+    except (IOError, OSError):
+        return None
+
+
+class NFPCache(object):
+    """The cache for the NFP with serial number @serial"""
+
+    def __init__(self, serial, cache_dir=CACHE_DIR):
+        self.serial = serial
+        self.path = os.path.join(cache_dir, serial)
+
+    @classmethod
+    def open(cls, nfp_num, cache_dir=CACHE_DIR, sysdir=SYSFS_PCI):
+        """Return the cache for NFP @nfp_num or None if the NFP can't
+        be identified"""
+        serial = nfp_serial(nfp_num, sysdir)
+        if not serial:
+            dbg("Can't read the serial number of NFP %d, not caching" %
+                nfp_num)
+            return None
+        dbg("NFP %d: serial %s" % (nfp_num, serial))
+        return cls(serial, cache_dir)
+
+    def _load(self, name):
+        """Return the JSON object stored as @name or None"""
+        try:
+            with open(os.path.join(self.path, name), 'r') as inf:
+                return json.load(inf)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _store(self, name, obj):
+        """Store the JSON object @obj as @name"""
+        fname = os.path.join(self.path, name)
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            with open(fname + ".tmp", 'w') as outf:
+                json.dump(obj, outf, sort_keys=True)
+            os.rename(fname + ".tmp", fname)
+        except (IOError, OSError) as exc:
+            dbg("Can't write %s: %s" % (fname, exc))
+
+    def hwinfo(self):
+        """Return the cached hardware information or None"""
+        return self._load("hwinfo.json")
+
+    def set_hwinfo(self, info):
+        """Cache the hardware information @info"""
+        self._store("hwinfo.json", info)
+
+    def symbols(self, fw_hash):
+        """Return the cached symbol table of the firmware with hash
+        @fw_hash or None"""
+        syms = self._load("symtab-%s.json" % fw_hash)
+        if syms is None:
+            return None
+        return dict((str(name), Symbol(off, size))
+                    for name, (off, size) in syms.items())
+
+    def set_symbols(self, fw_hash, symtab):
+        """Cache the symbol table @symtab of firmware @fw_hash"""
+        self._store("symtab-%s.json" % fw_hash,
+                    dict((name, [sym.off, sym.size])
+                         for name, sym in symtab.items()))
+
+    def fw_loaded(self, fw_hash):
+        """True if firmware @fw_hash was the last one loaded since the
+        host booted"""
+        state = self._load("fw.json")
+        return state is not None and state.get('fw') == fw_hash and \
+               state.get('boot_id') == read_file(BOOT_ID)
+
+    def set_fw_loaded(self, fw_hash):
+        """Record that firmware @fw_hash was loaded (None: unknown)"""
+        self._store("fw.json", {'fw': fw_hash,
+                                'boot_id': read_file(BOOT_ID)})
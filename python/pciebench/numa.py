@@ -0,0 +1,195 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Placement of the host side work on NUMA nodes.
+
+The node of the NFP and the CPUs local to it are read from sysfs (the
+numa_node and local_cpulist files of its PCI device).  A Placement
+names the node and CPUs to run on: the NFP's node ('local'), another
+node ('remote') or a node given by number.  Pinning the controller is
+inherited by the helper it spawns and the threads it starts; the
+helper's cache thrashing threads are told about the CPUs separately
+(-C), as they pin themselves.
+
+The host buffers are allocated by the kernel module, on the node given
+by its 'node' parameter, which is not changed here.
+"""
+
+import ctypes
+import ctypes.util
+import os
+
+from .debug import warn
+from .nfpcache import nfp_pci_dev
+from .sysinfo import read_file
+
+SYSFS_NODES = "/sys/devices/system/node"
+
+PIN_LOCAL = "local"
+PIN_REMOTE = "remote"
+PIN_NONE = "none"
+PIN_MODES = [PIN_LOCAL, PIN_REMOTE, PIN_NONE]
+
+
+def parse_cpulist(text):
+    """Return the CPUs in the cpulist @text ("0-3,8,10-11") as a
+    sorted list"""
+    res = set()
+    for part in (text or "").strip().split(','):
+        if not part:
+            continue
+        low, _, high = part.partition('-')
+        res.update(range(int(low), int(high or low) + 1))
+    return sorted(res)
+
+
+def format_cpulist(cpus):
+    """Return the cpulist of @cpus, with ranges collapsed"""
+    res = []
+    for cpu in sorted(cpus):
+        if res and res[-1][1] == cpu - 1:
+            res[-1][1] = cpu
+        else:
+            res.append([cpu, cpu])
+    return ",".join("%d" % low if low == high else "%d-%d" % (low, high)
+                    for low, high in res)
+
+
+def nodes(sysdir=SYSFS_NODES):
+    """Return a dictionary of the online nodes and their CPUs"""
+    res = {}
+    try:
+        names = os.listdir(sysdir)
+    except OSError:
+        return res
+    for name in names:
+        if not name.startswith("node") or not name[4:].isdigit():
+            continue
+        cpus = parse_cpulist(read_file(os.path.join(sysdir, name,
+                                                    "cpulist")))
+        if cpus:
+            res[int(name[4:])] = cpus
+    return res
+
+
+def nfp_node(nfp_num):
+    """Return the node of NFP @nfp_num and the CPUs local to it.  The
+    node is -1 and the CPUs empty if unknown."""
+    path = nfp_pci_dev(nfp_num)
+    if not path:
+        return -1, []
+    node = read_file(os.path.join(path, "numa_node"))
+    cpus = parse_cpulist(read_file(os.path.join(path, "local_cpulist")))
+    try:
+        return int(node), cpus
+    except (TypeError, ValueError):
+        return -1, cpus
+
+
+class Placement(object):
+    """Where the host side work runs: @mode as requested, the node of
+    the NFP, the node chosen and its CPUs (empty if not pinned)"""
+
+    __slots__ = ('mode', 'nfp_node', 'node', 'cpus')
+
+    def __init__(self, mode, nfp_node=-1, node=-1, cpus=None):
+        self.mode = mode
+        self.nfp_node = nfp_node
+        self.node = node
+        self.cpus = cpus or []
+
+    def local(self):
+        """True if the work runs on the NFP's node, None if unknown"""
+        if self.node < 0 or self.nfp_node < 0:
+            return None
+        return self.node == self.nfp_node
+
+    def cpulist(self):
+        """The CPUs as a cpulist"""
+        return format_cpulist(self.cpus)
+
+    def as_dict(self):
+        """Return the placement as a dictionary"""
+        return {'mode': self.mode, 'nfp_node': self.nfp_node,
+                'node': self.node, 'cpus': self.cpulist(),
+                'local': self.local()}
+
+    def __str__(self):
+        if not self.cpus:
+            return "not pinned (NFP on node %d)" % self.nfp_node
+        where = {True: "local", False: "remote", None: "?"}[self.local()]
+        return "node %d (%s to the NFP on node %d), CPUs %s" % \
+            (self.node, where, self.nfp_node, self.cpulist())
+
+
+def place(nfp_num, mode, sysdir=SYSFS_NODES):
+    """Return the Placement for NFP @nfp_num and @mode: one of
+    PIN_MODES or a node number"""
+    dev_node, dev_cpus = nfp_node(nfp_num)
+    all_nodes = nodes(sysdir)
+    if mode == PIN_NONE:
+        return Placement(mode, dev_node)
+
+    if mode == PIN_LOCAL:
+        node, cpus = dev_node, dev_cpus or all_nodes.get(dev_node)
+        if not cpus:
+            warn("Can't find the CPUs local to NFP %d, not pinning" %
+                 nfp_num)
+            return Placement(mode, dev_node)
+        return Placement(mode, dev_node, node, cpus)
+
+    if mode == PIN_REMOTE:
+        others = sorted(node for node in all_nodes if node != dev_node)
+        if dev_node < 0 or not others:
+            warn("No node remote to NFP %d, not pinning" % nfp_num)
+            return Placement(mode, dev_node)
+        node = others[0]
+    else:
+        node = int(mode)
+    if node not in all_nodes:
+        warn("Node %d has no CPUs online, not pinning" % node)
+        return Placement(str(mode), dev_node)
+    return Placement(str(mode), dev_node, node, all_nodes[node])
+
+
+def _sched_setaffinity(pid, cpus):
+    """os.sched_setaffinity() for Pythons without it (Python 2),
+    calling the C library"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.sched_setaffinity
+    except (OSError, AttributeError):
+        raise OSError("sched_setaffinity() is not available")
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    mask = (ctypes.c_ulong * (max(cpus) // bits + 1))()
+    for cpu in cpus:
+        mask[cpu // bits] |= 1 << (cpu % bits)
+    if func(pid, ctypes.c_size_t(ctypes.sizeof(mask)), mask) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def set_affinity(placement):
+    """Restrict this process (and the processes and threads it starts
+    from now on) to the CPUs of @placement.  Returns True if pinned."""
+    if not placement.cpus:
+        return False
+    setaffinity = getattr(os, 'sched_setaffinity', _sched_setaffinity)
+    try:
+        setaffinity(0, placement.cpus)
+    except OSError as exc:
+        warn("Failed to pin to CPUs %s: %s" % (placement.cpulist(), exc))
+        return False
+    return True
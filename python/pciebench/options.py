@@ -0,0 +1,118 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Command line options shared by nfp_pciebench.py and
+multi_pciebench.py, and the plan they select"""
+
+from .nfpbench import NFPBench
+from .numa import PIN_LOCAL, PIN_NONE, PIN_MODES
+from .plan import Plan, CostModel
+import pciebench.spec
+
+
+def add_common_options(parser):
+    """Add the options selecting the firmware, helper, transport,
+    simulation, spec and placement to the OptionParser @parser"""
+    parser.add_option('-f', '--fwfile',
+                      default=None, action='store', metavar='FILE',
+                      help='Firmware file to use')
+    parser.add_option('-o', '--outdir',
+                      default="./", action='store', metavar='DIRECTORY',
+                      help='Directory where to write data files')
+    parser.add_option('-u', '--user-helper', dest='helper',
+                      default=None, action='store', metavar='HELPER',
+                      help='Path to helper binary')
+    parser.add_option('--thrash', choices=NFPBench.THRASH_MODES,
+                      default=NFPBench.THRASH_FAST, metavar='MODE',
+                      help='How the helper thrashes the host cache ' + \
+                           'before each test: fast, legacy or none ' + \
+                           '(default fast)')
+    parser.add_option('--thrash-cpus', default=None, metavar='CPULIST',
+                      dest='thrash_cpus',
+                      help='CPUs the helper thrashes the cache from ' + \
+                           '(default: the pinned CPUs)')
+    parser.add_option('-t', '--transport',
+                      default='auto', action='store', metavar='TRANSPORT',
+                      choices=['auto', 'libnfp', 'rtsym'],
+                      help='How to access the NFP: auto|libnfp|rtsym ' + \
+                           '(default auto)')
+    parser.add_option('--sim',
+                      action="store_true", dest='sim', default=False,
+                      help='Run against a simulated NFP (no hardware needed)')
+    parser.add_option('--sim-trans', type='int',
+                      default=None, metavar='NUM', dest='sim_trans',
+                      help='Sim: Transactions per test ' + \
+                           '(default as firmware)')
+    parser.add_option('--sim-time', type='float',
+                      default=0.0, metavar='SCALE', dest='sim_time',
+                      help='Sim: Tests take their simulated time ' + \
+                           'multiplied by SCALE (default 0: no time)')
+    parser.add_option('-s', '--short',
+                      action="store_true", dest='short', default=False,
+                      help='Run a subset of the benchmarks (the short spec)')
+    parser.add_option('--spec', metavar='SPEC', default=None,
+                      help='Run the tests of a sweep spec file (JSON or ' + \
+                           'YAML) or built-in spec: ' + \
+                           ', '.join(pciebench.spec.builtin_specs()) + \
+                           ' (default full)')
+    parser.add_option('--plan',
+                      action="store_true", dest='plan', default=False,
+                      help='Print the planned test points and the ' + \
+                           'estimated run time and exit')
+    parser.add_option('--order', choices=Plan.ORDERS, default="cost",
+                      help='Order of the test points: cost (group ' + \
+                           'points by cache setting) or spec (default cost)')
+    parser.add_option('-p', '--pin', default=None, metavar='WHERE',
+                      help='Run the host side on the CPUs of: local ' + \
+                           '(the NFP\'s node), remote (another node), ' + \
+                           'a node number or none (default local, ' + \
+                           'none with --sim)')
+    parser.add_option('--reload-fw',
+                      action="store_true", dest='reload_fw', default=False,
+                      help='Always reload the firmware, even if it is ' + \
+                           'already loaded and idle')
+    parser.add_option("-v", '--verbose',
+                      action="count", help='set the verbosity level')
+
+
+def check_common_options(parser, options):
+    """Check and complete the options added by add_common_options()
+    after parsing them with @parser"""
+    if options.pin is None:
+        options.pin = PIN_NONE if options.sim else PIN_LOCAL
+    if options.pin not in PIN_MODES and not options.pin.isdigit():
+        parser.error("--pin: local, remote, none or a node number")
+    if not options.outdir.endswith('/'):
+        options.outdir += '/'
+
+
+def make_plan(options, name=None, only=None, adaptive=None):
+    """Return the Plan of the tables @only (default: all) of spec
+    @name (default: as selected by @options), run with the AdaptiveSweep
+    @adaptive, with the costs of the device and helper of @options"""
+    if name is None:
+        name = options.spec or ("short" if options.short else "full")
+    tables = pciebench.spec.select(pciebench.spec.load(name), only)
+
+    if options.sim:
+        # The simulated device completes tests immediately, unless
+        # --sim-time makes them take time
+        kwargs = {'helper': False, 'device_scale': options.sim_time}
+        if options.sim_trans:
+            kwargs.update(lat_trans=options.sim_trans,
+                          bw_trans=options.sim_trans)
+    else:
+        kwargs = {'helper': options.helper is not None}
+    return Plan(tables, CostModel(**kwargs), options.order, adaptive, name)
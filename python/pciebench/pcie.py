@@ -0,0 +1,403 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""The PCIe link of the NFP and a model of the bandwidth it allows.
+
+The link configuration (generation, width, Max Payload Size, Max Read
+Request Size and the Read Completion Boundary) is read from the PCIe
+capability in the configuration space of the NFP and of the port above
+it, via sysfs.  The configuration space beyond the first 64 bytes is
+only readable by root; otherwise the output of 'lspci -vvv' is parsed,
+which can also be a file captured earlier (e.g. sys-lspci.txt).
+
+The model counts the bytes on the wire in each direction for a DMA of
+a given size: the payload, the TLP headers, the data link layer's
+sequence number and LCRC, the physical layer's framing and the DLLPs
+acknowledging the TLPs and returning flow control credits.  The
+bandwidth achievable is the payload moved while the busier direction
+is busy.  Latency, the number of outstanding reads and the host's
+memory system are not modelled, so this is a ceiling.
+
+Run as 'python -m pciebench.pcie [lspci output [device]]' to print
+the link configuration and the model.
+"""
+
+import os
+import re
+import struct
+import subprocess
+import sys
+
+from .debug import dbg
+from .nfpcache import SYSFS_PCI, nfp_pci_dev
+from .tablewriter import TableWriter
+
+# Transfer rate per lane (GT/s) by generation
+GEN_RATE = {1: 2.5, 2: 5.0, 3: 8.0, 4: 16.0, 5: 32.0}
+
+# Sizes in bytes of the TLP headers (MRd/MWr with 64bit addresses and
+# CplD), the data link layer's sequence number plus LCRC and a DLLP
+MEM_HDR = 16
+MEM_HDR_32 = 12
+CPL_HDR = 12
+DLL_OVHD = 2 + 4
+DLLP_SZ = 6
+
+# TLPs acknowledged per Ack DLLP and per UpdateFC DLLP
+ACK_TLPS = 4
+FC_TLPS = 4
+
+# Used for values which can't be determined
+DEFAULT_MPS = 256
+DEFAULT_MRRS = 512
+DEFAULT_RCB = 64
+
+BW_RD = "rd"
+BW_WR = "wr"
+BW_RW = "rw"
+
+MODEL_FMT = [("Size", 5, "%d"), ('', 0, ''),
+             ("rd", 7, "%.2f"), ("wr", 7, "%.2f"), ("rw", 7, "%.2f")]
+
+# PCI Express capability and its registers
+_PCI_CAP_PTR = 0x34
+_PCI_CAP_EXP = 0x10
+_PCI_EXP_DEVCTL = 0x08
+_PCI_EXP_LNKCAP = 0x0c
+_PCI_EXP_LNKCTL = 0x10
+_PCI_EXP_LNKSTA = 0x12
+_PCI_EXP_LNKCTL_RCB = 0x08
+
+_BDF_RE = r'([0-9a-f]{4}:)?[0-9a-f]{2}:[0-9a-f]{2}\.[0-7]'
+_BDF = re.compile('^%s$' % _BDF_RE)
+_LSPCI_DEV = re.compile('^(%s) ' % _BDF_RE, re.M)
+# Link capabilities or status (by register name)
+_LSPCI_LNK = r'%s:.*?Speed ([0-9.]+)GT/s.*?Width x(\d+)'
+_LSPCI_DEVCTL = re.compile(r'MaxPayload (\d+) bytes, '
+                           r'MaxReadReq (\d+) bytes')
+_LSPCI_RCB = re.compile(r'RCB (\d+) bytes')
+_LSPCI_BUS = re.compile(r'Bus: primary=[0-9a-f]{2}, secondary=([0-9a-f]{2})')
+
+
+def gen_of(speed):
+    """Return the PCIe generation of the transfer rate @speed (GT/s)"""
+    for gen, rate in GEN_RATE.items():
+        if abs(rate - float(speed)) < 0.1:
+            return gen
+    return 0
+
+
+class LinkConfig(object):
+    """The configuration of a PCIe link: negotiated generation and
+    width (and the maximum the device supports), Max Payload Size, Max
+    Read Request Size and the Read Completion Boundary of the port
+    completing the device's reads"""
+
+    __slots__ = ('addr', 'gen', 'width', 'max_gen', 'max_width', 'mps',
+                 'mrrs', 'rcb', 'source')
+
+    def __init__(self, gen, width, mps=DEFAULT_MPS, mrrs=DEFAULT_MRRS,
+                 rcb=DEFAULT_RCB, max_gen=None, max_width=None, addr=None,
+                 source=None):
+        self.addr = addr
+        self.gen = gen
+        self.width = width
+        self.max_gen = max_gen or gen
+        self.max_width = max_width or width
+        self.mps = mps
+        self.mrrs = mrrs
+        self.rcb = rcb
+        self.source = source
+
+    def degraded(self):
+        """True if the link trained below what the device supports"""
+        return self.gen < self.max_gen or self.width < self.max_width
+
+    def as_dict(self):
+        """Return the configuration as a dictionary"""
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+
+    def __str__(self):
+        res = "Gen%d x%d (%.1f GT/s), MPS %d, MRRS %d, RCB %d" % \
+              (self.gen, self.width, GEN_RATE.get(self.gen, 0), self.mps,
+               self.mrrs, self.rcb)
+        if self.degraded():
+            res += " (capable of Gen%d x%d)" % (self.max_gen, self.max_width)
+        return res
+
+
+def parse_config(cfg):
+    """Return a dictionary with the link status and capabilities, MPS,
+    MRRS and RCB from the configuration space @cfg (bytes), or None
+    if it has no (readable) PCI Express capability"""
+    if len(cfg) < 0x40:
+        return None
+    off = struct.unpack_from('<B', cfg, _PCI_CAP_PTR)[0] & 0xfc
+    seen = set()
+    while off and off + 0x14 <= len(cfg) and off not in seen:
+        seen.add(off)
+        cap_id, nxt = struct.unpack_from('<BB', cfg, off)
+        if cap_id == _PCI_CAP_EXP:
+            devctl, = struct.unpack_from('<H', cfg, off + _PCI_EXP_DEVCTL)
+            lnkcap, = struct.unpack_from('<I', cfg, off + _PCI_EXP_LNKCAP)
+            lnkctl, = struct.unpack_from('<H', cfg, off + _PCI_EXP_LNKCTL)
+            lnksta, = struct.unpack_from('<H', cfg, off + _PCI_EXP_LNKSTA)
+            return {'gen': lnksta & 0xf, 'width': (lnksta >> 4) & 0x3f,
+                    'max_gen': lnkcap & 0xf,
+                    'max_width': (lnkcap >> 4) & 0x3f,
+                    'mps': 128 << ((devctl >> 5) & 0x7),
+                    'mrrs': 128 << ((devctl >> 12) & 0x7),
+                    'rcb': 128 if lnkctl & _PCI_EXP_LNKCTL_RCB else 64}
+        off = nxt & 0xfc
+    return None
+
+
+def lspci_devices(text):
+    """Split the output of 'lspci -vvv' into a dictionary of device
+    address -> description"""
+    res = {}
+    starts = [(mat.start(), mat.group(1))
+              for mat in _LSPCI_DEV.finditer(text)]
+    for i, (start, addr) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(text)
+        if addr.count(':') == 1:
+            addr = "0000:" + addr
+        res[addr] = text[start:end]
+    return res
+
+
+def parse_lspci_dev(desc):
+    """Return a dictionary of the link settings found in the 'lspci
+    -vvv' description @desc of a device.  Settings not listed (lspci
+    needs root to show them) are left out."""
+    res = {}
+    mat = re.search(_LSPCI_LNK % "LnkSta", desc)
+    if mat:
+        res['gen'] = gen_of(mat.group(1))
+        res['width'] = int(mat.group(2))
+    mat = re.search(_LSPCI_LNK % "LnkCap", desc)
+    if mat:
+        res['max_gen'] = gen_of(mat.group(1))
+        res['max_width'] = int(mat.group(2))
+    mat = _LSPCI_DEVCTL.search(desc)
+    if mat:
+        res['mps'] = int(mat.group(1))
+        res['mrrs'] = int(mat.group(2))
+    mat = _LSPCI_RCB.search(desc)
+    if mat:
+        res['rcb'] = int(mat.group(1))
+    return res
+
+
+def _link(dev, port, addr, source):
+    """Combine the settings @dev of a device and @port of the port
+    above it into a LinkConfig.  The port's MPS limits the device's
+    and its RCB applies to the completions it sends."""
+    if not dev or 'gen' not in dev:
+        return None
+    port = port or {}
+    mps = dev.get('mps', DEFAULT_MPS)
+    if 'mps' in port:
+        mps = min(mps, port['mps'])
+    return LinkConfig(dev['gen'], dev['width'], mps,
+                      dev.get('mrrs', DEFAULT_MRRS),
+                      port.get('rcb', DEFAULT_RCB), dev.get('max_gen'),
+                      dev.get('max_width'), addr, source)
+
+
+def _lspci_port(devs, addr):
+    """Return the address of the bridge above device @addr in the
+    'lspci -vvv' descriptions @devs (see lspci_devices()) or None.
+    This is the bridge whose secondary bus is the device's bus.  If
+    the bridges' bus numbers aren't listed, the closest root port on
+    a lower bus is taken."""
+    bridges = [dev for dev in sorted(devs)
+               if "PCI bridge" in devs[dev].split('\n')[0]]
+    for dev in bridges:
+        mat = _LSPCI_BUS.search(devs[dev])
+        if mat and dev[:4] == addr[:4] and \
+           int(mat.group(1), 16) == int(addr[5:7], 16):
+            return dev
+    port = None
+    for dev in bridges:
+        if dev >= addr:
+            break
+        if "Root Port" in devs[dev] and not _LSPCI_BUS.search(devs[dev]):
+            port = dev
+    return port
+
+
+def parse_lspci(text, addr=None):
+    """Return the LinkConfig of device @addr (default: the first
+    Netronome device) from the output of 'lspci -vvv' or None"""
+    devs = lspci_devices(text)
+    if addr is None:
+        for dev in sorted(devs):
+            if "Netronome" in devs[dev].split('\n')[0]:
+                addr = dev
+                break
+    elif addr.count(':') == 1:
+        addr = "0000:" + addr
+    if addr not in devs:
+        return None
+    port = _lspci_port(devs, addr)
+    return _link(parse_lspci_dev(devs[addr]),
+                 parse_lspci_dev(devs[port]) if port else None, addr,
+                 "lspci")
+
+
+def _read_config(path):
+    """Parse the configuration space of the device at sysfs @path"""
+    try:
+        with open(os.path.join(path, "config"), 'rb') as inf:
+            return parse_config(inf.read())
+    except (IOError, OSError):
+        return None
+
+
+def _run_lspci(addr):
+    """Return the output of 'lspci -vvv' for device @addr or None"""
+    try:
+        proc = subprocess.Popen(["lspci", "-vvv", "-D", "-s", addr],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, _ = proc.communicate()
+    except OSError:
+        return None
+    if proc.returncode:
+        return None
+    return out.decode('utf-8', 'replace')
+
+
+def sysfs_link(path):
+    """Return the LinkConfig of the device at sysfs @path or None"""
+    addr = os.path.basename(path)
+    port = os.path.dirname(os.path.realpath(path))
+    if not _BDF.match(os.path.basename(port)):
+        port = None
+
+    dev = _read_config(path)
+    if dev:
+        return _link(dev, _read_config(port) if port else None, addr,
+                     "sysfs")
+    dbg("Can't read the PCIe capability of %s, trying lspci" % addr)
+    out = _run_lspci(addr)
+    if not out:
+        return None
+    port_out = _run_lspci(os.path.basename(port)) if port else None
+    return _link(parse_lspci_dev(out),
+                 parse_lspci_dev(port_out) if port_out else None, addr,
+                 "lspci")
+
+
+def link_config(nfp_num, sysdir=SYSFS_PCI):
+    """Return the LinkConfig of NFP @nfp_num or None"""
+    path = nfp_pci_dev(nfp_num, sysdir)
+    if not path:
+        return None
+    return sysfs_link(path)
+
+
+class PCIeModel(object):
+    """A bandwidth model of the PCIe link @link (a LinkConfig).  With
+    @cpl_rcb set, the completions of reads are assumed to be split at
+    every Read Completion Boundary instead of being as large as the
+    Max Payload Size allows."""
+
+    def __init__(self, link, cpl_rcb=False, addr64=True):
+        self.link = link
+        self.cpl_rcb = cpl_rcb
+        self.mem_hdr = MEM_HDR if addr64 else MEM_HDR_32
+        framing = 2 if link.gen <= 2 else 4
+        self.tlp_ovhd = DLL_OVHD + framing
+        self.dllp = DLLP_SZ + 2
+
+    def raw_gbps(self):
+        """Usable bit rate of the link per direction, after encoding"""
+        rate = GEN_RATE.get(self.link.gen, 0) * self.link.width
+        if self.link.gen <= 2:
+            return rate * 8 / 10
+        return rate * 128 / 130
+
+    @staticmethod
+    def _split(size, off, chunk):
+        """Number of pieces @size bytes at offset @off are split into
+        at multiples of @chunk"""
+        off %= chunk
+        return (off + size + chunk - 1) // chunk
+
+    def _acks(self, tlps):
+        """Bytes of DLLPs sent in return for @tlps TLPs"""
+        return self.dllp * (float(tlps) / ACK_TLPS + float(tlps) / FC_TLPS)
+
+    def wire(self, test, size, off=0):
+        """Return the bytes sent (upstream, downstream) for a DMA of
+        @test (BW_RD, BW_WR or BW_RW) with @size bytes at host offset
+        @off.  BW_RW counts a read plus a write."""
+        ups = downs = 0.0
+        if test in [BW_WR, BW_RW]:
+            tlps = self._split(size, off, self.link.mps)
+            ups += size + tlps * (self.mem_hdr + self.tlp_ovhd)
+            downs += self._acks(tlps)
+        if test in [BW_RD, BW_RW]:
+            reqs = self._split(size, off, self.link.mrrs)
+            if self.cpl_rcb:
+                cpls = self._split(size, off, self.link.rcb)
+            else:
+                cpls = self._split(size, off, self.link.mps)
+            ups += reqs * (self.mem_hdr + self.tlp_ovhd) + self._acks(cpls)
+            downs += size + cpls * (CPL_HDR + self.tlp_ovhd) + \
+                     self._acks(reqs)
+        return ups, downs
+
+    def gbps(self, test, size, off=0):
+        """Payload bandwidth in Gb/s achievable with DMAs of @size bytes
+        at host offset @off for @test (BW_RD, BW_WR or BW_RW)"""
+        ups, downs = self.wire(test, size, off)
+        payload = 2 * size if test == BW_RW else size
+        return self.raw_gbps() * payload / max(ups, downs)
+
+    def efficiency(self, test, size, gbps, off=0):
+        """Fraction of the modelled bandwidth @gbps is"""
+        model = self.gbps(test, size, off)
+        if not model:
+            return 0.0
+        return gbps / model
+
+
+def main():
+    """Print the link configuration and the model for a lspci output
+    file (argument 1) or the first NFP"""
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r') as inf:
+            link = parse_lspci(inf.read(),
+                               sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        link = link_config(0)
+    if not link:
+        print("No PCIe link found")
+        return 1
+    print("%s: %s (from %s)" % (link.addr, link, link.source))
+    model = PCIeModel(link)
+    twr = TableWriter(MODEL_FMT)
+    twr.msg("Modelled bandwidth (Gb/s of %.2f)" % model.raw_gbps())
+    twr.sec()
+    for size in [64, 128, 256, 512, 1024, 2048, 4096]:
+        twr.out((size, model.gbps(BW_RD, size), model.gbps(BW_WR, size),
+                 model.gbps(BW_RW, size)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
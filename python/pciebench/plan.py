@@ -0,0 +1,371 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Planning and running the test points of a sweep spec.
+
+The tables of a spec (see spec.py) are flattened into a list of
+distinct test points, so a point listed in several tables is only
+run once.  The points are then ordered to keep points with the same
+cache setting (and, for host warmed points, the same window) together
+and the run time is estimated with a simple cost model.
+
+When running, the rows of each point are kept and a table is written
+once all of its points (and the tables before it) are done.
+"""
+
+import time
+from collections import OrderedDict
+
+from .debug import log
+from .tablewriter import TableWriter
+from .histogram import save_histograms
+from .rawsamples import RawSampleWriter, make_label
+from .stats import ListStats
+from .sweep import RowBuffer, col_index
+from .hostbuf import WARM_PASSES
+from .simdev import SimModel, PCIEBENCH_LAT_TRANS, PCIEBENCH_BW_TRANS, \
+     PCIEBENCH_JOURNAL_SZ
+from .nfpbench import NFPBench
+from .spec import CACHE_FLAGS
+from .trace import span
+
+# Rough host side costs in seconds and rates in bytes per second.
+# The switch costs are penalties for changing the cache setting (or
+# the host warmed window) from one point to the next.  They keep
+# points with a similar state of the host caches together.
+COSTS = {'point': 0.02,         # writing parameters, reading results
+         'helper': 0.1,         # starting the helper, thrashing
+         'dev_thrash': 0.05,    # thrashing the cache from the device
+         'warm_rate': 2e9,      # warming the host buffers
+         'journal_rate': 100e6, # reading the journal
+         'cache_switch': 0.5,
+         'warm_switch': 0.05,
+         'fw_load': 5.0}
+
+CACHE_ORDER = list(CACHE_FLAGS.keys())
+
+LAT_TEST_CDF_FMT = [("cycles", 8, "%d"), ("ns", 8, "%.0f"),
+                    ("cdf", 10, "%.8f")]
+
+PLAN_FMT = [("#", 5, "%d"), ("Test", 12, "%s"), ("Cache", 6, "%s"),
+            ("Access", 6, "%s"), ("Win", 8, "%z"), ("Size", 5, "%d"),
+            ("HOff", 4, "%d"), ("DOff", 4, "%d"), ('', 0, ''),
+            ("Est", 9, "%t")]
+
+
+def write_cdf(nfp, cdfwr, hist, head):
+    """Write the CDF of the LogLinearHistogram @hist as a new section
+    with heading @head to @cdfwr (set up with LAT_TEST_CDF_FMT)"""
+    cdf_cyc = hist.cdf()
+
+    vals = sorted(cdf_cyc.keys())
+    cdfwr.sec(head)
+    cdfwr.out((vals[0], nfp.cyc2ns(vals[0]), 0.0))
+    for val in vals:
+        cdfwr.out((val, nfp.cyc2ns(val), cdf_cyc[val]))
+
+
+def hms(secs):
+    """Format @secs as h:mm:ss"""
+    secs = int(round(secs))
+    return "%d:%02d:%02d" % (secs // 3600, secs // 60 % 60, secs % 60)
+
+
+class CostModel(object):
+    """Estimates the time taken by test points.
+
+    @lat_trans     Transactions per latency test
+    @bw_trans      Transfers per bandwidth test
+    @helper        True if a C helper runs the tests
+    @device_scale  Scale of the time spent on the device (0 for a
+                   simulated device which does not take any time)
+    @model         SimModel estimating the time spent on the device
+    @costs         Overrides for COSTS
+    """
+
+    def __init__(self, lat_trans=PCIEBENCH_LAT_TRANS,
+                 bw_trans=PCIEBENCH_BW_TRANS, helper=True,
+                 device_scale=1.0, model=None, costs=None):
+        self.lat_trans = lat_trans
+        self.bw_trans = bw_trans
+        self.helper = helper
+        self.device_scale = device_scale
+        self.model = model or SimModel()
+        self.costs = dict(COSTS)
+        self.costs.update(costs or {})
+
+    def point(self, pt):
+        """Return the estimated time taken by point @pt"""
+        costs = self.costs
+        model = self.model
+        secs = costs['point']
+        if self.helper:
+            secs += costs['helper']
+        if pt.is_lat():
+            trans = self.lat_trans
+            if pt.flags & NFPBench.FLAGS_LONG:
+                trans *= 8
+            trans = min(trans, PCIEBENCH_JOURNAL_SZ)
+            dev_ns = trans * (model.lat_ns(pt.test, pt.flags, pt.win_sz,
+                                           pt.trans_sz, pt.h_off) +
+                              model.loop_ns)
+            secs += trans * 4 / costs['journal_rate']
+        else:
+            dev_ns = model.bw_ns(pt.test, pt.flags, pt.win_sz, pt.trans_sz,
+                                 pt.h_off, self.bw_trans)
+        secs += dev_ns * self.device_scale / 1e9
+        if pt.cache == "thrash":
+            secs += costs['dev_thrash']
+        elif pt.cache == "hwarm":
+            secs += float(pt.win_sz) * WARM_PASSES / costs['warm_rate']
+        return secs
+
+    def transition(self, prev, pt):
+        """Return the cost of running @pt after @prev"""
+        if prev is None:
+            return 0.0
+        if prev.cache != pt.cache:
+            return self.costs['cache_switch']
+        if pt.cache == "hwarm" and prev.win_sz != pt.win_sz:
+            return self.costs['warm_switch']
+        return 0.0
+
+    def estimate(self, points):
+        """Return the estimated time to run @points in order"""
+        secs = self.costs['fw_load']
+        prev = None
+        for pt in points:
+            secs += self.transition(prev, pt) + self.point(pt)
+            prev = pt
+        return secs
+
+    @staticmethod
+    def order(points):
+        """Return @points ordered by cache setting, then (for host
+        warmed points) window size.  This minimises the transition
+        costs, the order within a group does not matter."""
+        def _key(pt):
+            return (CACHE_ORDER.index(pt.cache),
+                    pt.win_sz if pt.cache == "hwarm" else 0,
+                    pt.test, pt.flags, pt.trans_sz, pt.win_sz,
+                    pt.h_off, pt.d_off)
+        return sorted(points, key=_key)
+
+    def switches(self, points):
+        """Return the number of transitions with a cost in @points"""
+        return sum(1 for prev, pt in zip(points[:-1], points[1:])
+                   if self.transition(prev, pt))
+
+
+class Plan(object):
+    """The test points of the Tables @tables and the order to run
+    them in.
+
+    @model     CostModel to order the points and estimate the run time
+    @order     "cost" to order by cost, "spec" to run the points in
+               the order of the spec
+    @adaptive  Optional AdaptiveSweep for sections which allow it.
+               Only the coarse grid of these sections is planned, the
+               refinement runs once the coarse grid is done.
+    @name      Optional name of the spec
+    """
+
+    ORDERS = ["cost", "spec"]
+
+    def __init__(self, tables, model=None, order="cost", adaptive=None,
+                 name=None):
+        self.tables = tables
+        self.name = name
+        self.model = model or CostModel()
+        self.adaptive = adaptive
+
+        # Points to write per section (by id), adaptive sections still
+        # to refine and the keys of points whose samples are kept
+        self.out = {}
+        self.refine = []
+        self.keep = set()
+
+        points = OrderedDict()
+        total = 0
+        for table in tables:
+            for sec in table.sections:
+                pts = sec.points
+                if adaptive and sec.adaptive:
+                    pts = [sec.point(win_sz)
+                           for win_sz in adaptive.coarse(sec.win_szs())]
+                    self.refine.append((table, sec))
+                self.out[id(sec)] = pts
+                for pt in pts:
+                    total += 1
+                    points.setdefault(pt.key, pt)
+                    if table.details:
+                        self.keep.add(pt.key)
+        self.dups = total - len(points)
+        self.points = list(points.values())
+        if order == "cost":
+            self.order = self.model.order(self.points)
+        else:
+            self.order = self.points
+
+        self.rows = {}
+        self.samples = {}
+
+        # Optional progress.Progress updated while running
+        self.progress = None
+
+    def estimate(self):
+        """Return the estimated run time of the planned points and of
+        the most points adaptive sweeps may add"""
+        extra = 0.0
+        for _, sec in self.refine:
+            pts = self.out[id(sec)]
+            budget = self.adaptive.max_points or len(sec.points)
+            if budget > len(pts):
+                extra += (budget - len(pts)) * \
+                         sum(self.model.point(pt) for pt in pts) / len(pts)
+        return self.model.estimate(self.order), extra
+
+    def summary(self):
+        """Return a description of the plan"""
+        est, extra = self.estimate()
+        res = "Plan: %d tables, %d test points (%d duplicates), " \
+              "%d cache state changes\n" % \
+              (len(self.tables), len(self.points), self.dups,
+               self.model.switches(self.order))
+        res += "Estimated run time: %s (in spec order: %s)" % \
+               (hms(est), hms(self.model.estimate(self.points)))
+        if extra:
+            res += ", adaptive sweeps may add up to %s" % hms(extra)
+        return res
+
+    def write(self, twr):
+        """Write the points in order to @twr (set up with PLAN_FMT)"""
+        twr.sec()
+        for idx, pt in enumerate(self.order):
+            access = "rnd" if pt.flags & NFPBench.FLAGS_RANDOM else "seq"
+            twr.out((idx, NFPBench.TEST_NAMES[pt.test], pt.cache, access,
+                     pt.win_sz, pt.trans_sz, pt.h_off, pt.d_off,
+                     self.model.point(pt) * 1e9))
+
+    def _measure(self, nfp, pt):
+        """Run point @pt (unless it was run already)"""
+        if pt.key in self.rows:
+            return
+        if self.progress:
+            self.progress.begin(pt)
+        buf = RowBuffer()
+        keep = pt.key in self.keep
+        if pt.is_lat():
+            nfp.lat_test(buf, *pt.args(), keep=keep)
+        else:
+            nfp.bw_test(buf, *pt.args())
+        self.rows[pt.key] = buf.rows[-1]
+        if self.progress:
+            self.progress.end(pt, self.rows[pt.key])
+        # Kept samples are read back from the checkpoint if possible
+        if keep and not (nfp.checkpoint and nfp.checkpoint.record(pt.key)):
+            self.samples[pt.key] = buf.samples[-1]
+
+    def _get_samples(self, nfp, key):
+        """Return the samples kept for point @key"""
+        if key in self.samples:
+            return self.samples[key]
+        return nfp.checkpoint.samples(nfp.checkpoint.record(key))
+
+    def _refine(self, nfp, table, sec):
+        """Run the adaptive sweep of section @sec"""
+        col = col_index(table.fmt, sec.adaptive)
+        def _measure(win_sz):
+            pt = sec.point(win_sz)
+            self._measure(nfp, pt)
+            return self.rows[pt.key][col]
+        vals = self.adaptive.run(sec.win_szs(), _measure)
+        self.out[id(sec)] = [sec.point(win_sz) for win_sz, _ in vals]
+
+    def _ready(self, table):
+        """True if all points of @table are done"""
+        return all(pt.key in self.rows
+                   for sec in table.sections for pt in self.out[id(sec)])
+
+    def _write_table(self, nfp, table, outdir):
+        """Write @table to @outdir"""
+        twr = TableWriter(table.fmt, store=nfp.store)
+        twr.open(outdir + table.name, TableWriter.ALL)
+        if table.details:
+            cdfwr = TableWriter(LAT_TEST_CDF_FMT, stdout=False,
+                                store=nfp.store, batched=True)
+            cdfwr.open(outdir + table.name + "_cdf", TableWriter.ALL)
+            raw = RawSampleWriter(outdir + table.name + "_raw.bin",
+                                  nfp.freq_hz)
+            hists = {}
+        if table.msg:
+            twr.msg(table.msg)
+
+        for sec in table.sections:
+            twr.sec()
+            for pt in self.out[id(sec)]:
+                if not table.details:
+                    twr.out(self.rows[pt.key])
+                    continue
+                samples = self._get_samples(nfp, pt.key)
+                twr.out(self.rows[pt.key], samples)
+
+                name = NFPBench.TEST_NAMES[pt.test]
+                hwarm = pt.flags & NFPBench.FLAGS_HOSTWARM
+                head = "test=%s trans_sz=%d win_sz=%d cache=%s" % \
+                       (name, pt.trans_sz, pt.win_sz,
+                        "hwarm" if hwarm else "cold")
+                hists[head] = ListStats(samples).hdr_histo()
+                write_cdf(nfp, cdfwr, hists[head], head)
+                raw.add(make_label(name, hwarm, pt.win_sz, pt.trans_sz),
+                        samples, test=pt.test, flags=pt.flags,
+                        win_sz=pt.win_sz, trans_sz=pt.trans_sz)
+
+        if table.details:
+            cdfwr.close(TableWriter.ALL)
+            twr.close(TableWriter.ALL)
+            raw.close()
+            save_histograms(outdir + table.name + "_hist.json", hists)
+        else:
+            twr.close(TableWriter.ALL)
+
+    def run(self, nfp, outdir, progress=None):
+        """Run the plan on the NFPBench @nfp and write the tables to
+        @outdir, updating the optional progress.Progress @progress"""
+        start = time.time()
+        todo = list(self.tables)
+        refine = list(self.refine)
+        self.progress = progress
+        if progress:
+            progress.plan(self)
+            progress.tables(0, todo[0].name if todo else None)
+        with span("plan", points=len(self.order)):
+            for pt in self.order + [None]:
+                if pt is not None:
+                    self._measure(nfp, pt)
+                for table, sec in list(refine):
+                    if all(p.key in self.rows for p in self.out[id(sec)]):
+                        refine.remove((table, sec))
+                        self._refine(nfp, table, sec)
+                while todo and self._ready(todo[0]) and \
+                      not any(table is todo[0] for table, _ in refine):
+                    with span("table", table=todo[0].name):
+                        self._write_table(nfp, todo.pop(0), outdir)
+                    if progress:
+                        progress.tables(len(self.tables) - len(todo),
+                                        todo[0].name if todo else None)
+        log("Ran %d test points in %s (estimated %s)" %
+            (len(self.rows), hms(time.time() - start),
+             hms(self.estimate()[0])))
@@ -0,0 +1,425 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Live progress of a running suite.
+
+A Progress object is updated by Plan.run() as test points start and
+finish: the points done and planned, the point running, the estimated
+time left and the latest latency and bandwidth values per test.  The
+time spent per phase is taken from the span totals (see trace.py).
+
+serve() publishes a Progress while the suite runs, either over HTTP
+on a local port:
+
+    /metrics   Prometheus text format
+    /progress  the state as JSON
+
+or on a Unix socket, which streams the state as one JSON object per
+line, a line for every update (and every HEARTBEAT seconds), until the
+suite is done or the client disconnects.
+
+    python -m pciebench.progress ADDR
+
+prints the metrics or the stream of a running suite.
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    import socketserver
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    import SocketServer as socketserver
+
+from .debug import err, dbg
+from .nfpbench import NFPBench
+from .sweep import col_index
+from . import trace
+
+# Seconds between lines on the Unix socket without updates
+HEARTBEAT = 10.0
+
+# Columns reported as the latest values, by test kind
+LAT_COLS = [("median", "Median"), ("p99", "99%")]
+BW_COLS = [("gbps", "Gb/s"), ("eff_pct", "Eff%")]
+
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+def _label(val):
+    """Escape @val for use as a Prometheus label value"""
+    return str(val).replace('\\', '\\\\').replace('"', '\\"') \
+                   .replace('\n', '\\n')
+
+
+def _labels(**labels):
+    """Return the Prometheus label set of @labels"""
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, _label(labels[key]))
+                             for key in sorted(labels))
+
+
+def _value(val):
+    """Format @val as a Prometheus sample value"""
+    if val is None or val != val:
+        return "NaN"
+    return "%r" % float(val)
+
+
+def describe(pt):
+    """Return the parameters of the test point @pt as a dictionary"""
+    return {'test': NFPBench.TEST_NAMES[pt.test], 'cache': pt.cache,
+            'access': "rnd" if pt.flags & NFPBench.FLAGS_RANDOM else "seq",
+            'win_sz': pt.win_sz, 'trans_sz': pt.trans_sz,
+            'h_off': pt.h_off, 'd_off': pt.d_off}
+
+
+class Progress(object):
+    """Progress of suite @suite on NFP @nfp_num.  The update methods
+    are called from the thread running the suite, the exporters read
+    snapshot() and metrics() from their own threads."""
+
+    def __init__(self, suite, nfp_num=0):
+        self.suite = suite
+        self.nfp_num = nfp_num
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.state = STATE_RUNNING
+        self.start = time.time()
+
+        self.total = 0
+        self.done = 0
+        self.tables_total = 0
+        self.tables_done = 0
+        self.table = None
+        self.point = None
+        self.point_start = None
+
+        # Estimated time of the points planned, of those done
+        self.model = None
+        self.plan_start = None
+        self.est_total = 0.0
+        self.est_done = 0.0
+
+        # Test name -> dictionary of the latest values
+        self.latest = {}
+
+    def _update(self):
+        """Wake up the streams waiting for an update.  Must be called
+        with the condition held."""
+        self.seq += 1
+        self.cond.notify_all()
+
+    def plan(self, plan):
+        """Start running the Plan @plan"""
+        with self.cond:
+            self.model = plan.model
+            self.plan_start = time.time()
+            self.total = len(plan.order)
+            self.tables_total = len(plan.tables)
+            self.est_total = sum(plan.model.point(pt) for pt in plan.order)
+            self._update()
+
+    def begin(self, pt):
+        """Point @pt (a spec.Point) starts"""
+        with self.cond:
+            self.point = describe(pt)
+            self.point_start = time.time()
+            self._update()
+
+    def end(self, pt, row):
+        """Point @pt is done, @row is its result"""
+        desc = describe(pt)
+        if pt.is_lat():
+            fmt, cols = NFPBench.lat_fmt, LAT_COLS
+        else:
+            fmt, cols = NFPBench.bw_fmt, BW_COLS
+        vals = dict((name, row[col_index(fmt, col)]) for name, col in cols)
+        vals.update(desc)
+        with self.cond:
+            self.done += 1
+            # Adaptive sweeps add points to the plan
+            self.total = max(self.total, self.done)
+            if self.model:
+                self.est_done += self.model.point(pt)
+                self.est_total = max(self.est_total, self.est_done)
+            self.latest[desc['test']] = vals
+            self.point = None
+            self.point_start = None
+            self._update()
+
+    def tables(self, done, name):
+        """@done tables are written, @name is the next one (or None)"""
+        with self.cond:
+            self.tables_done = done
+            self.table = name
+            self._update()
+
+    def finish(self, failed=False):
+        """The suite ended"""
+        with self.cond:
+            self.state = STATE_FAILED if failed else STATE_DONE
+            self.point = None
+            self._update()
+
+    def eta(self):
+        """Return the estimated seconds left: the estimate of the
+        points left, scaled by how the points done compared with their
+        estimate.  None if unknown."""
+        if self.state != STATE_RUNNING:
+            return 0.0
+        if not self.est_total:
+            return None
+        left = self.est_total - self.est_done
+        if self.est_done:
+            left *= (time.time() - self.plan_start) / self.est_done
+        return left
+
+    def snapshot(self):
+        """Return the state as a dictionary"""
+        with self.cond:
+            now = time.time()
+            return {'seq': self.seq, 'suite': self.suite,
+                    'nfp': self.nfp_num, 'state': self.state,
+                    'time': now, 'elapsed': now - self.start,
+                    'eta': self.eta(),
+                    'points': {'done': self.done, 'total': self.total},
+                    'tables': {'done': self.tables_done,
+                               'total': self.tables_total,
+                               'next': self.table},
+                    'point': dict(self.point, elapsed=now - self.point_start)
+                             if self.point else None,
+                    'phases': dict((name, {'count': cnt, 'secs': secs})
+                                   for name, (cnt, secs) in
+                                   trace.totals().items()),
+                    'latest': dict((test, dict(vals))
+                                   for test, vals in self.latest.items())}
+
+    def metrics(self):
+        """Return the state in the Prometheus text format"""
+        snap = self.snapshot()
+        res = []
+
+        def _metric(name, mtype, helptext, samples):
+            res.append("# HELP pciebench_%s %s" % (name, helptext))
+            res.append("# TYPE pciebench_%s %s" % (name, mtype))
+            for labels, val in samples:
+                res.append("pciebench_%s%s %s" %
+                           (name, _labels(**labels), _value(val)))
+
+        _metric("info", "gauge", "The suite running",
+                [({'suite': snap['suite'], 'nfp': snap['nfp'],
+                   'state': snap['state']}, 1)])
+        _metric("running", "gauge", "1 while the suite is running",
+                [({}, snap['state'] == STATE_RUNNING)])
+        _metric("elapsed_seconds", "gauge", "Time since the suite started",
+                [({}, snap['elapsed'])])
+        _metric("eta_seconds", "gauge", "Estimated time left",
+                [({}, snap['eta'])])
+        _metric("points_done", "gauge", "Test points done",
+                [({}, snap['points']['done'])])
+        _metric("points_total", "gauge", "Test points planned",
+                [({}, snap['points']['total'])])
+        _metric("tables_done", "gauge", "Tables written",
+                [({}, snap['tables']['done'])])
+        _metric("tables_total", "gauge", "Tables planned",
+                [({}, snap['tables']['total'])])
+        point = snap['point']
+        _metric("point_info", "gauge", "The test point running",
+                [(dict((key, val) for key, val in point.items()
+                       if key != 'elapsed'), 1)] if point else [])
+        _metric("point_elapsed_seconds", "gauge",
+                "Time the test point has been running",
+                [({}, point['elapsed'])] if point else [])
+        phases = sorted(snap['phases'].items())
+        _metric("phase_seconds_total", "counter", "Time spent per phase",
+                [({'phase': name}, ent['secs']) for name, ent in phases])
+        _metric("phase_count_total", "counter", "Spans ended per phase",
+                [({'phase': name}, ent['count']) for name, ent in phases])
+        latest = sorted(snap['latest'].items())
+        _metric("latency_ns", "gauge",
+                "Latency of the latest point per test",
+                [({'test': test, 'stat': stat}, vals[stat])
+                 for test, vals in latest for stat, _ in LAT_COLS
+                 if stat in vals])
+        _metric("bandwidth_gbps", "gauge",
+                "Bandwidth of the latest point per test",
+                [({'test': test}, vals['gbps'])
+                 for test, vals in latest if 'gbps' in vals])
+        _metric("bandwidth_efficiency_percent", "gauge",
+                "PCIe efficiency of the latest point per test",
+                [({'test': test}, vals['eff_pct'])
+                 for test, vals in latest if 'eff_pct' in vals])
+        return "\n".join(res) + "\n"
+
+    def wait(self, seq, timeout):
+        """Wait up to @timeout seconds for an update after @seq"""
+        with self.cond:
+            if self.seq == seq and self.state == STATE_RUNNING:
+                self.cond.wait(timeout)
+            return self.seq
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    """Serves /metrics and /progress"""
+
+    def do_GET(self):
+        """Handle a GET request"""
+        progress = self.server.progress
+        path = self.path.split('?')[0]
+        if path == "/metrics":
+            body = progress.metrics()
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        elif path in ["/", "/progress"]:
+            body = json.dumps(progress.snapshot(), sort_keys=True) + "\n"
+            ctype = "application/json"
+        else:
+            self.send_error(404)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        dbg("Progress: %s %s" % (self.address_string(), fmt % args))
+
+
+class _StreamHandler(socketserver.StreamRequestHandler):
+    """Streams the state as JSON lines"""
+
+    def handle(self):
+        progress = self.server.progress
+        seq = None
+        while True:
+            snap = progress.snapshot()
+            seq = snap['seq']
+            try:
+                self.wfile.write((json.dumps(snap, sort_keys=True) +
+                                  "\n").encode('utf-8'))
+                self.wfile.flush()
+            except (IOError, OSError):
+                return
+            if snap['state'] != STATE_RUNNING:
+                return
+            progress.wait(seq, HEARTBEAT)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def parse_addr(addr):
+    """Return ('http', (host, port)) for @addr given as [HOST:]PORT or
+    ('unix', path) for a path"""
+    host, _, port = addr.rpartition(':')
+    if port.isdigit() and '/' not in addr:
+        return 'http', (host or "127.0.0.1", int(port))
+    return 'unix', addr
+
+
+class Exporter(object):
+    """Publishes @progress at @addr (see parse_addr()) from a thread"""
+
+    def __init__(self, progress, addr):
+        self.kind, self.addr = parse_addr(addr)
+        try:
+            if self.kind == 'http':
+                self.server = _ThreadingHTTPServer(self.addr, _HTTPHandler)
+            else:
+                if os.path.exists(self.addr):
+                    os.unlink(self.addr)
+                self.server = _ThreadingUnixServer(self.addr, _StreamHandler)
+        except (IOError, OSError, socket.error) as exc:
+            err("Can't publish the progress at %s: %s" % (addr, exc))
+        self.server.progress = progress
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self):
+        """Where the progress is published"""
+        if self.kind == 'http':
+            return "http://%s:%d/metrics" % self.server.server_address[:2]
+        return "unix:%s" % self.addr
+
+    def close(self):
+        """Stop publishing"""
+        self.server.shutdown()
+        self.server.server_close()
+        if self.kind == 'unix' and os.path.exists(self.addr):
+            os.unlink(self.addr)
+
+
+def serve(progress, addr):
+    """Publish @progress at @addr and return the Exporter"""
+    return Exporter(progress, addr)
+
+
+def main():
+    """Print the metrics or the stream published at the address given
+    on the command line"""
+    if len(sys.argv) != 2:
+        print("usage: python -m pciebench.progress [HOST:]PORT|SOCKET")
+        return 2
+    kind, addr = parse_addr(sys.argv[1])
+    if kind == 'http':
+        sock = socket.create_connection(addr)
+        sock.sendall(("GET /metrics HTTP/1.0\r\nHost: %s\r\n\r\n" %
+                      addr[0]).encode('ascii'))
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(addr)
+    # Skip the HTTP response header
+    head = kind == 'http'
+    buf = b""
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            if head:
+                buf += data
+                if b"\r\n\r\n" not in buf:
+                    continue
+                data = buf.split(b"\r\n\r\n", 1)[1]
+                head = False
+            sys.stdout.write(data.decode('utf-8'))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,377 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Compact binary files of raw latency samples.
+
+The samples are stored as ME cycle counts, not nanoseconds.  A file
+starts with a header holding the ME frequency, followed by any number
+of blocks, one per test.  Each block has a header with the test
+parameters, a label and the number of samples, followed by the
+samples.  Every sample is stored as the difference to the previous
+one (zig-zag and LEB128 varint encoded), so the typical sample takes
+one or two bytes instead of the 5-10 bytes of the text format.
+
+All integers in the headers are little endian:
+
+  file:   magic (8 bytes), version (u32), frequency in Hz (u64)
+  block:  magic (4 bytes), test (u32), flags (u32), window size (u64),
+          transaction size (u32), host offset (u32), device offset
+          (u32), number of samples (u64), encoded length (u64), label
+          length (u16), label (UTF-8), encoded samples
+
+RawSampleWriter streams blocks to a file.  RawSampleReader maps a
+file into memory, finds the blocks by only reading their headers and
+decodes samples on demand.  to_text() and from_text() convert to and
+from the text format the raw samples used to be written in.
+"""
+
+import array
+import mmap
+import re
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .debug import err
+
+FILE_MAGIC = b'NPBRAW\r\n'
+FILE_VERSION = 1
+_FILE_HDR = struct.Struct('<8sIQ')
+
+BLOCK_MAGIC = b'BLK\0'
+_BLOCK_HDR = struct.Struct('<4sIIQIIIQQH')
+
+# Label of the blocks as written for the details tables, e.g.
+# "LAT_DMA_RD Warm Winsz=8192 trans_sz=64"
+_LABEL_RE = re.compile(r'^(\S+) (Warm|Cold) Winsz=(\d+) trans_sz=(\d+)$')
+
+
+def _zigzag(diff):
+    """Map a signed difference to an unsigned value"""
+    return diff << 1 if diff >= 0 else ((-diff) << 1) - 1
+
+
+def _unzigzag(val):
+    """Inverse of _zigzag()"""
+    return -((val + 1) >> 1) if val & 1 else val >> 1
+
+
+def encode(vals, prev=0):
+    """Delta and varint encode the samples @vals, starting from the
+    value @prev.  Returns the encoded bytes and the last value."""
+    if numpy is not None:
+        return _encode_numpy(vals, prev)
+    out = bytearray()
+    for val in vals:
+        val = int(val)
+        zz = _zigzag(val - prev)
+        prev = val
+        while zz >= 0x80:
+            out.append((zz & 0x7f) | 0x80)
+            zz >>= 7
+        out.append(zz)
+    return bytes(out), prev
+
+
+def _encode_numpy(vals, prev):
+    """encode() using NumPy"""
+    vals = numpy.asarray(vals, dtype=numpy.int64)
+    if not len(vals):
+        return b'', prev
+    diff = numpy.diff(vals, prepend=numpy.int64(prev))
+    zz = ((diff << 1) ^ (diff >> 63)).astype(numpy.uint64)
+
+    # number of bytes for each value (samples are 32bit, so at most 5)
+    nbytes = numpy.ones(len(zz), dtype=numpy.int64)
+    for shift in range(7, 64, 7):
+        big = zz >= numpy.uint64(1 << shift)
+        if not big.any():
+            break
+        nbytes += big
+    starts = numpy.cumsum(nbytes) - nbytes
+
+    out = numpy.empty(int(nbytes.sum()), dtype=numpy.uint8)
+    for pos in range(int(nbytes.max())):
+        sel = nbytes > pos
+        byte = (zz[sel] >> numpy.uint64(7 * pos)) & numpy.uint64(0x7f)
+        byte |= (nbytes[sel] > pos + 1).astype(numpy.uint64) << \
+                numpy.uint64(7)
+        out[starts[sel] + pos] = byte
+    return out.tobytes(), int(vals[-1])
+
+
+def decode(mem, count, prev=0):
+    """Decode @count samples from the bytes like object @mem.
+    Returns an array('I') or, if NumPy is available, a NumPy array of
+    uint32."""
+    if numpy is not None:
+        return _decode_numpy(mem, count, prev)
+    res = array.array('I', [0]) * count
+    for idx, val in enumerate(_iter_decode(mem, count, prev)):
+        res[idx] = val
+    return res
+
+
+def _iter_decode(mem, count, prev=0):
+    """Generator decoding @count samples from @mem one at a time"""
+    mem = memoryview(mem)
+    pos = 0
+    for _ in range(count):
+        zz = 0
+        shift = 0
+        while True:
+            byte = mem[pos]
+            if not isinstance(byte, int):
+                byte = ord(byte)
+            pos += 1
+            zz |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        prev += _unzigzag(zz)
+        yield prev
+
+
+def _decode_numpy(mem, count, prev):
+    """decode() using NumPy"""
+    data = numpy.frombuffer(mem, dtype=numpy.uint8)
+    if not count:
+        return numpy.zeros(0, dtype=numpy.uint32)
+    ends = numpy.flatnonzero(data < 0x80)
+    if len(ends) != count or ends[-1] != len(data) - 1:
+        err("Corrupt raw sample data: %d values, expected %d" %
+            (len(ends), count))
+    starts = numpy.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shift = numpy.arange(len(data)) - numpy.repeat(starts, ends - starts + 1)
+    vals = (data & 0x7f).astype(numpy.uint64) << \
+           (7 * shift).astype(numpy.uint64)
+    zz = numpy.add.reduceat(vals, starts).astype(numpy.int64)
+    diff = (zz >> 1) ^ -(zz & 1)
+    return (numpy.cumsum(diff) + prev).astype(numpy.uint32)
+
+
+def make_label(test_name, hostwarm, win_sz, trans_sz):
+    """Return the label used for a block of samples"""
+    return "%s %s Winsz=%d trans_sz=%d" % \
+           (test_name, "Warm" if hostwarm else "Cold", win_sz, trans_sz)
+
+
+class RawBlock(object):
+    """The header of a block of samples in a RawSampleReader"""
+
+    def __init__(self, fields, label, offset):
+        (_, self.test, self.flags, self.win_sz, self.trans_sz,
+         self.h_off, self.d_off, self.count, self.nbytes, _) = fields
+        self.label = label
+        self.offset = offset
+
+    def __repr__(self):
+        return "<RawBlock %s: %d samples>" % (self.label, self.count)
+
+
+class RawSampleWriter(object):
+    """Write blocks of raw samples to the file @path.  @freq_hz is the
+    ME frequency the cycle counts are relative to.
+
+    Blocks are written either in one go with add() or streamed with
+    start(), any number of write() calls and end().  The block header
+    is filled in by end(), so a block need not be held in memory."""
+
+    def __init__(self, path, freq_hz):
+        self.path = path
+        self.freq_hz = int(freq_hz)
+        self.outf = open(path, 'wb')
+        self.outf.write(_FILE_HDR.pack(FILE_MAGIC, FILE_VERSION,
+                                       self.freq_hz))
+        self.blk = None
+
+    def start(self, label, test=0, flags=0, win_sz=0, trans_sz=0,
+              h_off=0, d_off=0):
+        """Start a new block with @label and the test parameters"""
+        if self.blk:
+            err("Raw sample block %s not ended" % self.blk['label'])
+        label = label.encode('utf-8')
+        self.blk = {'label': label, 'params': (test, flags, win_sz,
+                                               trans_sz, h_off, d_off),
+                    'pos': self.outf.tell(), 'count': 0, 'nbytes': 0,
+                    'prev': 0}
+        # write a placeholder header, completed by end()
+        self.outf.write(b'\0' * _BLOCK_HDR.size + label)
+
+    def write(self, samples):
+        """Append the cycle counts @samples to the current block"""
+        if not self.blk:
+            err("No raw sample block started")
+        data, self.blk['prev'] = encode(samples, self.blk['prev'])
+        self.outf.write(data)
+        self.blk['count'] += len(samples)
+        self.blk['nbytes'] += len(data)
+
+    def end(self):
+        """Complete the current block"""
+        blk = self.blk
+        if not blk:
+            err("No raw sample block started")
+        end = self.outf.tell()
+        self.outf.seek(blk['pos'])
+        self.outf.write(_BLOCK_HDR.pack(BLOCK_MAGIC, *(blk['params'] + (
+            blk['count'], blk['nbytes'], len(blk['label'])))))
+        self.outf.seek(end)
+        self.blk = None
+
+    def add(self, label, samples, **params):
+        """Write a block with @label and @samples.  @params are the
+        test parameters as for start()."""
+        self.start(label, **params)
+        self.write(samples)
+        self.end()
+
+    def close(self):
+        """Close the file"""
+        if self.blk:
+            self.end()
+        self.outf.close()
+
+
+class RawSampleReader(object):
+    """Read the raw sample file @path.  The file is mapped into memory
+    and only the headers are read when opening it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.inf = open(path, 'rb')
+        self.mem = mmap.mmap(self.inf.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mem) < _FILE_HDR.size:
+            err("%s: not a raw sample file" % path)
+        magic, version, self.freq_hz = _FILE_HDR.unpack_from(self.mem, 0)
+        if magic != FILE_MAGIC:
+            err("%s: not a raw sample file" % path)
+        if version != FILE_VERSION:
+            err("%s: unsupported version %d" % (path, version))
+
+        self.blocks = []
+        pos = _FILE_HDR.size
+        while pos < len(self.mem):
+            fields = _BLOCK_HDR.unpack_from(self.mem, pos)
+            if fields[0] != BLOCK_MAGIC:
+                err("%s: bad block header at offset %d" % (path, pos))
+            pos += _BLOCK_HDR.size
+            label = self.mem[pos:pos + fields[-1]].decode('utf-8')
+            pos += fields[-1]
+            blk = RawBlock(fields, label, pos)
+            self.blocks.append(blk)
+            pos += blk.nbytes
+
+    def _data(self, blk):
+        """Return a memoryview of the encoded samples of @blk"""
+        try:
+            return memoryview(self.mem)[blk.offset:blk.offset + blk.nbytes]
+        except TypeError:
+            # Python 2 mmap objects don't support memoryview
+            return self.mem[blk.offset:blk.offset + blk.nbytes]
+
+    def cyc2ns(self, cycles):
+        """Convert ME cycles to nanoseconds (as NFPBench.cyc2ns())"""
+        return float(cycles) * (1000 * 1000 * 1000) / self.freq_hz
+
+    def cycles(self, blk):
+        """Return all samples of @blk in cycles"""
+        return decode(self._data(blk), blk.count)
+
+    def ns(self, blk):
+        """Return all samples of @blk in nanoseconds, as a NumPy array
+        of floats, or a list if NumPy isn't available"""
+        cyc = self.cycles(blk)
+        if numpy is not None:
+            return cyc.astype(numpy.float64) * (1000 * 1000 * 1000) / \
+                   self.freq_hz
+        return [self.cyc2ns(val) for val in cyc]
+
+    def iter_ns(self, blk):
+        """Generator yielding the samples of @blk in nanoseconds one
+        at a time, without decoding the whole block"""
+        for val in _iter_decode(self._data(blk), blk.count):
+            yield self.cyc2ns(val)
+
+    def close(self):
+        """Unmap and close the file"""
+        try:
+            self.mem.close()
+        except BufferError:
+            # Still used by a generator returned by iter_ns().  The
+            # mapping goes away with it.
+            pass
+        self.inf.close()
+
+
+def to_text(inpath, outpath):
+    """Convert the raw sample file @inpath to the text format at
+    @outpath (a comment line with the label, the samples in ns, one
+    per line, and two empty lines per block)"""
+    rdr = RawSampleReader(inpath)
+    with open(outpath, 'w') as outf:
+        for blk in rdr.blocks:
+            outf.write("# %s (values in ns)\n" % blk.label)
+            outf.write(''.join(["%.0f\n" % val for val in rdr.ns(blk)]))
+            outf.write("\n\n")
+    rdr.close()
+
+
+def from_text(inpath, outpath, freq_hz):
+    """Convert the text file @inpath to the raw sample file @outpath.
+    Nanoseconds are converted to the nearest cycle count at
+    @freq_hz, so samples may be off by a cycle compared to the
+    original measurements.  Test parameters are recovered from labels
+    in the format written for the details tables."""
+    from .nfpbench import NFPBench
+
+    names = dict((name, num) for num, name in NFPBench.TEST_NAMES.items())
+    wrt = RawSampleWriter(outpath, freq_hz)
+
+    def _flush(label, vals):
+        params = {}
+        match = _LABEL_RE.match(label)
+        if match:
+            params = {'test': names.get(match.group(1), 0),
+                      'flags': NFPBench.FLAGS_HOSTWARM
+                               if match.group(2) == "Warm" else 0,
+                      'win_sz': int(match.group(3)),
+                      'trans_sz': int(match.group(4))}
+        wrt.add(label, vals, **params)
+
+    label = None
+    vals = []
+    with open(inpath, 'r') as inf:
+        for line in inf:
+            line = line.strip()
+            if line.startswith('#'):
+                if label is not None:
+                    _flush(label, vals)
+                label = line[1:].strip()
+                if label.endswith("(values in ns)"):
+                    label = label[:-len("(values in ns)")].strip()
+                vals = []
+            elif line:
+                vals.append(int(round(float(line) * freq_hz /
+                                      (1000 * 1000 * 1000))))
+    if label is not None:
+        _flush(label, vals)
+    wrt.close()
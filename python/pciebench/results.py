@@ -0,0 +1,195 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Decoded test results.
+
+The firmware reports every test as start and end timestamps plus four
+generic words, r0 to r3 (struct test_result in me/pciebench.h), whose
+meaning depends on the test.  A result class per kind of test names
+the words it uses (@FIELDS) and derives rates from them, the cycle
+count and the ME frequency.  The classes are registered for the tests
+they describe and decode() picks the right one.
+
+The records use __slots__, as a suite creates one per test point.
+"""
+
+from .debug import err
+from .simdev import LAT_CMD_RD, LAT_CMD_WRRD, LAT_DMA_RD, LAT_DMA_WRRD, \
+    BW_DMA_RD, BW_DMA_WR, BW_DMA_RW, LAT_FLAGS_LONG, \
+    PCIEBENCH_JOURNAL_SZ, PCIEBENCH_LAT_TRANS, PCIEBENCH_BW_TRANS
+
+# Test number -> result class
+_SCHEMAS = {}
+
+
+def register(cls):
+    """Class decorator registering @cls for the tests in cls.TESTS"""
+    for test in cls.TESTS:
+        if test in _SCHEMAS:
+            err("Test %d already has a result schema" % test)
+        _SCHEMAS[test] = cls
+    return cls
+
+
+def schema(test):
+    """Return the result class for @test"""
+    if test not in _SCHEMAS:
+        err("No result schema for test %d" % test)
+    return _SCHEMAS[test]
+
+
+def decode(test, name, params, cycles, words, freq_hz):
+    """Decode the result of @test (called @name) run with @params
+    (flags, transfer size, window size, host and device offset), which
+    took @cycles ME cycles and returned @words, on a ME running at
+    @freq_hz"""
+    return schema(test)(test, name, params, cycles, words, freq_hz)
+
+
+class TestResult(object):
+    """Base class of the test results"""
+
+    __slots__ = ('test', 'name', 'flags', 'trans_sz', 'win_sz', 'h_off',
+                 'd_off', 'cycles', 'freq_hz', 'words')
+
+    # Tests described, names of the result words used
+    TESTS = []
+    FIELDS = ()
+
+    def __init__(self, test, name, params, cycles, words, freq_hz):
+        self.test = test
+        self.name = name
+        params = list(params) + [0] * (5 - len(params))
+        self.flags, self.trans_sz, self.win_sz, self.h_off, self.d_off = \
+            params[:5]
+        self.cycles = cycles
+        self.freq_hz = freq_hz
+        self.words = tuple(words)
+        for field, val in zip(self.FIELDS, self.words):
+            setattr(self, field, val)
+
+    @property
+    def time_ns(self):
+        """Duration of the test in ns"""
+        return float(self.cycles) * (1000 * 1000 * 1000) / self.freq_hz
+
+    @property
+    def count(self):
+        """Number of transactions performed"""
+        return getattr(self, self.FIELDS[0])
+
+    @property
+    def expected(self):
+        """Number of transactions the firmware performs by default"""
+        return 0
+
+    @property
+    def complete(self):
+        """Fraction of the expected transactions performed"""
+        if not self.expected:
+            return 0.0
+        return float(self.count) / self.expected
+
+    @property
+    def tps(self):
+        """Transactions per second"""
+        time_ns = self.time_ns
+        if not time_ns:
+            return 0.0
+        return float(self.count) * (1000 * 1000 * 1000) / time_ns
+
+    @property
+    def mtps(self):
+        """Million transactions per second"""
+        time_ns = self.time_ns
+        if not time_ns:
+            return 0.0
+        return float(self.count) * 1000 / time_ns
+
+    def fields(self):
+        """Return the named result words as a dictionary"""
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __repr__(self):
+        return "%s(%s, %s, cycles=%d)" % (
+            self.__class__.__name__, self.name,
+            ", ".join("%s=%s" % (field, getattr(self, field))
+                      for field in self.FIELDS), self.cycles)
+
+
+@register
+class LatResult(TestResult):
+    """Result of a latency test.  @samples transactions were timed
+    and their latencies written to the journal."""
+
+    __slots__ = ('samples',)
+
+    TESTS = [LAT_CMD_RD, LAT_CMD_WRRD, LAT_DMA_RD, LAT_DMA_WRRD]
+    FIELDS = ('samples',)
+
+    @property
+    def expected(self):
+        trans = PCIEBENCH_LAT_TRANS
+        if self.flags & LAT_FLAGS_LONG:
+            trans *= 8
+        return min(trans, PCIEBENCH_JOURNAL_SZ)
+
+    @property
+    def loop_ns(self):
+        """Average time per transaction, including the ME's overhead
+        for timing and journaling it"""
+        if not self.samples:
+            return 0.0
+        return self.time_ns / self.samples
+
+
+@register
+class BwResult(TestResult):
+    """Result of a bandwidth test: @trans DMAs of @trans_sz bytes"""
+
+    __slots__ = ('trans',)
+
+    TESTS = [BW_DMA_RD, BW_DMA_WR, BW_DMA_RW]
+    FIELDS = ('trans',)
+
+    @property
+    def expected(self):
+        if self.flags & LAT_FLAGS_LONG:
+            return PCIEBENCH_JOURNAL_SZ
+        return PCIEBENCH_BW_TRANS
+
+    @property
+    def bytes(self):
+        """Number of bytes transferred"""
+        return self.trans * self.trans_sz
+
+    @property
+    def gbps(self):
+        """Bandwidth in Gb/s"""
+        time_ns = self.time_ns
+        if not time_ns:
+            return 0.0
+        return float(self.trans * self.trans_sz * 8) / time_ns
+
+    def efficiency(self, peak_gbps):
+        """Fraction of @peak_gbps achieved"""
+        if not peak_gbps:
+            return 0.0
+        return self.gbps / peak_gbps
+
+    def __str__(self):
+        return "%s %dB win %d: %d DMAs in %.0fns, %.2f Gb/s, %.2f Mtps" % \
+            (self.name, self.trans_sz, self.win_sz, self.trans,
+             self.time_ns, self.gbps, self.mtps)
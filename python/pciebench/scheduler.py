@@ -0,0 +1,221 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Running tests on several NFPs of a host concurrently.
+
+Most of the time of a test point is spent waiting: for the device to
+run the test, for the helper, for journal reads.  A DeviceScheduler
+runs a function per NFPBench object, each in its own thread, so these
+waits overlap across devices.  The threads share a HostLock, a
+reader-writer lock which NFPBench.run_test() holds while running a
+test.  It is held exclusively while the host caches are thrashed or
+warmed for a test (see NFPBench._disturbs_host()) and shared while the
+device runs the test, unless the device itself thrashes the caches.
+Thrashing and warming thus never overlap with the tests of other
+devices, while the tests themselves and everything else (helper
+setup, journal reads, statistics) overlap.
+
+multi_pciebench.py runs sweeps on several NFPs with worker processes
+sharing a HostLock instead (see fleet.py).  The DeviceScheduler is
+used by
+
+    python -m pciebench.scheduler [-d NUM]
+
+which runs a spec on simulated devices, one after the other and then
+concurrently, and prints the time taken.
+"""
+
+import multiprocessing
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+from .debug import err
+from .sweep import RowBuffer
+from .trace import span
+
+
+class HostLock(object):
+    """A reader-writer lock held by NFPBench.run_test() while running
+    a test: any number of holders in shared mode or one in exclusive
+    mode.  Waiting exclusive holders go first, so a stream of shared
+    holders can't starve them.  With @procs set, it is built from
+    multiprocessing primitives and can be shared with worker
+    processes (see fleet.py), otherwise with threads."""
+
+    # Indices into the state: shared holders, exclusive holder,
+    # waiting exclusive holders
+    _SHARED = 0
+    _EXCL = 1
+    _WAITING = 2
+
+    def __init__(self, procs=False):
+        if procs:
+            self._cond = multiprocessing.Condition()
+            self._state = multiprocessing.RawArray('i', 3)
+        else:
+            self._cond = threading.Condition()
+            self._state = [0, 0, 0]
+
+    def acquire(self, exclusive):
+        """Acquire the lock, in exclusive mode if @exclusive is set"""
+        state = self._state
+        with self._cond:
+            if exclusive:
+                state[self._WAITING] += 1
+                while state[self._EXCL] or state[self._SHARED]:
+                    self._cond.wait()
+                state[self._WAITING] -= 1
+                state[self._EXCL] = 1
+            else:
+                while state[self._EXCL] or state[self._WAITING]:
+                    self._cond.wait()
+                state[self._SHARED] += 1
+
+    def downgrade(self):
+        """Turn the exclusive hold of the lock into a shared one,
+        without letting another exclusive holder in between"""
+        state = self._state
+        with self._cond:
+            state[self._EXCL] = 0
+            state[self._SHARED] += 1
+            self._cond.notify_all()
+
+    def release(self, exclusive):
+        """Release the lock acquired with the same @exclusive"""
+        state = self._state
+        with self._cond:
+            if exclusive:
+                state[self._EXCL] = 0
+            else:
+                state[self._SHARED] -= 1
+                if state[self._SHARED]:
+                    return
+            self._cond.notify_all()
+
+
+class DeviceScheduler(object):
+    """Runs work on the NFPBench objects @benches concurrently"""
+
+    def __init__(self, benches):
+        self.benches = list(benches)
+        if len(set(nfp.nfp_num for nfp in self.benches)) != \
+           len(self.benches):
+            err("Each device can only be scheduled once")
+        self.host_lock = HostLock()
+        for nfp in self.benches:
+            nfp.host_lock = self.host_lock
+
+    def run(self, func, *args, **kwargs):
+        """Call func(nfp, *args, **kwargs) for every NFPBench, each in
+        its own thread, and wait for all of them.  Returns the results
+        in the order of the devices.  If a call raised an exception,
+        the first one is raised once all calls returned."""
+        res = [None] * len(self.benches)
+        errors = [None] * len(self.benches)
+
+        def _run(idx, nfp):
+            try:
+                with span("device", nfp=nfp.nfp_num):
+                    res[idx] = func(nfp, *args, **kwargs)
+            except Exception as exc: # pylint: disable=broad-except
+                errors[idx] = exc
+
+        threads = [threading.Thread(target=_run, args=(idx, nfp),
+                                    name="nfp%d" % nfp.nfp_num)
+                   for idx, nfp in enumerate(self.benches)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for exc in errors:
+            if exc is not None:
+                raise exc
+        return res
+
+    def run_points(self, points):
+        """Run the spec.Points @points on every device and return a
+        list of the rows per device"""
+        return self.run(run_points, points)
+
+
+def run_points(nfp, points):
+    """Run the spec.Points @points on the NFPBench @nfp and return the
+    rows"""
+    buf = RowBuffer()
+    for pt in points:
+        if pt.is_lat():
+            nfp.lat_test(buf, *pt.args())
+        else:
+            nfp.bw_test(buf, *pt.args())
+    return buf.rows
+
+
+def main():
+    """Compare running a spec on simulated devices one after the
+    other and concurrently"""
+    from .nfpbench import NFPBench
+    from .simdev import SimDevice
+    from .spec import load, select
+    from .plan import Plan
+
+    parser = OptionParser("usage: python -m pciebench.scheduler [options]")
+    parser.add_option('-d', '--devices', type='int', default=2,
+                      metavar='NUM', help='Simulated devices (default 2)')
+    parser.add_option('--spec', default="lat_cmd", metavar='SPEC',
+                      help='Spec to run (default lat_cmd)')
+    parser.add_option('--sim-trans', type='int', default=2000,
+                      metavar='NUM', dest='sim_trans',
+                      help='Transactions per test (default 2000)')
+    parser.add_option('--sim-time', type='float', default=10.0,
+                      metavar='SCALE', dest='sim_time',
+                      help='Scale of the simulated test time (default 10)')
+    (options, _) = parser.parse_args()
+
+    points = Plan(select(load(options.spec), None)).order
+    devs = [SimDevice(num, lat_trans=options.sim_trans,
+                      bw_trans=options.sim_trans,
+                      time_scale=options.sim_time)
+            for num in range(options.devices)]
+    try:
+        benches = [NFPBench(dev.nfp_num, None, None, dev) for dev in devs]
+        for nfp in benches:
+            nfp.load_fw()
+            nfp._set_dma_addrs() # pylint: disable=protected-access
+
+        start = time.time()
+        seq = [run_points(nfp, points) for nfp in benches]
+        seq_secs = time.time() - start
+
+        start = time.time()
+        par = DeviceScheduler(benches).run_points(points)
+        par_secs = time.time() - start
+    finally:
+        for dev in devs:
+            dev.close()
+
+    print("%d points on %d devices: %.2fs one after the other, "
+          "%.2fs concurrently (%.1fx)" %
+          (len(points), len(benches), seq_secs, par_secs,
+           seq_secs / par_secs))
+    if [[row[:7] for row in rows] for rows in seq] != \
+       [[row[:7] for row in rows] for rows in par]:
+        err("The concurrent run did not produce the same points")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,403 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""A software simulation of a NFP running the pciebench firmware.
+
+@SimDevice is a transport which implements the contract of
+me/pciebench.h: the host writes parameters and DMA addresses to the
+firmware symbols, starts a test by writing the test number to the
+test control symbol and reads back the result and the test journal.
+Instead of running on MEs, the results are produced by a simple,
+configurable latency/bandwidth model (@SimModel).
+
+The simulated device also provides a stand-in for the procfs files
+exported by the kernel module, so the complete control path can be
+exercised on any Linux system.
+"""
+
+import array
+import bisect
+import math
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+
+from .transport import FakeTransport, Symbol
+from .pcie import LinkConfig, PCIeModel, BW_RD, BW_WR, BW_RW
+
+# Keep these in sync with me/pciebench.h
+PCIEBENCH_MAX_MEM = 64 * 1024 * 1024
+PCIEBENCH_CHUNK_SZ = 4 * 1024 * 1024
+PCIEBENCH_CHUNKS = PCIEBENCH_MAX_MEM // PCIEBENCH_CHUNK_SZ
+PCIEBENCH_JOURNAL_SZ = 16 * 1024 * 1024
+PCIEBENCH_LAT_TRANS = 2 * 1024 * 1024
+PCIEBENCH_BW_TRANS = 8 * 1024 * 1024
+
+LAT_CMD_RD = 1
+LAT_CMD_WRRD = 2
+LAT_DMA_RD = 3
+LAT_DMA_WRRD = 4
+BW_DMA_RD = 5
+BW_DMA_WR = 6
+BW_DMA_RW = 7
+
+LAT_FLAGS_WARM = 1 << 0
+LAT_FLAGS_THRASH = 1 << 1
+LAT_FLAGS_RANDOM = 1 << 2
+LAT_FLAGS_LONG = 1 << 3
+
+# Symbols exported by the NFP-6000 firmware
+SIM_SYMBOLS = {"i32._test_ctrl": 8,
+               "i32._test_params": 5 * 4,
+               "i32._test_result": 8 * 4,
+               "i32._host_dma_addrs": PCIEBENCH_CHUNKS * 8,
+               "test_journal": PCIEBENCH_JOURNAL_SZ * 4}
+
+_CTRL = "i32._test_ctrl"
+_PARAMS = "i32._test_params"
+_RESULT = "i32._test_result"
+_JOURNAL = "test_journal"
+
+# Base of the fake DMA addresses handed out by the procfs stand-in
+_SIM_DMA_BASE = 0x100000000
+
+
+def _choices(rng, vals, cum, count):
+    """Return @count values of @vals picked by @rng with the cumulative
+    weights @cum, like rng.choices() which Python 2 doesn't have"""
+    if hasattr(rng, 'choices'):
+        return rng.choices(vals, cum_weights=cum, k=count)
+    total = cum[-1]
+    hi = len(vals) - 1
+    return [vals[bisect.bisect(cum, rng.random() * total, 0, hi)]
+            for _ in range(count)]
+
+
+class SimModel(object):
+    """A simple model of PCIe latency and bandwidth as seen by the NFP.
+
+    All times are in nanoseconds, sizes in bytes.  The defaults
+    roughly resemble a NFP-6000 in a PCIe Gen3 x8 slot of a Xeon
+    system with DDIO.  Any attribute can be overridden with keyword
+    arguments to the constructor.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, **kwargs):
+        self.cmd_base_ns = 480.0   # PCIe command read, LLC hit
+        self.dma_base_ns = 520.0   # DMA read, LLC hit
+        self.wr_ns = 60.0          # Extra cost of the write in WRRD
+        self.link_gbps = 63.0      # Usable link rate (Gen3 x8)
+        self.link_gen = 3          # Link used for the bandwidth tests
+        self.link_width = 8
+        self.dram_ns = 70.0        # Extra cost of a LLC miss
+        self.llc_sz = 20 * 1024 * 1024
+        self.ddio_frac = 0.1       # Fraction of the LLC used by DDIO
+        self.iotlb_reach = 0       # Bytes mapped by the IOTLB, 0=no IOMMU
+        self.iotlb_miss_ns = 330.0
+        self.jitter_ns = 10.0      # Mean of exponential jitter
+        self.tail_prob = 1e-4      # Probability of a large outlier
+        self.tail_ns = 2000.0
+        self.unaligned_ns = 8.0    # Extra cache line touched
+        self.loop_ns = 20.0        # ME loop overhead per transaction
+
+        self.mps = 256             # Max payload size
+        self.mrrs = 512            # Max read request size
+        self.dma_outstanding = 32  # Outstanding DMA reads
+        self.dma_issue_ns = 4.0    # DMA engine issue cost
+
+        for key, val in kwargs.items():
+            if not hasattr(self, key):
+                raise AttributeError("Unknown model parameter %s" % key)
+            setattr(self, key, val)
+        return
+
+    def _hit_prob(self, test, flags, win_sz):
+        """Probability that an access hits in the host LLC"""
+        ddio = min(1.0, self.llc_sz * self.ddio_frac / win_sz)
+        if test in [LAT_CMD_WRRD, LAT_DMA_WRRD, BW_DMA_WR]:
+            # Writes allocate in the DDIO ways
+            return ddio
+        if flags & (1 << 31):
+            # Host warm: the window is in the LLC if it fits
+            return min(1.0, float(self.llc_sz) / win_sz)
+        if flags & LAT_FLAGS_WARM:
+            return ddio
+        # Device reads do not allocate, a cold cache stays cold.
+        return 0.0
+
+    def _iotlb_miss_prob(self, win_sz):
+        """Probability that an access misses in the IOTLB"""
+        if not self.iotlb_reach:
+            return 0.0
+        return 1.0 - min(1.0, float(self.iotlb_reach) / win_sz)
+
+    def _xfer_ns(self, trans_sz):
+        """Time to move @trans_sz bytes of payload over the link"""
+        return trans_sz * 8 / self.link_gbps
+
+    def _extra_lines(self, trans_sz, h_off):
+        """Number of extra cache lines touched because of @h_off"""
+        lines = (trans_sz + 63) // 64
+        return ((h_off % 64) + trans_sz + 63) // 64 - lines
+
+    def lat_ns(self, test, flags, win_sz, trans_sz, h_off):
+        """Return the latency of a single transaction hitting in the
+        host LLC and the IOTLB"""
+        if test in [LAT_CMD_RD, LAT_CMD_WRRD]:
+            base = self.cmd_base_ns
+        else:
+            base = self.dma_base_ns
+        if test in [LAT_CMD_WRRD, LAT_DMA_WRRD]:
+            base += self.wr_ns + self._xfer_ns(trans_sz)
+        base += self._xfer_ns(trans_sz)
+        base += self._extra_lines(trans_sz, h_off) * self.unaligned_ns
+        return base
+
+    def lat_samples(self, rng, test, flags, win_sz, trans_sz, h_off,
+                    count, freq_hz):
+        """Return an array of @count latency samples in cycles"""
+        base = self.lat_ns(test, flags, win_sz, trans_sz, h_off)
+        hit = self._hit_prob(test, flags, win_sz)
+        tlb = self._iotlb_miss_prob(win_sz)
+
+        # Build a discrete distribution over the cache/IOTLB states and
+        # a set of jitter quantiles and sample from it in one go.
+        jitter = [-self.jitter_ns * math.log(1.0 - (i + 0.5) / 32)
+                  for i in range(32)]
+        vals = []
+        weights = []
+        for c_miss, c_prob in [(0, hit), (1, 1.0 - hit)]:
+            for t_miss, t_prob in [(0, 1.0 - tlb), (1, tlb)]:
+                prob = c_prob * t_prob
+                if prob <= 0.0:
+                    continue
+                lat = base + c_miss * self.dram_ns + \
+                      t_miss * self.iotlb_miss_ns
+                for jit in jitter:
+                    vals.append(lat + jit)
+                    weights.append(prob * (1.0 - self.tail_prob) / 32)
+                vals.append(lat + self.tail_ns)
+                weights.append(prob * self.tail_prob)
+
+        cyc_per_ns = freq_hz / 1e9
+        vals = [int(v * cyc_per_ns) for v in vals]
+        cum = []
+        acc = 0.0
+        for weight in weights:
+            acc += weight
+            cum.append(acc)
+        return array.array('I', _choices(rng, vals, cum, count))
+
+    def link(self, source=None):
+        """Return the LinkConfig of the simulated link"""
+        return LinkConfig(self.link_gen, self.link_width, self.mps,
+                          self.mrrs, source=source)
+
+    def bw_ns(self, test, flags, win_sz, trans_sz, h_off, count):
+        """Return the time in ns to perform @count DMAs.  The time on
+        the wire is that of the PCIeModel of the link, so the
+        simulated bandwidth never exceeds the modelled one."""
+        pcie = PCIeModel(self.link())
+        rate = pcie.raw_gbps() / 8.0  # bytes per ns
+        direction = {BW_DMA_RD: BW_RD, BW_DMA_WR: BW_WR,
+                     BW_DMA_RW: BW_RW}[test]
+        wire_ns = max(pcie.wire(direction, trans_sz, h_off)) / rate
+
+        hit = self._hit_prob(test, flags, win_sz)
+        lat = self.dma_base_ns + (1.0 - hit) * self.dram_ns + \
+              self._iotlb_miss_prob(win_sz) * self.iotlb_miss_ns
+        rd_lat_ns = lat / self.dma_outstanding
+
+        if test == BW_DMA_WR:
+            per_dma = wire_ns
+        elif test == BW_DMA_RD:
+            per_dma = max(wire_ns, rd_lat_ns)
+        else:
+            # Half reads, half writes: the wire time is that of a read
+            # plus a write on the full duplex link.
+            per_dma = max(wire_ns, rd_lat_ns) / 2
+        per_dma = max(per_dma, self.dma_issue_ns)
+        return per_dma * count
+
+
+class SimDevice(FakeTransport):
+    """A transport backed by a simulated NFP running pciebench.
+
+    @nfp_num     NFP number to pretend to be
+    @model       A SimModel (default: a model with default parameters)
+    @freq_mhz    ME frequency reported by hwinfo
+    @lat_trans   Transactions per latency test (default as firmware)
+    @bw_trans    Transfers per bandwidth test (default as firmware)
+    @time_scale  If non-zero, tests appear to be running for their
+                 simulated duration multiplied by @time_scale
+    @procdir     Directory for the procfs stand-in (default: temp dir)
+    @seed        Seed for the random number generator
+    """
+
+    name = "sim"
+
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+
+    def __init__(self, nfp_num=0, model=None, freq_mhz=1200,
+                 lat_trans=PCIEBENCH_LAT_TRANS, bw_trans=PCIEBENCH_BW_TRANS,
+                 time_scale=0.0, procdir=None, seed=0):
+        FakeTransport.__init__(self, nfp_num, {},
+                               {'me.speed': str(freq_mhz),
+                                'chip.model': 'NFP6000 (simulated)'})
+        self.model = model if model else SimModel()
+        self.freq_hz = freq_mhz * 1000 * 1000
+        self.lat_trans = lat_trans
+        self.bw_trans = bw_trans
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+
+        self._init_symtab()
+
+        self.journal = array.array('I')
+        self._running = bytes(bytearray(8))
+        self.ts = 0           # ME timestamp (ticks every 16 cycles)
+        self.busy_until = 0.0
+        self.fw_loaded = None
+        self.tests_run = 0
+
+        self.own_procdir = not procdir
+        self.procdir = procdir if procdir else \
+                       tempfile.mkdtemp(prefix="pciebench-sim-")
+        self._make_procfs()
+        return
+
+    def close(self):
+        if self.own_procdir and os.path.isdir(self.procdir):
+            shutil.rmtree(self.procdir)
+        return
+
+    def _init_symtab(self):
+        """Set up the symbol table and memory for all symbols, except
+        the journal which is kept as an array"""
+        off = 0
+        self.symtab = {}
+        self.mem = {}
+        for name, size in sorted(SIM_SYMBOLS.items()):
+            self.symtab[name] = Symbol(off, size)
+            if name != _JOURNAL:
+                self.mem[name] = bytearray(size)
+            off += size
+        self.device_symtab = dict(self.symtab)
+        return
+
+    def _make_procfs(self):
+        """Create the files normally exported by the kernel module"""
+        if not os.path.isdir(self.procdir):
+            os.makedirs(self.procdir)
+        with open(os.path.join(self.procdir, "pciebench_dma_addrs-%d" %
+                               self.nfp_num), 'w') as outf:
+            for chunk in range(PCIEBENCH_CHUNKS):
+                outf.write("0x%x\n" %
+                           (_SIM_DMA_BASE + chunk * PCIEBENCH_CHUNK_SZ))
+        with open(os.path.join(self.procdir, "pciebench_buf_sz-%d" %
+                               self.nfp_num), 'w') as outf:
+            outf.write("%d\n" % PCIEBENCH_MAX_MEM)
+        with open(os.path.join(self.procdir, "pciebench_buffer-%d" %
+                               self.nfp_num), 'a') as outf:
+            outf.truncate(PCIEBENCH_MAX_MEM)
+        return
+
+    def pcie_link(self):
+        return self.model.link(source=self.name)
+
+    def load_fw(self, fwfile):
+        self._init_symtab()
+        self.journal = array.array('I')
+        self.busy_until = 0.0
+        self.fw_loaded = fwfile
+        return
+
+    def unload_fw(self):
+        self.fw_loaded = None
+        return
+
+    def lookup(self, name):
+        if not self.fw_loaded:
+            return None
+        return FakeTransport.lookup(self, name)
+
+    def read(self, name, length=None, offset=0):
+        self.reads += 1
+        length = self._length(name, length, offset)
+        if name == _JOURNAL:
+            # Journal accesses are always word aligned
+            data = self.journal[offset // 4:(offset + length) // 4]
+            data = data.tobytes() if hasattr(data, 'tobytes') else \
+                   data.tostring()
+            return data + bytes(bytearray(length - len(data)))
+        if name == _CTRL and self.busy_until and \
+           time.time() < self.busy_until:
+            return self._running[offset:offset + length]
+        return bytes(self.mem[name][offset:offset + length])
+
+    def write(self, name, words):
+        FakeTransport.write(self, name, words)
+        if name == _CTRL and words[0] and words[0] < (1 << 31):
+            self._run(words[0])
+        return
+
+    def _run(self, test):
+        """Run test @test, update result, journal and test control"""
+        self.tests_run += 1
+        self._running = bytes(self.mem[_CTRL])
+        params = struct.unpack('<5I', bytes(self.mem[_PARAMS]))
+        flags, trans_sz, win_sz, h_off, _ = params
+
+        model = self.model
+        trans = 0
+        if test in [LAT_CMD_RD, LAT_CMD_WRRD, LAT_DMA_RD, LAT_DMA_WRRD]:
+            # Long runs fill the journal (8x the default with the
+            # firmware defaults)
+            trans = self.lat_trans
+            if flags & LAT_FLAGS_LONG:
+                trans *= 8
+            trans = min(trans, PCIEBENCH_JOURNAL_SZ)
+            self.journal = model.lat_samples(self.rng, test, flags, win_sz,
+                                             trans_sz, h_off, trans,
+                                             self.freq_hz)
+            cycles = sum(self.journal) + \
+                     int(trans * model.loop_ns * self.freq_hz / 1e9)
+        elif test in [BW_DMA_RD, BW_DMA_WR, BW_DMA_RW]:
+            trans = self.bw_trans
+            # Round up, not to exceed the modelled bandwidth
+            cycles = int(math.ceil(model.bw_ns(test, flags, win_sz, trans_sz,
+                                               h_off, trans) *
+                                   self.freq_hz / 1e9))
+        else:
+            self.mem[_CTRL][:4] = struct.pack('<i', -1)
+            return
+
+        start = self.ts
+        end = start + (cycles + 15) // 16
+        self.ts = end + 1
+        self.mem[_RESULT][:] = struct.pack('<8I', start >> 32,
+                                           start & 0xffffffff,
+                                           end >> 32, end & 0xffffffff,
+                                           trans, 0, 0, 0)
+        if self.time_scale:
+            self.busy_until = time.time() + \
+                              self.time_scale * float(cycles) / self.freq_hz
+        self.mem[_CTRL][:4] = struct.pack('<i', 0)
+        return
@@ -0,0 +1,366 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Declarative sweep specifications.
+
+A spec (JSON, or YAML if PyYAML is installed) lists the output tables
+of a run and the test points in each.  A test point is described by
+the parameters:
+
+    test      Test name, e.g. "LAT_DMA_RD"
+    cache     cold (default), thrash, dwarm or hwarm
+    access    seq (default) or rnd
+    long      Do a long run (default false)
+    win_sz    Window size, in bytes or e.g. "8K", "1.5M"
+    trans_sz  Transfer size
+    h_off     Host offset (default 0)
+    d_off     Device offset (default 0)
+
+A table has a "name" and optionally a "msg" printed before it and
+"details": true to keep the raw samples of its (latency) points and
+write their CDFs, histograms and samples to NAME_cdf, NAME_hist.json
+and NAME_raw.bin.  Tables and sections are nodes which may have:
+
+    "params":   Parameters fixed for the node
+    "foreach":  Parameters with a list of values.  The node is
+                repeated for every combination, the first parameter
+                varying slowest.  For a table, this produces one table
+                per combination, so the name must use the parameters,
+                e.g. "lat_dma_off_%(op)s".
+    "sections": A list of child nodes, or
+    "points":   The points of a section, either parameters with a list
+                of values (combined as for "foreach") or a list of
+                parameter dictionaries.
+
+A list of values may be given as {"range": [start, stop(, step)]}.
+Names and messages may refer to the parameters and "op" (e.g. "rd",
+"wrrd") and "op_desc" (e.g. "Read", "Write/Read") of the test.
+
+A section whose points only vary the window size may set "adaptive"
+to the column to refine the sweep on with an AdaptiveSweep (e.g.
+"Median" or "Gb/s").
+
+A spec may "include" other specs (by built-in name or path) and
+"skip" tables of the included specs (shell style patterns).  The
+built-in specs live in the specs/ directory next to this module.
+"""
+
+import fnmatch
+import json
+import os
+import re
+from collections import OrderedDict
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from .debug import err
+from .checkpoint import point_key
+from .nfpbench import NFPBench
+
+SPEC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "specs")
+
+TESTS = dict((name, num) for num, name in NFPBench.TEST_NAMES.items())
+
+CACHE_FLAGS = OrderedDict([("cold", 0),
+                           ("thrash", NFPBench.FLAGS_THRASH),
+                           ("dwarm", NFPBench.FLAGS_WARM),
+                           ("hwarm", NFPBench.FLAGS_HOSTWARM)])
+ACCESS_FLAGS = {"seq": 0, "rnd": NFPBench.FLAGS_RANDOM}
+
+# Short names and descriptions of the tests
+OPS = {NFPBench.LAT_CMD_RD: ("rd", "Read"),
+       NFPBench.LAT_CMD_WRRD: ("wrrd", "Write/Read"),
+       NFPBench.LAT_DMA_RD: ("rd", "Read"),
+       NFPBench.LAT_DMA_WRRD: ("wrrd", "Write/Read"),
+       NFPBench.BW_DMA_RD: ("rd", "Read"),
+       NFPBench.BW_DMA_WR: ("wr", "Write"),
+       NFPBench.BW_DMA_RW: ("rw", "Read/Write")}
+
+DEFAULTS = {'cache': "cold", 'access': "seq", 'long': False,
+            'h_off': 0, 'd_off': 0}
+PARAMS = ['test', 'cache', 'access', 'long', 'win_sz', 'trans_sz',
+          'h_off', 'd_off']
+
+_SIZE = re.compile(r'^\s*([0-9.]+)\s*([KMG]?)B?\s*$', re.I)
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(val):
+    """Return the size @val (a number or a string like "1.5M") in
+    bytes"""
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return int(val)
+    match = _SIZE.match(str(val))
+    if not match:
+        err("Invalid size %r" % (val,))
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def _norm(name, val):
+    """Check and normalise the value @val of parameter @name"""
+    if name == 'test':
+        if val in TESTS:
+            return TESTS[val]
+        if val in NFPBench.TEST_NAMES:
+            return val
+        err("Unknown test %r" % (val,))
+    if name == 'cache' and val not in CACHE_FLAGS:
+        err("Unknown cache setting %r (one of %s)" %
+            (val, ", ".join(CACHE_FLAGS)))
+    if name == 'access' and val not in ACCESS_FLAGS:
+        err("Unknown access %r (seq or rnd)" % (val,))
+    if name == 'long':
+        return bool(val)
+    if name in ['win_sz', 'trans_sz', 'h_off', 'd_off']:
+        return parse_size(val)
+    if name not in PARAMS:
+        err("Unknown parameter %r" % (name,))
+    return val
+
+
+def _values(name, vals):
+    """Return the list of values @vals of parameter @name"""
+    if isinstance(vals, dict) and 'range' in vals:
+        vals = list(range(*[parse_size(v) for v in vals['range']]))
+    elif not isinstance(vals, list):
+        vals = [vals]
+    return [_norm(name, val) for val in vals]
+
+
+def _product(items):
+    """Return all combinations of @items, a dictionary of parameters
+    and lists of values, as a list of dictionaries.  The first
+    parameter varies slowest."""
+    res = [{}]
+    for name, vals in (items or {}).items():
+        vals = _values(name, vals)
+        res = [dict(comb, **{name: val}) for comb in res for val in vals]
+    return res
+
+
+def _fixed(params):
+    """Return the normalised fixed @params of a node"""
+    return dict((name, _norm(name, val))
+                for name, val in (params or {}).items())
+
+
+def _template_vars(params):
+    """Return the variables for name and message templates"""
+    tvars = dict(params)
+    if 'test' in params:
+        tvars['op'], tvars['op_desc'] = OPS[params['test']]
+        tvars['test_name'] = NFPBench.TEST_NAMES[params['test']]
+    return tvars
+
+
+class Point(object):
+    """A test point"""
+
+    __slots__ = ('test', 'flags', 'win_sz', 'trans_sz', 'h_off', 'd_off',
+                 'cache', 'key')
+
+    def __init__(self, params):
+        for name in ['test', 'win_sz', 'trans_sz']:
+            if name not in params:
+                err("Test point without %s: %s" % (name, params))
+        self.test = params['test']
+        self.cache = params['cache']
+        self.flags = CACHE_FLAGS[self.cache] | \
+                     ACCESS_FLAGS[params['access']] | \
+                     (NFPBench.FLAGS_LONG if params['long'] else 0)
+        self.win_sz = params['win_sz']
+        self.trans_sz = params['trans_sz']
+        self.h_off = params['h_off']
+        self.d_off = params['d_off']
+        self.key = point_key(self.test, self.flags, self.win_sz,
+                             self.trans_sz, self.h_off, self.d_off)
+        self._check()
+
+    def _check(self):
+        """Catch points NFPBench would refuse before starting a run"""
+        if self.win_sz % 64:
+            err("%s: window size must be a multiple of 64" % self.key)
+        if self.trans_sz > 4096:
+            err("%s: the transfer must be at most 4096B" % self.key)
+        if self.test in [NFPBench.LAT_CMD_RD, NFPBench.LAT_CMD_WRRD] and \
+           self.trans_sz > NFPBench.MAX_CMD_SZ:
+            err("%s: PCIe commands transfer at most %dB" %
+                (self.key, NFPBench.MAX_CMD_SZ))
+
+    def is_lat(self):
+        """True for latency tests"""
+        return self.test in NFPBench.LAT_TESTS
+
+    def args(self):
+        """Return the arguments for NFPBench.lat_test()/bw_test()"""
+        return (self.test, self.flags, self.win_sz, self.trans_sz,
+                self.h_off, self.d_off)
+
+
+class Section(object):
+    """A section of a table: a list of points.  @params are the
+    parameters common to all points, @adaptive the column an adaptive
+    sweep over the window sizes refines on (or None)."""
+
+    def __init__(self, points, params, adaptive=None):
+        self.points = points
+        self.params = params
+        self.adaptive = adaptive
+
+    def point(self, win_sz):
+        """Return the point of the section with window size @win_sz"""
+        return Point(dict(self.params, win_sz=win_sz))
+
+    def win_szs(self):
+        """Return the window sizes of the section's points"""
+        return [pt.win_sz for pt in self.points]
+
+
+class Table(object):
+    """An output table"""
+
+    def __init__(self, name, msg, details, sections):
+        self.name = name
+        self.msg = msg
+        self.details = details
+        self.sections = sections
+        lat = set(pt.is_lat() for sec in sections for pt in sec.points)
+        if len(lat) != 1:
+            err("Table %s must have either latency or bandwidth tests" %
+                name)
+        self.is_lat = lat.pop()
+        if details and not self.is_lat:
+            err("Table %s: details are only kept for latency tests" % name)
+        self.fmt = NFPBench.lat_fmt if self.is_lat else NFPBench.bw_fmt
+
+
+def _section(node, params):
+    """Return the Section for the leaf node @node"""
+    points = node['points']
+    adaptive = node.get('adaptive')
+    if isinstance(points, list):
+        combs = [_fixed(pt) for pt in points]
+    else:
+        combs = _product(points)
+    if adaptive:
+        if isinstance(points, list) or list(points.keys()) != ['win_sz']:
+            err("Adaptive sections may only vary win_sz")
+        fmt = NFPBench.lat_fmt if params.get('test') in \
+              NFPBench.LAT_TESTS else NFPBench.bw_fmt
+        if adaptive not in [col[0] for col in fmt]:
+            err("Unknown column %r to adapt on" % (adaptive,))
+    return Section([Point(dict(params, **comb)) for comb in combs],
+                   params, adaptive)
+
+
+def _sections(node, params, out):
+    """Expand the sections of @node with the parameters @params into
+    the list @out"""
+    for comb in _product(node.get('foreach')):
+        sub = dict(params)
+        sub.update(_fixed(node.get('params')))
+        sub.update(comb)
+        if 'sections' in node:
+            for child in node['sections']:
+                _sections(child, sub, out)
+        elif 'points' in node:
+            out.append(_section(node, sub))
+        else:
+            err("A section needs points or sections")
+
+
+def _tables(node):
+    """Return the tables described by the table node @node"""
+    res = []
+    if 'name' not in node:
+        err("A table needs a name")
+    for comb in _product(node.get('foreach')):
+        params = dict(DEFAULTS)
+        params.update(_fixed(node.get('params')))
+        params.update(comb)
+        tvars = _template_vars(params)
+        try:
+            name = node['name'] % tvars
+            msg = node['msg'] % tvars if node.get('msg') else None
+        except (KeyError, ValueError, TypeError) as exc:
+            err("Table %s: bad template: %s" % (node['name'], exc))
+        sections = []
+        body = dict((key, val) for key, val in node.items()
+                    if key in ['sections', 'points', 'adaptive'])
+        _sections(body, params, sections)
+        res.append(Table(name, msg, bool(node.get('details')), sections))
+    return res
+
+
+def builtin_specs():
+    """Return the names of the built-in specs"""
+    return sorted(os.path.splitext(fname)[0]
+                  for fname in os.listdir(SPEC_DIR)
+                  if fname.endswith(".json"))
+
+
+def _read(path):
+    """Read the spec file @path"""
+    with open(path, 'r') as inf:
+        if path.endswith(".yaml") or path.endswith(".yml"):
+            if yaml is None:
+                err("PyYAML is needed to read %s" % path)
+            return yaml.safe_load(inf)
+        return json.load(inf, object_pairs_hook=OrderedDict)
+
+
+def _find(name):
+    """Return the path of spec @name: a file or a built-in spec"""
+    if os.path.isfile(name):
+        return name
+    path = os.path.join(SPEC_DIR, name + ".json")
+    if not os.path.isfile(path):
+        err("No spec %s (built-in specs: %s)" %
+            (name, ", ".join(builtin_specs())))
+    return path
+
+
+def load(name, _seen=None):
+    """Return the list of Tables of spec @name, a built-in spec or a
+    file"""
+    path = os.path.abspath(_find(name))
+    seen = set(_seen or [])
+    if path in seen:
+        err("Spec %s includes itself" % name)
+    seen.add(path)
+
+    spec = _read(path)
+    tables = []
+    for inc in spec.get('include', []):
+        if not os.path.isabs(inc) and os.path.isfile(
+                os.path.join(os.path.dirname(path), inc)):
+            inc = os.path.join(os.path.dirname(path), inc)
+        tables += load(inc, seen)
+    for node in spec.get('tables', []):
+        tables += _tables(node)
+    return select(tables, skip=spec.get('skip'))
+
+
+def select(tables, only=None, skip=None):
+    """Return the @tables matching one of the patterns @only (if set)
+    and none of the patterns @skip"""
+    def _match(name, patterns):
+        return any(fnmatch.fnmatchcase(name, pat) for pat in patterns)
+    return [table for table in tables
+            if (not only or _match(table.name, only)) and
+            not (skip and _match(table.name, skip))]
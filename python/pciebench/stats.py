@@ -15,27 +15,66 @@
 
 """A collection of stats functions"""
 
+import collections
 import math
 import sys
 
-class ListStats(object):
-    """A class implementing some statistics on a list of values"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .histogram import LogLinearHistogram, DEFAULT_PRECISION
+
+# Percentiles reported by default by ListStats.percentiles()
+DEFAULT_PCTS = (50, 90, 99, 99.9, 99.99)
 
-    def __init__(self, inlist):
-        """Initialise a stats object with a list of items"""
+class ListStats(object):
+    """A class implementing some statistics on a list of values.
+
+    If NumPy is available the values are kept in a NumPy array and all
+    operations are vectorised.  Otherwise a pure Python implementation
+    is used.  In both cases the values are only sorted when needed and
+    percentiles are computed with the same linear interpolation."""
+
+    def __init__(self, inlist, use_numpy=None):
+        """Initialise a stats object with a list of items.  Set
+        @use_numpy to force (True) or prevent (False) the use of NumPy.
+        By default NumPy is used if available."""
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        self.use_numpy = use_numpy
         self.list = inlist
-        self.sorted_list = sorted(self.list)
+        if use_numpy:
+            self.arr = numpy.asarray(inlist)
+        else:
+            self.arr = None
+        self._sorted = None
+
+    @property
+    def sorted_list(self):
+        """The values in sorted order (sorted on first use)"""
+        if self._sorted is None:
+            if self.use_numpy:
+                self._sorted = numpy.sort(self.arr)
+            else:
+                self._sorted = sorted(self.list)
+        return self._sorted
 
     def avg(self):
         """Return the average of the list."""
-        if not self.list:
+        if not len(self.list):
             return 0.0
+        if self.use_numpy:
+            return float(self.arr.mean(dtype=numpy.float64))
         return float(sum(self.list))/len(self.list)
 
     def median(self):
         """Return the median of the values."""
-        if not self.list:
+        if not len(self.list):
             return 0
+        if self.use_numpy:
+            return self.percentiles([50])[0]
         length = len(self.sorted_list)
         if not length % 2:
             return (self.sorted_list[int(length / 2)] +
@@ -44,17 +83,39 @@ class ListStats(object):
 
     def min(self):
         """Return the minimum value in the list"""
+        if self.use_numpy:
+            return self.arr.min().item()
+        if self._sorted is not None:
+            return self._sorted[0]
         return min(self.list)
 
     def max(self):
         """Return the maximum value in the list"""
+        if self.use_numpy:
+            return self.arr.max().item()
+        if self._sorted is not None:
+            return self._sorted[-1]
         return max(self.list)
 
+    def percentiles(self, pcts=DEFAULT_PCTS):
+        """Return a list with the values for each of the percentiles in
+        @pcts.  With NumPy this uses a selection algorithm unless the
+        values have already been sorted."""
+        if not len(self.list):
+            return [0 for _ in pcts]
+        if self.use_numpy:
+            src = self.arr if self._sorted is None else self._sorted
+            res = numpy.percentile(src, pcts)
+            return [float(val) for val in res]
+        return [self._percentile(pct) for pct in pcts]
+
     def percentile(self, percentile):
         """Return the nth the percentile from a list of values."""
+        return self.percentiles([percentile])[0]
+
+    def _percentile(self, percentile):
+        """Pure Python percentile"""
         # from http://code.activestate.com/recipes/511478/
-        if not self.list:
-            return 0
         idx = (len(self.sorted_list) - 1) * (percentile / 100.0)
         floor = math.floor(idx)
         ceil = math.ceil(idx)
@@ -68,12 +129,17 @@ class ListStats(object):
         """Return a histogram from a list.
         Returns a dictionary with values as key and #occurrences as values
         """
-        res = {}
-        for val in self.list:
-            if not val in res:
-                res[val] = 1
-            else:
-                res[val] += 1
+        if self.use_numpy:
+            vals, counts = numpy.unique(self.arr, return_counts=True)
+            return dict(zip(vals.tolist(), counts.tolist()))
+        return dict(collections.Counter(self.list))
+
+    def hdr_histo(self, precision=DEFAULT_PRECISION):
+        """Return a LogLinearHistogram of the list.  Unlike histo() the
+        size of the result is bounded, it can be merged with other
+        histograms and answers percentiles and CDFs directly."""
+        res = LogLinearHistogram(precision)
+        res.record_values(self.list)
         return res
 
 def histo2cdf(histo):
@@ -0,0 +1,521 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""A columnar store for the results of a run.
+
+A store is a directory holding one sub-directory per table (one table
+per TableWriter output file).  Each column of a table is kept in its
+own file as a packed little endian array: 64bit integers, doubles or,
+for string columns, 16bit indices into a per column dictionary.  Raw
+samples of all tables are appended to a single file of 32bit values
+and each row records the offset and number of its samples.
+
+'meta.json' describes the tables (columns, row count, sections) and
+'index.json' maps the test dimensions (test, cache, access, window,
+size, host and device offset) to the rows holding results for them.
+Column and sample files can be memory mapped, so point queries only
+touch the index and the rows asked for.
+
+The text, gnuplot and CSV files are written by exporting a table,
+which replays its sections and rows through a TableWriter.
+"""
+
+import array
+import json
+import mmap
+import os
+import shutil
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .debug import err
+from .tablewriter import TableWriter
+
+# Name of the store directory in the output directory
+RESULTS_DIR = "results"
+
+META_FILE = "meta.json"
+INDEX_FILE = "index.json"
+SAMPLES_FILE = "samples.u32"
+
+# Columns identifying a test point, in the order used by lat_fmt and
+# bw_fmt
+DIMS = ("Test", "Cache", "Access", "Win", "Size", "HOff", "DOff")
+
+# Column kinds and the array typecodes they are stored as
+_KIND_INT = 'q'
+_KIND_FLOAT = 'd'
+_KIND_STR = 'H'
+
+# Python 2 has no 64bit typecodes, but 'l' is 64bit on LP64 systems
+_PY2_KINDS = {'q': 'l', 'Q': 'L'}
+
+# Per row sample offset and count
+_SAMPLES_OFF = "_samples_off"
+_SAMPLES_CNT = "_samples_cnt"
+
+
+def point_index_key(test, cache, access, win, size, h_off, d_off):
+    """Return the index key for a test point"""
+    return "%s:%s:%s:%d:%d:%d:%d" % (test, cache, access, int(win),
+                                     int(size), int(h_off), int(d_off))
+
+
+def _array(kind, vals=()):
+    """Return an array of typecode @kind holding @vals"""
+    try:
+        return array.array(kind, vals)
+    except ValueError:
+        return array.array(_PY2_KINDS[kind], vals)
+
+
+def _to_le(arr):
+    """Return @arr as little endian bytes"""
+    if sys.byteorder == 'big':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    if hasattr(arr, 'tobytes'):
+        return arr.tobytes()
+    return arr.tostring() # Python 2
+
+
+def _write_atomic(path, data):
+    """Write the string @data to @path atomically"""
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as outf:
+        outf.write(data)
+    os.rename(tmp, path)
+
+
+class _Table(object):
+    """A table being written.  Rows are kept in memory (tables are
+    small) and written out when the table is closed.  Samples are
+    appended to the store's sample file straight away."""
+
+    def __init__(self, store, name, fmt, base, mask):
+        self.store = store
+        self.name = name
+        self.fmt = [list(col) for col in fmt]
+        self.base = base
+        self.mask = mask
+        self.cols = [col for col in fmt if not (col[0] == '' and col[1] == 0)]
+        self.kinds = [None] * len(self.cols)
+        self.data = [None] * len(self.cols)
+        self.dicts = [None] * len(self.cols)
+        self.samples_off = _array('q')
+        self.samples_cnt = _array('q')
+        self.sections = []
+        self.rows = 0
+        self.indexed = tuple(col[0] for col in self.cols[:len(DIMS)]) == DIMS
+
+    def _kind(self, col, val):
+        """The kind of column @col, from its format or, for the special
+        formats, the python value @val"""
+        conv = self.cols[col][2][-1:]
+        if conv in 'di':
+            return _KIND_INT
+        if conv in 'feg':
+            return _KIND_FLOAT
+        if conv == 's' or isinstance(val, str):
+            return _KIND_STR
+        if isinstance(val, float):
+            return _KIND_FLOAT
+        return _KIND_INT
+
+    def _add(self, col, val):
+        """Append @val to column @col"""
+        kind = self.kinds[col]
+        if kind is None:
+            kind = self.kinds[col] = self._kind(col, val)
+            self.data[col] = _array(kind)
+            if kind == _KIND_STR:
+                self.dicts[col] = []
+
+        if kind == _KIND_STR:
+            val = str(val)
+            codes = self.dicts[col]
+            if val not in codes:
+                codes.append(val)
+            self.data[col].append(codes.index(val))
+        elif kind == _KIND_INT:
+            if isinstance(val, float) and val != int(val):
+                # promote the column
+                self.kinds[col] = _KIND_FLOAT
+                self.data[col] = array.array(_KIND_FLOAT, self.data[col])
+                self.data[col].append(val)
+            else:
+                self.data[col].append(int(val))
+        else:
+            self.data[col].append(float(val))
+
+    def append(self, vals, samples=None):
+        """Append a row and optionally its raw samples"""
+        if len(vals) != len(self.cols):
+            err("Table %s: row has %d values, expected %d" %
+                (self.name, len(vals), len(self.cols)))
+        for col, val in enumerate(vals):
+            self._add(col, val)
+        if samples is not None:
+            off, cnt = self.store._add_samples(samples)
+        else:
+            off, cnt = -1, 0
+        self.samples_off.append(off)
+        self.samples_cnt.append(cnt)
+        self.rows += 1
+
+    def section(self, head=None):
+        """Start a new section before the next row"""
+        self.sections.append([self.rows, head])
+
+    def close(self, export=True):
+        """Write the columns and the table's metadata and, with
+        @export, the files of the table"""
+        tdir = os.path.join(self.store.path, self.name)
+        if not os.path.isdir(tdir):
+            os.makedirs(tdir)
+        files = [(str(i), self.data[i]) for i in range(len(self.cols))]
+        files += [(_SAMPLES_OFF, self.samples_off),
+                  (_SAMPLES_CNT, self.samples_cnt)]
+        for fname, arr in files:
+            with open(os.path.join(tdir, fname + ".col"), 'wb') as outf:
+                if arr is not None:
+                    outf.write(_to_le(arr))
+
+        meta = {'fmt': self.fmt, 'base': os.path.basename(self.base),
+                'mask': self.mask, 'rows': self.rows,
+                'sections': self.sections,
+                'kinds': [kind or _KIND_INT for kind in self.kinds],
+                'dicts': self.dicts}
+        index = {}
+        if self.indexed:
+            for row in range(self.rows):
+                key = point_index_key(*[self._get(col, row)
+                                        for col in range(len(DIMS))])
+                index.setdefault(key, []).append(row)
+        self.store._table_done(self.name, meta, index)
+        if export and self.mask:
+            self.store.export(self.name, self.base)
+
+    def _get(self, col, row):
+        """Value of column @col in row @row"""
+        val = self.data[col][row]
+        if self.kinds[col] == _KIND_STR:
+            return self.dicts[col][val]
+        return val
+
+
+class ResultStore(object):
+    """A results store in directory @path.  With @create set, any
+    existing store at @path is removed and a new one created.
+    Otherwise an existing store is opened read-only."""
+
+    def __init__(self, path, create=False):
+        self.path = path
+        self.create = create
+        self._maps = {}
+        self._samples = None
+        self._samples_len = 0
+
+        if create:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.makedirs(path)
+            self.meta = {'version': 1, 'tables': {}, 'info': {}}
+            self.index = {}
+            self._samples = open(os.path.join(path, SAMPLES_FILE), 'wb')
+            self._flush_meta()
+        else:
+            with open(os.path.join(path, META_FILE), 'r') as inf:
+                self.meta = json.load(inf)
+            with open(os.path.join(path, INDEX_FILE), 'r') as inf:
+                self.index = json.load(inf)
+
+    ##
+    ## Writing
+    ##
+    def create_table(self, base, fmt, mask=TableWriter.ALL):
+        """Create a table for the TableWriter output file @base with
+        format @fmt (as for TableWriter).  The table is named after
+        the last component of @base."""
+        if not self.create:
+            err("Results store %s is read-only" % self.path)
+        name = os.path.basename(base)
+        return _Table(self, name, fmt, base, mask)
+
+    def _add_samples(self, samples):
+        """Append @samples to the sample file.  Returns offset and
+        count (in samples)"""
+        if numpy is not None and isinstance(samples, numpy.ndarray):
+            data = samples.astype('<u4', copy=False).tobytes()
+        else:
+            if not (isinstance(samples, array.array) and
+                    samples.typecode == 'I'):
+                samples = array.array('I', samples)
+            data = _to_le(samples)
+        off = self._samples_len
+        self._unmap(SAMPLES_FILE)
+        self._samples.write(data)
+        self._samples_len += len(data) // 4
+        return off, len(data) // 4
+
+    def _table_done(self, name, meta, index):
+        """Record the metadata and index entries of a closed table"""
+        self.meta['tables'][name] = meta
+        for fname in list(self._maps.keys()):
+            if fname.startswith(name + os.sep):
+                self._unmap(fname)
+        for key in list(self.index.keys()):
+            self.index[key] = [ent for ent in self.index[key]
+                               if ent[0] != name]
+            if not self.index[key]:
+                del self.index[key]
+        for key, rows in index.items():
+            self.index.setdefault(key, []).extend([[name, row]
+                                                   for row in rows])
+        self._samples.flush()
+        self._flush_meta()
+
+    def set_info(self, key, val):
+        """Record @val (JSON serialisable) as information @key about
+        the run, e.g. where it ran"""
+        if not self.create:
+            err("Results store %s is read-only" % self.path)
+        self.meta['info'][key] = val
+        self._flush_meta()
+
+    def _flush_meta(self):
+        """Write metadata and index"""
+        _write_atomic(os.path.join(self.path, META_FILE),
+                      json.dumps(self.meta, sort_keys=True))
+        _write_atomic(os.path.join(self.path, INDEX_FILE),
+                      json.dumps(self.index, sort_keys=True))
+
+    def close(self):
+        """Close the store, once the tables exported in the background
+        are written"""
+        TableWriter.sync()
+        if self._samples:
+            self._samples.close()
+            self._samples = None
+        for fname in list(self._maps.keys()):
+            self._unmap(fname)
+
+    ##
+    ## Reading
+    ##
+    def tables(self):
+        """Return the names of the tables in the store"""
+        return sorted(self.meta['tables'].keys())
+
+    def info(self, key):
+        """Return the information @key recorded about the run or None"""
+        return self.meta.get('info', {}).get(key)
+
+    def _map(self, fname):
+        """Return a (cached) read-only mapping of file @fname in the
+        store or None if it is empty"""
+        if fname not in self._maps:
+            with open(os.path.join(self.path, fname), 'rb') as inf:
+                size = os.fstat(inf.fileno()).st_size
+                if size:
+                    self._maps[fname] = mmap.mmap(inf.fileno(), size,
+                                                  access=mmap.ACCESS_READ)
+                else:
+                    self._maps[fname] = None
+        return self._maps[fname]
+
+    def _unmap(self, fname):
+        """Drop the cached mapping of @fname"""
+        mem = self._maps.pop(fname, None)
+        if mem is not None:
+            try:
+                mem.close()
+            except BufferError:
+                # Still used by arrays returned to the caller.  The
+                # mapping goes away with them.
+                pass
+
+    def _values(self, fname, kind, start=0, count=None):
+        """Return @count values of typecode @kind from file @fname,
+        starting at entry @start.  The result is a NumPy array backed
+        by the mapping if NumPy is available, otherwise an array."""
+        mem = self._map(fname)
+        width = _array(kind).itemsize
+        if mem is None:
+            total = 0
+        else:
+            total = len(mem) // width
+        if count is None:
+            count = total - start
+        if start < 0 or start + count > total:
+            err("Out of range access to %s" % fname)
+        if numpy is not None:
+            if not count:
+                return numpy.zeros(0, dtype='<' + kind)
+            return numpy.frombuffer(mem, dtype='<' + kind, count=count,
+                                    offset=start * width)
+        res = _array(kind)
+        if count:
+            data = mem[start * width:(start + count) * width]
+            if hasattr(res, 'frombytes'):
+                res.frombytes(data)
+            else:
+                res.fromstring(data) # Python 2
+        if sys.byteorder == 'big':
+            res.byteswap()
+        return res
+
+    def _col_no(self, table, name):
+        """Index of column @name in @table"""
+        cols = [col[0] for col in self.meta['tables'][table]['fmt']
+                if not (col[0] == '' and col[1] == 0)]
+        if name not in cols:
+            err("Table %s has no column %s" % (table, name))
+        return cols.index(name)
+
+    def column(self, table, name):
+        """Return column @name of @table.  Numeric columns are
+        returned as (memory mapped, with NumPy) arrays, string columns
+        as a list of strings."""
+        meta = self.meta['tables'][table]
+        col = self._col_no(table, name)
+        kind = meta['kinds'][col]
+        vals = self._values(os.path.join(table, "%d.col" % col), kind)
+        if kind == _KIND_STR:
+            codes = meta['dicts'][col]
+            return [codes[int(val)] for val in vals]
+        return vals
+
+    def _columns(self, table):
+        """Return the columns of @table as lists of Python values"""
+        meta = self.meta['tables'][table]
+        res = []
+        for col, kind in enumerate(meta['kinds']):
+            vals = self._values(os.path.join(table, "%d.col" % col), kind,
+                                0, meta['rows'])
+            if kind == _KIND_STR:
+                codes = meta['dicts'][col]
+                res.append([codes[int(val)] for val in vals])
+            else:
+                # Python ints and floats, as row() returns
+                res.append(vals.tolist())
+        return res
+
+    def row(self, table, row):
+        """Return row @row of @table as a tuple"""
+        meta = self.meta['tables'][table]
+        if row < 0 or row >= meta['rows']:
+            err("Table %s has no row %d" % (table, row))
+        res = []
+        for col, kind in enumerate(meta['kinds']):
+            val = self._values(os.path.join(table, "%d.col" % col), kind,
+                               row, 1)[0]
+            if kind == _KIND_STR:
+                val = meta['dicts'][col][int(val)]
+            elif kind == _KIND_INT:
+                val = int(val)
+            else:
+                val = float(val)
+            res.append(val)
+        return tuple(res)
+
+    def rows(self, table):
+        """Iterate over the rows of @table"""
+        for vals in zip(*self._columns(table)):
+            yield vals
+
+    def samples(self, table, row):
+        """Return the raw samples stored with row @row of @table or
+        None"""
+        off = int(self._values(os.path.join(table, _SAMPLES_OFF + ".col"),
+                               _KIND_INT, row, 1)[0])
+        cnt = int(self._values(os.path.join(table, _SAMPLES_CNT + ".col"),
+                               _KIND_INT, row, 1)[0])
+        if off < 0:
+            return None
+        return self._values(SAMPLES_FILE, 'I', off, cnt)
+
+    def find(self, test=None, cache=None, access=None, win=None, size=None,
+             h_off=None, d_off=None):
+        """Return a list of (table, row) holding results for a test
+        point.  If all dimensions are given this is a direct index
+        lookup, otherwise the index keys are filtered (the tables
+        themselves are never scanned)."""
+        dims = (test, cache, access, win, size, h_off, d_off)
+        if None not in dims:
+            return [tuple(ent) for ent in
+                    self.index.get(point_index_key(*dims), [])]
+        def _match(want, have):
+            if want is None:
+                return True
+            if isinstance(want, str):
+                return want == have
+            return int(want) == int(have)
+
+        res = []
+        for key, ents in self.index.items():
+            parts = key.split(':')
+            if all(_match(want, have) for want, have in zip(dims, parts)):
+                res.extend([tuple(ent) for ent in ents])
+        return sorted(res)
+
+    ##
+    ## Exporting
+    ##
+    def export(self, table, base=None, mask=None):
+        """Write @table as text, gnuplot and/or CSV file (per @mask,
+        default: as the table was opened) to @base plus the usual
+        extensions (default: next to the store).  The output is
+        identical to what a TableWriter writes directly."""
+        meta = self.meta['tables'][table]
+        if mask is None:
+            mask = meta['mask']
+        if base is None:
+            base = os.path.join(os.path.dirname(os.path.normpath(self.path)),
+                                meta['base'])
+
+        # Not batched, this may run on the background writer thread
+        twr = TableWriter(meta['fmt'], stdout=False)
+        twr.open(base, mask)
+        sections = list(meta['sections'])
+        for row, vals in enumerate(self.rows(table)):
+            while sections and sections[0][0] <= row:
+                twr.sec(sections.pop(0)[1])
+            twr.out(vals)
+        for _, head in sections:
+            twr.sec(head)
+        twr.close(TableWriter.ALL)
+
+    def export_all(self, outdir, mask=None):
+        """Export all tables into directory @outdir"""
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        for table in self.tables():
+            base = self.meta['tables'][table]['base']
+            self.export(table, os.path.join(outdir, base), mask)
+
+
+def open_store(path):
+    """Open the results store of the output directory @path (or the
+    store at @path itself)"""
+    if os.path.isdir(os.path.join(path, RESULTS_DIR)):
+        path = os.path.join(path, RESULTS_DIR)
+    if not os.path.isfile(os.path.join(path, META_FILE)):
+        err("No results store in %s" % path)
+    return ResultStore(path)
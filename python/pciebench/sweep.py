@@ -0,0 +1,130 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Adaptive window size sweeps.
+
+Effects of host caches (DDIO/LLC) and the IOMMU show up as steps in
+latency or bandwidth over the window size.  Instead of running a fixed
+list of window sizes, an adaptive sweep starts from a coarse grid and
+bisects (in log space) only the intervals where adjacent points differ
+by more than a threshold, largest difference first, until a point
+budget is used up.
+"""
+
+import heapq
+import math
+
+# Coarse grid: 1KB to 64MB in steps of 4x
+COARSE_WINDOWS = [1024 * 4 ** i for i in range(9)]
+
+
+def col_index(fmt, name):
+    """Return the index of column @name in rows written with the
+    TableWriter format @fmt (separator entries are not part of rows)"""
+    cols = [col[0] for col in fmt if not (col[0] == '' and col[1] == 0)]
+    return cols.index(name)
+
+
+class RowBuffer(object):
+    """Stands in for a TableWriter and keeps the rows written to it"""
+
+    def __init__(self):
+        self.rows = []
+        self.samples = []
+
+    def out(self, vals, samples=None):
+        """Record a row"""
+        self.rows.append(tuple(vals))
+        self.samples.append(samples)
+
+
+class AdaptiveSweep(object):
+    """Parameters for adaptive sweeps.
+
+    @threshold   Relative difference between neighbouring points
+                 above which the interval between them is bisected
+    @max_points  Maximum number of points per sweep, including the
+                 coarse grid.  None: the size of the fixed grid
+    @min_ratio   Don't bisect intervals where hi/lo is below 1 + this
+    """
+
+    def __init__(self, threshold=0.05, max_points=None, min_ratio=0.1):
+        self.threshold = threshold
+        self.max_points = max_points
+        self.min_ratio = min_ratio
+
+    def coarse(self, win_szs):
+        """Return the coarse grid covering the range of the fixed grid
+        @win_szs"""
+        low = min(win_szs)
+        high = max(win_szs)
+        res = set([low, high])
+        res.update([w for w in COARSE_WINDOWS if low < w < high])
+        return sorted(res)
+
+    @staticmethod
+    def _align(val):
+        """Round a window size to three significant bits (e.g. 40MB,
+        48MB, 56MB) and to at least a cache line, so that points line
+        up between sweeps and print nicely"""
+        val = int(val)
+        align = max(64, 1 << max(val.bit_length() - 3, 0))
+        return int(round(float(val) / align)) * align
+
+    def _diff(self, val0, val1):
+        """Relative difference between two measurements"""
+        base = min(abs(val0), abs(val1))
+        if base == 0:
+            return 0.0 if val0 == val1 else float('inf')
+        return abs(val1 - val0) / base
+
+    def _split(self, low, high):
+        """Return the (aligned) window size to measure between @low
+        and @high or None if the interval is too small"""
+        if high < low * (1 + self.min_ratio):
+            return None
+        mid = self._align(math.sqrt(float(low) * high))
+        if mid <= low or mid >= high:
+            return None
+        return mid
+
+    def run(self, win_szs, measure):
+        """Run an adaptive sweep over the range of @win_szs. @measure
+        is called with a window size and must return the value to
+        compare.  Returns a sorted list of (window size, value)."""
+        budget = self.max_points if self.max_points else len(win_szs)
+        vals = {}
+        for win_sz in self.coarse(win_szs):
+            vals[win_sz] = measure(win_sz)
+
+        # Candidate intervals, largest relative difference first
+        heap = []
+        def _push(low, high):
+            diff = self._diff(vals[low], vals[high])
+            if diff > self.threshold and self._split(low, high):
+                heapq.heappush(heap, (-diff, low, high))
+
+        pts = sorted(vals)
+        for low, high in zip(pts[:-1], pts[1:]):
+            _push(low, high)
+
+        while heap and len(vals) < budget:
+            _, low, high = heapq.heappop(heap)
+            mid = self._split(low, high)
+            vals[mid] = measure(mid)
+            _push(low, mid)
+            _push(mid, high)
+
+        return sorted(vals.items())
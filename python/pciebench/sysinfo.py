@@ -15,25 +15,261 @@
 
 """A modules which collects useful information about a system,
 primarily by executing a bunch of commands and store the output in
-separate files."""
+separate files.
 
+The commands are run concurrently, each with a timeout.  The output
+of commands reporting static facts (DMI, CPU and topology, kernel
+version) is cached in CACHE_DIR.  A cached copy is used if it was
+collected since the last boot and the sysfs files relevant to the
+command have not changed since.  How long each collector took (and
+whether the output was cached) is recorded in TIMES_FILE."""
+
+import json
 import os
+import shutil
+import signal
 import subprocess
-from .debug import err, warn
+import threading
+import time
+from .debug import err, warn, dbg
+
+# Seconds a command may run before it is killed
+DEFAULT_TIMEOUT = 30
+
+# Root of all on-disk caches
+CACHE_ROOT = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                         os.path.expanduser("~/.cache")),
+                          "pciebench")
+CACHE_DIR = os.path.join(CACHE_ROOT, "sysinfo")
+
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+
+TIMES_FILE = "sys-collect.json"
+TIMES_FILE_END = "sys-collect-end.json"
+
+# sysfs files whose modification time invalidates cached output
+_CPU_SYSFS = ["/sys/devices/system/cpu/online",
+              "/sys/devices/system/cpu/present",
+              "/sys/devices/system/node/online"]
+_DMI_SYSFS = ["/sys/firmware/dmi/tables/DMI"]
+
+# Collectors: (output file, command, sysfs files or None).  If the
+# last entry is not None, the output is cached, keyed on the boot ID
+# and the modification time of the sysfs files listed.
+COLLECTORS = [
+    ("sys-date.txt", "date", None),
+    ("sys-hostname.txt", "hostname", None),
+    ("sys-cpuinfo.txt", "cat /proc/cpuinfo", _CPU_SYSFS),
+    ("sys-kernel-cmdline.txt", "cat /proc/cmdline", []),
+    ("sys-memory.txt", "free", None),
+    ("sys-meminfo.txt", "cat /proc/meminfo", None),
+    ("sys-numactl.txt", "numactl --hardware", None),
+    ("sys-lstopo.txt", "lstopo-no-graphics -c", _CPU_SYSFS),
+    ("sys-uname.txt", "uname -a", []),
+    ("sys-lsb_release.txt", "lsb_release -a", []),
+    ("sys-dmidecode.txt", "dmidecode", _DMI_SYSFS),
+    ("sys-lspci.txt", "lspci -vvv", None),
+    ("sys-dmesg.txt", "dmesg", None),
+]
+
+NFP_COLLECTORS = [
+    ("sys-nfp-hwinfo.txt", "nfp-hwinfo -n %d", None),
+    ("sys-dma-addrs.txt", "cat /proc/pciebench_dma_addrs-%d", None),
+    ("sys-buf-sz.txt", "cat /proc/pciebench_buf_sz-%d", None),
+]
+
+END_COLLECTORS = [
+    ("sys-date-end.txt", "date", None),
+    ("sys-dmesg-end.txt", "dmesg", None),
+]
+
+
+def read_file(fname):
+    """Return the stripped contents of @fname or None"""
+    try:
+        with open(fname, 'r') as inf:
+            return inf.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _cache_key(cmd, sysfs):
+    """Return the cache key for the output of @cmd"""
+    key = {'cmd': cmd, 'boot_id': read_file(BOOT_ID),
+           'euid': os.geteuid()}
+    for fname in sysfs:
+        try:
+            key[fname] = os.stat(fname).st_mtime
+        except OSError:
+            key[fname] = None
+    return key
 
-def _exec_redir(cmd, outfn):
-    """Execute command and redirect stdout put to a file"""
-    outf = open(outfn, "w")
+
+def _cache_get(cache_dir, outfn, key):
+    """Copy the cached output for @outfn to @outfn if it is valid for
+    @key.  Returns True on success."""
+    name = os.path.join(cache_dir, os.path.basename(outfn))
     try:
-        subprocess.call(cmd, shell=True, stdout=outf, stderr=outf)
-    except subprocess.CalledProcessError:
-        pass
+        with open(name + ".json", 'r') as inf:
+            if json.load(inf) != key:
+                return False
+        shutil.copyfile(name, outfn)
+    except (IOError, OSError, ValueError):
+        return False
+    return True
+
+
+def _cache_put(cache_dir, outfn, key):
+    """Store @outfn in the cache with @key"""
+    name = os.path.join(cache_dir, os.path.basename(outfn))
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        shutil.copyfile(outfn, name)
+        with open(name + ".json", 'w') as outf:
+            json.dump(key, outf)
+    except (IOError, OSError) as exc:
+        dbg("Can't cache %s: %s" % (outfn, exc))
+
+
+def _wait_proc(run):
+    """Wait for the process of @run and note the time it exited"""
+    run['proc'].wait()
+    run['end'] = time.time()
+
+
+def _start_all(cmds):
+    """Start the shell commands @cmds, a list of (command, output
+    file) tuples, with stdout and stderr redirected to the output
+    file.  Returns a list of runs to pass to _wait_all()."""
+    runs = []
+    for cmd, outfn in cmds:
+        run = {'outf': open(outfn, "w"), 'start': time.time(),
+               'proc': None, 'thread': None}
+        try:
+            run['proc'] = subprocess.Popen(cmd, shell=True,
+                                           stdout=run['outf'],
+                                           stderr=run['outf'],
+                                           preexec_fn=os.setsid)
+        except OSError as exc:
+            run['outf'].write("%s: %s\n" % (cmd, exc))
+        else:
+            run['thread'] = threading.Thread(target=_wait_proc, args=(run,))
+            run['thread'].start()
+        runs.append(run)
+    return runs
+
+
+def _wait_all(runs, timeout):
+    """Wait for the commands started by _start_all().  A command
+    still running after @timeout seconds is killed.  Returns a list of
+    (status, return code, duration in seconds), one per command."""
+    res = []
+    for run in runs:
+        if run['proc'] is None:
+            run['outf'].close()
+            res.append(("failed", None, 0.0))
+            continue
+        run['thread'].join(max(run['start'] + timeout - time.time(), 0))
+        status = None
+        if run['thread'].is_alive():
+            # kill the whole process group, not just the shell
+            try:
+                os.killpg(run['proc'].pid, signal.SIGKILL)
+            except OSError:
+                pass
+            run['thread'].join()
+            run['outf'].write("\n*** Killed after %d seconds\n" % timeout)
+            status = "timeout"
+        run['outf'].close()
+        ret = run['proc'].returncode
+        if status is None:
+            status = "ok" if ret == 0 else "failed"
+        res.append((status, ret, run['end'] - run['start']))
+    return res
+
+
+def _collect(path, collectors, timeout, cache_dir, extra=None):
+    """Run @collectors (see COLLECTORS), writing the output to
+    directory @path, and return a list describing each collector's
+    run.  @extra, if set, is called while the commands run and
+    returns further (output file, description, duration) entries."""
+    times = []
+    cmds = []
+    todo = []
+    for fname, cmd, sysfs in collectors:
+        outfn = os.path.join(path, fname)
+        ent = {'file': fname, 'cmd': cmd}
+        times.append(ent)
+        if cache_dir and sysfs is not None:
+            start = time.time()
+            ent['key'] = _cache_key(cmd, sysfs)
+            if _cache_get(cache_dir, outfn, ent['key']):
+                ent.update({'status': "cached",
+                            'duration': time.time() - start})
+                del ent['key']
+                continue
+        cmds.append((cmd, outfn))
+        todo.append(ent)
+
+    runs = _start_all(cmds)
+    if extra:
+        for fname, desc, duration in extra():
+            times.append({'file': fname, 'cmd': desc, 'status': "ok",
+                          'duration': duration})
+
+    for ent, (status, ret, duration) in zip(todo, _wait_all(runs, timeout)):
+        ent.update({'status': status, 'ret': ret, 'duration': duration})
+        if status == "timeout":
+            warn("%s timed out after %d seconds" % (ent['cmd'], timeout))
+        key = ent.pop('key', None)
+        if key and status == "ok":
+            _cache_put(cache_dir, os.path.join(path, ent['file']), key)
+
+    for ent in times:
+        dbg("sysinfo: %-24s %-8s %7.3fs" %
+            (ent['file'], ent['status'], ent['duration']))
+    return times
+
+
+def _write_times(fname, times, duration):
+    """Write the collector timings @times to @fname"""
+    with open(fname, 'w') as outf:
+        json.dump({'duration': duration, 'collectors': times}, outf,
+                  indent=1, sort_keys=True)
+        outf.write('\n')
+
+
+def _pci_cpulist(path):
+    """On modern Intel/AMD processors PCI devices are local to a CPU.
+    Extract this information from sysfs"""
+    pcidir = "/sys/bus/pci/devices"
+    if not os.path.exists(pcidir):
+        return []
+    start = time.time()
+    outf = open(path + "/sys-pci-cpulist.txt", 'w')
+    for device in os.listdir(pcidir):
+        devpath = pcidir + '/' + device
+        if os.path.exists(devpath + '/local_cpulist'):
+            with open(devpath + '/local_cpulist', 'r') as dev_file:
+                cpu_list = dev_file.read()
+        else:
+            cpu_list = "NA"
+        if os.path.exists(devpath + '/local_cpus'):
+            with open(devpath + '/local_cpus', 'r') as dev_file:
+                cpus = dev_file.read()
+        else:
+            cpus = "NA"
+        outf.write("%s %s %s\n" % (device, cpu_list.strip(), cpus.strip()))
     outf.close()
+    return [("sys-pci-cpulist.txt", pcidir, time.time() - start)]
+
 
-def collect(path, nfp_num=-1):
+def collect(path, nfp_num=-1, timeout=DEFAULT_TIMEOUT, cache_dir=CACHE_DIR):
     """Collect system information and store the output in the
     directory pointed to by @path. If nfp_num is set, collect NFP
-    information as well"""
+    information as well.  Commands are killed after @timeout
+    seconds.  Set @cache_dir to None to not use cached output."""
 
     if os.path.exists(path):
         if not os.path.isdir(path):
@@ -44,53 +280,18 @@ def collect(path, nfp_num=-1):
     if os.geteuid() != 0:
         warn("You are not root, some commands may not work.")
 
-    _exec_redir("date", path + "/sys-date.txt")
-    _exec_redir("hostname", path + "/sys-hostname.txt")
-
-    _exec_redir("cat /proc/cpuinfo", path + "/sys-cpuinfo.txt")
-    _exec_redir("cat /proc/cmdline", path + "/sys-kernel-cmdline.txt")
-    _exec_redir("free", path + "/sys-memory.txt")
-    _exec_redir("cat /proc/meminfo", path + "/sys-meminfo.txt")
-    _exec_redir("numactl --hardware", path + "/sys-numactl.txt")
-    _exec_redir("lstopo-no-graphics -c", path + "/sys-lstopo.txt")
-
-    _exec_redir("uname -a", path + "/sys-uname.txt")
-    _exec_redir("lsb_release -a", path + "/sys-lsb_release.txt")
-    _exec_redir("dmidecode", path + "/sys-dmidecode.txt")
-
-    _exec_redir("lspci -vvv", path + "/sys-lspci.txt")
-
-    _exec_redir("dmesg", path + "/sys-dmesg.txt")
-
-    # On modern Intel/AMD processors PCI devices are local to a CPU
-    # Extract this information from sysfs
-    pcidir = "/sys/bus/pci/devices"
-    if os.path.exists(pcidir):
-        outf = open(path + "/sys-pci-cpulist.txt", 'w')
-        for device in os.listdir(pcidir):
-            devpath = pcidir + '/' + device
-            if os.path.exists(devpath + '/local_cpulist'):
-                with open(devpath + '/local_cpulist', 'r') as dev_file:
-                    cpu_list = dev_file.read()
-            else:
-                cpu_list = "NA"
-            if os.path.exists(devpath + '/local_cpus'):
-                with open(devpath + '/local_cpus', 'r') as dev_file:
-                    cpus = dev_file.read()
-            else:
-                cpus = "NA"
-            outf.write("%s %s %s\n" % (device, cpu_list.strip(), cpus.strip()))
-        outf.close()
-
+    start = time.time()
+    collectors = list(COLLECTORS)
     if not nfp_num == -1:
-        _exec_redir("nfp-hwinfo -n %d" % nfp_num, path + "/sys-nfp-hwinfo.txt")
-        _exec_redir("cat /proc/pciebench_dma_addrs-%d" % nfp_num,
-                    path + "/sys-dma-addrs.txt")
-        _exec_redir("cat /proc/pciebench_buf_sz-%d" % nfp_num,
-                    path + "/sys-buf-sz.txt")
+        collectors += [(fname, cmd % nfp_num, sysfs)
+                       for fname, cmd, sysfs in NFP_COLLECTORS]
+
+    times = _collect(path, collectors, timeout, cache_dir,
+                     lambda: _pci_cpulist(path))
+    _write_times(os.path.join(path, TIMES_FILE), times, time.time() - start)
 
 
-def end(path):
+def end(path, timeout=DEFAULT_TIMEOUT):
     """Collect system information at the end of a benchmark"""
 
     if os.path.exists(path):
@@ -102,8 +303,10 @@ def end(path):
     if os.geteuid() != 0:
         warn("You are not root, some commands may not work.")
 
-    _exec_redir("date", path + "/sys-date-end.txt")
-    _exec_redir("dmesg", path + "/sys-dmesg-end.txt")
+    start = time.time()
+    times = _collect(path, END_COLLECTORS, timeout, None)
+    _write_times(os.path.join(path, TIMES_FILE_END), times,
+                 time.time() - start)
 
 
 # Test
@@ -17,6 +17,14 @@
 
 import sys
 import csv
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .debug import err
 
 def sz2unit(num):
     """Convert a size into a string with units"""
@@ -24,10 +32,10 @@ def sz2unit(num):
         out_num = num
         out_unit = "B"
     if num < (1024 * 1024):
-        out_num = num / 1024
+        out_num = num / 1024.0
         out_unit = "KB"
     else:
-        out_num = num / (1024 * 1024)
+        out_num = num / (1024 * 1024.0)
         out_unit = "MB"
     if int(out_num) == out_num:
         return "%d%s" % (int(out_num), out_unit)
@@ -40,10 +48,10 @@ def ns2unit(num):
         out_num = num
         out_unit = "ns"
     if num < (1000 * 1000):
-        out_num = num / 1000
+        out_num = num / 1000.0
         out_unit = "us"
     else:
-        out_num = num / (1000 * 1000)
+        out_num = num / (1000 * 1000.0)
         out_unit = "ms"
     if int(out_num) == out_num:
         return "%d%s" % (int(out_num), out_unit)
@@ -51,6 +59,61 @@ def ns2unit(num):
         return "%.2f%s" % (out_num, out_unit)
 
 
+class _Background(object):
+    """A thread running the file writes of batched TableWriters.
+    Queued items are a function and its arguments.  The first error
+    is kept and reported to the next caller of wait()."""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run,
+                                       name="TableWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    @classmethod
+    def get(cls):
+        """Return the background writer, starting it if needed"""
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def _run(self):
+        while True:
+            func, args = self.queue.get()
+            try:
+                func(*args)
+            except Exception as exc: # pylint: disable=broad-except
+                if self.error is None:
+                    self.error = exc
+            finally:
+                self.queue.task_done()
+
+    def put(self, func, *args):
+        """Queue a call of @func with @args"""
+        self.queue.put((func, args))
+
+    def wait(self):
+        """Wait for everything queued to complete"""
+        self.queue.join()
+        if self.error is not None:
+            exc, self.error = self.error, None
+            err("Writing table data failed: %s" % exc)
+
+    @classmethod
+    def sync(cls):
+        """Wait for the background writer, if it was started"""
+        with cls._lock:
+            inst = cls._instance
+        if inst is not None:
+            inst.wait()
+
+
 class TableWriter(object):
     """A class for pretty-printing table like data to stdout while
     also logging the data in files in various format"""
@@ -65,7 +128,10 @@ class TableWriter(object):
 
     ALL = TXT | GNP | CSV
 
-    def __init__(self, fmt, stdout=True):
+    # Number of rows handed to the background thread at a time
+    BATCH = 4096
+
+    def __init__(self, fmt, stdout=True, store=None, batched=False):
         """Initialise the TableWriter
 
         @fmt is a list of tuples.  Each item in the list describes a
@@ -89,6 +155,23 @@ class TableWriter(object):
         data to files.
 
         By setting format to None, you get a dummy writer object
+
+        If a ResultStore is passed in @store, rows are added to a
+        table in the store instead of being written to the files
+        directly.  The text, gnuplot and CSV files are exported from
+        the store when the table is closed.
+
+        With @batched set, rows and sections are queued and formatted
+        and written to the files in blocks by a background thread.
+        The files are flushed by sec() and close() and close() waits
+        for all writes to complete.  Rows printed to stdout are
+        written directly, to keep them in order with other messages,
+        but only flushed by sec(), msg() and close().  The output is
+        the same as without @batched.
+
+        With both @store and @batched, the table is exported by the
+        background thread instead.  The export is waited for by the
+        next open() of a batched writer, sync() or closing the store.
         """
 
         # output streams
@@ -98,6 +181,13 @@ class TableWriter(object):
         self.csvf = None
         self.csv = None
 
+        self.store = store
+        self.table = None
+
+        self.batched = batched
+        self.bg = _Background.get() if batched else None
+        self.pending = []
+
         self.out_hdr_printed = False
         self.txt_first_sec = True
         self.gnp_first_sec = True
@@ -111,6 +201,7 @@ class TableWriter(object):
 
         # Convert the format.
         # Create a format string output formats which need it
+        self.fmt = fmt
         self.format = []
         self.std_hdr = self.std_fmt = ""
         for col in fmt:
@@ -147,6 +238,20 @@ class TableWriter(object):
         if self.format == None:
             return
 
+        if self.store:
+            if self.batched:
+                # the previous exports had the time since to finish
+                self.bg.wait()
+            if self.table:
+                self._close_table()
+            self.table = self.store.create_table(base, self.fmt, mask)
+            return
+
+        if self.batched:
+            # files are (re)opened here, so finish writing the old ones
+            self._submit()
+            self.bg.wait()
+
         if mask & self.TXT:
             if self.txt:
                 self.txt.close()
@@ -169,9 +274,43 @@ class TableWriter(object):
             self.csv.writerow([x[0] for x in self.format])
 
     def close(self, mask):
-        """Open a data file."""
+        """Close a data file."""
         if self.format == None:
             return
+        if self.store:
+            if self.table:
+                self._close_table()
+            if self.std:
+                self.std.flush()
+            return
+        if self.batched:
+            self._submit()
+            self.bg.put(self._close_files, mask)
+            self.bg.wait()
+            if self.std:
+                self.std.flush()
+            return
+        self._close_files(mask)
+
+    def _close_table(self):
+        """Close the store table.  If batched, it is exported by the
+        background thread."""
+        table, self.table = self.table, None
+        if not self.batched:
+            table.close()
+            return
+        table.close(export=False)
+        if table.mask:
+            self.bg.put(self.store.export, table.name, table.base)
+
+    @staticmethod
+    def sync():
+        """Wait for the background writes and exports of all batched
+        writers"""
+        _Background.sync()
+
+    def _close_files(self, mask):
+        """Close the files selected by @mask"""
         if mask & self.TXT:
             if self.txt:
                 self.txt.close()
@@ -182,11 +321,34 @@ class TableWriter(object):
             if self.csvf:
                 self.csvf.close()
 
-    def out(self, vals):
-        """Print a tuple/list of values and write them to all open files"""
+    def out(self, vals, samples=None):
+        """Print a tuple/list of values and write them to all open
+        files.  The raw @samples the values are derived from are
+        recorded if a results store is used."""
         if self.format == None:
             return
+        if self.table:
+            self.table.append(vals, samples)
 
+        if self.std:
+            if not self.out_hdr_printed:
+                self.std.write(self.std_hdr)
+                self.out_hdr_printed = True
+            self.std.write(self.std_fmt % self._units(vals))
+            if not self.batched:
+                self.std.flush()
+
+        if not (self.txt or self.gnp or self.csv):
+            return
+        if self.batched:
+            self.pending.append((self._out_files, vals))
+            if len(self.pending) >= self.BATCH:
+                self._submit()
+        else:
+            self._out_files(vals)
+
+    def _units(self, vals):
+        """Return @vals with sizes and times converted for printing"""
         tmp = ()
         for i in range(len(vals)):
             if self.format[i][2] == '%z':
@@ -195,21 +357,38 @@ class TableWriter(object):
                 tmp += ns2unit(vals[i]),
             else:
                 tmp += vals[i],
+        return tmp
 
-        if self.std:
-            if not self.out_hdr_printed:
-                self.std.write(self.std_hdr)
-                self.out_hdr_printed = True
-            self.std.write(self.std_fmt % tmp)
-            self.std.flush()
-
+    def _out_files(self, vals):
+        """Write a row of values to all open files"""
         if self.txt:
-            self.txt.write(self.std_fmt % tmp)
+            self.txt.write(self.std_fmt % self._units(vals))
         if self.gnp:
             self.gnp.write(self.gnp_fmt % vals)
         if self.csv:
             self.csv.writerow(vals)
 
+    def _submit(self, flush=False):
+        """Hand the pending rows and sections to the background
+        thread, optionally followed by flushing the files"""
+        if self.pending:
+            self.bg.put(self._write_pending, self.pending)
+            self.pending = []
+        if flush:
+            self.bg.put(self._flush_files)
+
+    @staticmethod
+    def _write_pending(pending):
+        """Perform a list of queued (function, argument) writes"""
+        for func, arg in pending:
+            func(arg)
+
+    def _flush_files(self):
+        """Flush all open files"""
+        for stream in [self.txt, self.gnp, self.csvf]:
+            if stream and not stream.closed:
+                stream.flush()
+
     def sec(self, head=None):
         """Some data file allow sections. This creates a new section
         with an optional section heading"""
@@ -224,6 +403,19 @@ class TableWriter(object):
             self.std.flush()
             self.out_hdr_printed = True
 
+        if self.table:
+            self.table.section(head)
+
+        if not (self.txt or self.gnp):
+            return
+        if self.batched:
+            self.pending.append((self._sec_files, head))
+            self._submit(flush=True)
+        else:
+            self._sec_files(head)
+
+    def _sec_files(self, head):
+        """Start a new section in the text and gnuplot files"""
         if self.txt:
             if self.txt_first_sec:
                 if head:
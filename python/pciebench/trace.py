@@ -0,0 +1,246 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Tracing of where the time of a run goes.
+
+Code is instrumented with spans:
+
+    with span("journal", entries=count):
+        ...
+
+or, for whole functions, with the @traced decorator.  Spans are only
+recorded after start() was called.  Until then span() returns a shared
+object which does nothing, so instrumented code costs little more
+than a function call.
+
+The spans recorded can be written as a Chrome trace (JSON, which
+chrome://tracing and Perfetto load) and summarised per span name.  The
+count and total time per span name are also kept as spans end, for
+the progress exporter (see progress.py), which starts a tracer that
+keeps only these.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+from .tablewriter import TableWriter
+
+# The active Tracer, if any
+_TRACER = None
+
+SUMMARY_FMT = [("span", 22, "%s"), ("count", 8, "%d"), ('', 0, ''),
+               ("total", 9, "%t"), ("self", 9, "%t"), ("avg", 9, "%t"),
+               ("max", 9, "%t"), ("self%", 6, "%.1f")]
+
+
+class _NoSpan(object):
+    """What span() returns when not tracing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        """Ignore @args"""
+        return
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span(object):
+    """A span being recorded"""
+
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.name, self.start, time.time(), self.args)
+        return False
+
+    def set(self, **args):
+        """Add @args to the arguments recorded with the span"""
+        self.args.update(args)
+
+
+class Tracer(object):
+    """Collects spans as (name, start, end, thread, args) tuples, with
+    times in seconds since the epoch, and the count and total time per
+    span name.  With @keep unset only the totals are kept."""
+
+    def __init__(self, keep=True):
+        self.spans = []
+        self.totals = {}
+        self.keep = keep
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end, args=None):
+        """Record span @name from @start to @end"""
+        ent = (name, start, end, threading.current_thread().ident, args)
+        with self.lock:
+            if self.keep:
+                self.spans.append(ent)
+            tot = self.totals.setdefault(name, [0, 0.0])
+            tot[0] += 1
+            tot[1] += end - start
+
+    def chrome(self):
+        """Return the spans as a Chrome trace event dictionary"""
+        pid = os.getpid()
+        tids = {}
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+                   'args': {'name': 'pciebench'}}]
+        for name, start, end, thread, args in self.spans:
+            tid = tids.setdefault(thread, len(tids))
+            evt = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': round((start - self.start) * 1e6, 3),
+                   'dur': round((end - start) * 1e6, 3)}
+            if args:
+                evt['args'] = args
+            events.append(evt)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome(self, path):
+        """Write the spans as a Chrome trace to @path"""
+        with open(path, 'w') as outf:
+            json.dump(self.chrome(), outf)
+
+    def summary(self):
+        """Return a list of (name, count, total, self, max) tuples, in
+        seconds, sorted by self time.  The self time of a span excludes
+        the time of the spans nested in it."""
+        stats = {}
+        by_thread = {}
+        for ent in self.spans:
+            by_thread.setdefault(ent[3], []).append(ent)
+        for spans in by_thread.values():
+            # parents before children: by start, longer first
+            spans.sort(key=lambda ent: (ent[1], -ent[2]))
+            stack = []
+            for name, start, end, _, _ in spans:
+                while stack and stack[-1][1] <= start:
+                    stack.pop()
+                dur = end - start
+                if stack:
+                    stats[stack[-1][0]][2] -= dur
+                ent = stats.setdefault(name, [0, 0.0, 0.0, 0.0])
+                ent[0] += 1
+                ent[1] += dur
+                ent[2] += dur
+                ent[3] = max(ent[3], dur)
+                stack.append((name, end))
+        res = [(name, cnt, total, own, dmax)
+               for name, (cnt, total, own, dmax) in stats.items()]
+        return sorted(res, key=lambda ent: -ent[3])
+
+    def write_summary(self, twr):
+        """Write the summary to the TableWriter @twr (set up with
+        SUMMARY_FMT)"""
+        wall = max(time.time() - self.start, 1e-9)
+        for name, cnt, total, own, dmax in self.summary():
+            twr.out((name, cnt, total * 1e9, own * 1e9, total * 1e9 / cnt,
+                     dmax * 1e9, 100.0 * own / wall))
+
+
+def start(keep=True):
+    """Start recording spans and return the Tracer.  With @keep unset
+    only the totals per span name are kept."""
+    global _TRACER
+    _TRACER = Tracer(keep)
+    return _TRACER
+
+
+def stop():
+    """Stop recording spans and return the Tracer (or None)"""
+    global _TRACER
+    tracer, _TRACER = _TRACER, None
+    return tracer
+
+
+def enabled():
+    """True if spans are being recorded"""
+    return _TRACER is not None
+
+
+def totals():
+    """Return a dictionary of the count and total time (in seconds) of
+    the spans ended so far, by name"""
+    tracer = _TRACER
+    if tracer is None:
+        return {}
+    with tracer.lock:
+        return dict((name, tuple(tot))
+                    for name, tot in tracer.totals.items())
+
+
+def span(name, **args):
+    """Return a context manager recording a span called @name with the
+    arguments @args"""
+    if _TRACER is None:
+        return _NO_SPAN
+    return _Span(_TRACER, name, args)
+
+
+def add_span(name, start, end, **args):
+    """Record a span timed elsewhere, from @start to @end"""
+    if _TRACER is not None:
+        _TRACER.add(name, start, end, args)
+
+
+def traced(func):
+    """Decorator recording a span, named after the function, for every
+    call of @func"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        if _TRACER is None:
+            return func(*args, **kwargs)
+        with _Span(_TRACER, name, {}):
+            return func(*args, **kwargs)
+    return _wrapper
+
+
+def write(path, outbase=None):
+    """Stop tracing, write the Chrome trace to @path and print the
+    summary (also writing it to @outbase.txt/.csv if given)"""
+    tracer = stop()
+    if tracer is None:
+        return
+    tracer.write_chrome(path)
+    twr = TableWriter(SUMMARY_FMT)
+    if outbase:
+        twr.open(outbase, TableWriter.TXT | TableWriter.CSV)
+    twr.msg("\nWhere the time went (self%% of %.1fs)\n" %
+            (time.time() - tracer.start))
+    twr.sec()
+    tracer.write_summary(twr)
+    if outbase:
+        twr.close(TableWriter.TXT | TableWriter.CSV)
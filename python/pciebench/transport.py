@@ -0,0 +1,423 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Transports used by NFPBench to access run-time symbols on the NFP.
+
+A transport hides how the host talks to the card.  Three are provided:
+
+@SubprocessTransport  Run the NFP userspace utilities (nfp-rtsym,
+                      nfp-hwinfo, nfp-nffw) for every access.  Slow,
+                      but only needs the utilities to be installed.
+@LibNFPTransport      Bind to libnfp with ctypes and keep the device
+                      open across calls.  No fork/exec per access.
+@FakeTransport        In-memory symbols, no card required.  Useful to
+                      measure the cost of the control code itself.
+
+All transports operate on 32bit little endian words for writes and
+return raw bytes for reads.
+"""
+
+import ctypes
+import ctypes.util
+import struct
+import subprocess
+
+from .debug import err, dbg, trc
+
+# Location of the NFP userspace utilities and library
+NFP_BIN_DIR = "/opt/netronome/bin"
+NFP_LIB_DIR = "/opt/netronome/lib"
+
+
+class TransportError(Exception):
+    """The NFP can't be opened through a transport"""
+    pass
+
+
+def _exec_cmd(cmd):
+    """Execute a command and return a tuple of return code and output"""
+    trc(cmd)
+    print(cmd)
+    proc = subprocess.Popen(cmd, bufsize=16384, shell=True, close_fds=True,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+
+    # wait for process to terminate
+    res_data, _ = proc.communicate(None)
+    ret = proc.returncode
+
+    return ret, res_data
+
+
+def _parse_hwinfo(out):
+    """Parse the key=value output of nfp-hwinfo into a dictionary"""
+    ret = {}
+    for line in out.split('\n'):
+        line = line.strip()
+        key, _, val = line.partition("=")
+        ret[key] = val
+    return ret
+
+
+class Symbol(object):
+    """A struct, really"""
+    def __init__(self, off, size):
+        self.off = off
+        self.size = size
+        return
+
+
+class Transport(object):
+    """Base class for all transports.  Sub-classes must implement
+    hwinfo(), symbols(), read() and write()."""
+
+    name = "none"
+
+    # Directory containing the procfs files of the kernel module
+    procdir = "/proc"
+
+    # True if a read at an offset only transfers the bytes read.  If
+    # not, large ranges are best read in one go.
+    offset_reads = True
+
+    def __init__(self, nfp_num=0):
+        self.nfp_num = nfp_num
+        self.symtab = {}
+
+        # Access counters, handy for benchmarking the control path
+        self.reads = 0
+        self.writes = 0
+        return
+
+    def hwinfo(self):
+        """Return the hardware information as a dictionary"""
+        raise NotImplementedError
+
+    def symbols(self):
+        """Return the symbol table as a dictionary, indexed by name and
+        containing Symbol objects"""
+        raise NotImplementedError
+
+    def lookup(self, name):
+        """Look up symbol @name on the device, ignoring the symbol
+        table cached by the transport (which may come from a
+        NFPCache).  Returns a Symbol or None if the firmware loaded,
+        if any, doesn't have it."""
+        raise NotImplementedError
+
+    def read(self, name, length=None, offset=0):
+        """Read @length bytes (default: the rest of the symbol) from
+        symbol @name, starting at byte @offset.  Returns a bytes like
+        object."""
+        raise NotImplementedError
+
+    def write(self, name, words):
+        """Write a list of 32bit @words to the start of symbol @name"""
+        raise NotImplementedError
+
+    def load_fw(self, fwfile):
+        """Load the firmware image @fwfile onto the NFP"""
+        subprocess.call("%s/nfp-nffw %s load -n %d --ignore-debugger" %
+                        (NFP_BIN_DIR, fwfile, self.nfp_num), shell=True)
+        self.symtab = {}
+        return
+
+    def unload_fw(self):
+        """Unload any firmware from the NFP"""
+        subprocess.call("%s/nfp-nffw unload -n %d --ignore-debugger "
+                        "2> /dev/null" % (NFP_BIN_DIR, self.nfp_num),
+                        shell=True)
+        self.symtab = {}
+        return
+
+    def close(self):
+        """Release any resources held by the transport"""
+        return
+
+    def pcie_link(self):
+        """Return a pcie.LinkConfig if the transport knows the PCIe link
+        of the NFP.  By default (None) it is looked up in sysfs."""
+        return None
+
+    def _length(self, name, length, offset=0):
+        """Return the number of bytes to access for symbol @name"""
+        if length is None:
+            return self.symbols()[name].size - offset
+        return length
+
+
+class SubprocessTransport(Transport):
+    """Access the NFP by executing nfp-rtsym for every access"""
+
+    name = "rtsym"
+
+    # nfp-rtsym reads from the start of the symbol
+    offset_reads = False
+
+    def hwinfo(self):
+        _, out = _exec_cmd("%s/nfp-hwinfo -n %d" % (NFP_BIN_DIR, self.nfp_num))
+        return _parse_hwinfo(out.decode('ascii'))
+
+    def _list(self):
+        """Return the symbol table listed by nfp-rtsym"""
+        res = {}
+        _, out = _exec_cmd("%s/nfp-rtsym -n %d -L" % (NFP_BIN_DIR, self.nfp_num))
+        out = out.decode('ascii')
+        for line in out.split("\n"):
+            elems = line.split()
+            if len(elems) == 0:
+                continue
+            if elems[0] == "Name":
+                continue
+            name = elems[0].strip()
+            off = int(elems[2], 16)
+            size = int(elems[3], 16)
+            trc("%s 0x%08x 0x%08x" % (name, off, size))
+            res[name] = Symbol(off, size)
+        return res
+
+    def symbols(self):
+        # No need to re-read the symbol table on every access.
+        if len(self.symtab):
+            return self.symtab
+        self.symtab = self._list()
+        return self.symtab
+
+    def lookup(self, name):
+        return self._list().get(name)
+
+    def read(self, name, length=None, offset=0):
+        self.reads += 1
+        length = self._length(name, length, offset)
+        # Read from the start of the symbol and skip @offset bytes
+        _, res_data = _exec_cmd("%s/nfp-rtsym -n %d -l %d -R %s" %
+                                (NFP_BIN_DIR, self.nfp_num, offset + length,
+                                 name))
+        # nfp-rtsym may append a trailing newline to raw output
+        return memoryview(res_data)[offset:offset + length]
+
+    def write(self, name, words):
+        self.writes += 1
+        val = ' '.join(["0x%x" % w for w in words])
+        _, _ = _exec_cmd("%s/nfp-rtsym -n %d %s %s" %
+                         (NFP_BIN_DIR, self.nfp_num, name, val))
+        return
+
+
+class _NfpRtsym(ctypes.Structure):
+    """struct nfp_rtsym from nfp_nffw.h"""
+    # pylint: disable=too-few-public-methods
+    _fields_ = [("name", ctypes.c_char_p),
+                ("addr", ctypes.c_uint64),
+                ("size", ctypes.c_uint64),
+                ("type", ctypes.c_int),
+                ("target", ctypes.c_int),
+                ("domain", ctypes.c_int)]
+
+
+def _load_libnfp():
+    """Load libnfp and set up the prototypes of the functions we use"""
+    path = ctypes.util.find_library("nfp")
+    if not path:
+        path = NFP_LIB_DIR + "/libnfp.so"
+    lib = ctypes.CDLL(path)
+
+    rtsym_p = ctypes.POINTER(_NfpRtsym)
+
+    lib.nfp_device_open.argtypes = [ctypes.c_uint]
+    lib.nfp_device_open.restype = ctypes.c_void_p
+    lib.nfp_device_close.argtypes = [ctypes.c_void_p]
+    lib.nfp_device_close.restype = None
+    lib.nfp_rtsym_count.argtypes = [ctypes.c_void_p]
+    lib.nfp_rtsym_count.restype = ctypes.c_int
+    lib.nfp_rtsym_get.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lib.nfp_rtsym_get.restype = rtsym_p
+    lib.nfp_rtsym_lookup.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    lib.nfp_rtsym_lookup.restype = rtsym_p
+    lib.nfp_rtsym_read.argtypes = [ctypes.c_void_p, rtsym_p, ctypes.c_void_p,
+                                   ctypes.c_size_t, ctypes.c_uint64]
+    lib.nfp_rtsym_read.restype = ctypes.c_int
+    lib.nfp_rtsym_write.argtypes = [ctypes.c_void_p, rtsym_p, ctypes.c_void_p,
+                                    ctypes.c_size_t, ctypes.c_uint64]
+    lib.nfp_rtsym_write.restype = ctypes.c_int
+    return lib
+
+
+class LibNFPTransport(Transport):
+    """Access the NFP through libnfp, keeping the device open across
+    calls.  Symbol handles are looked up once and cached."""
+
+    name = "libnfp"
+
+    def __init__(self, nfp_num=0):
+        Transport.__init__(self, nfp_num)
+        self.lib = _load_libnfp()
+        self.dev = None
+        self.handles = {}
+        self._open()
+        return
+
+    def _open(self):
+        """(Re-)open the device handle"""
+        if self.dev:
+            self.lib.nfp_device_close(self.dev)
+        self.dev = self.lib.nfp_device_open(self.nfp_num)
+        if not self.dev:
+            raise TransportError("Failed to open NFP device %d" %
+                                 self.nfp_num)
+        self.handles = {}
+        self.symtab = {}
+        return
+
+    def _handle(self, name):
+        """Return the (cached) rtsym handle for @name"""
+        if name not in self.handles:
+            sym = self.lib.nfp_rtsym_lookup(self.dev, name.encode('ascii'))
+            if not sym:
+                err("Symbol %s not found" % name)
+            self.handles[name] = sym
+        return self.handles[name]
+
+    def hwinfo(self):
+        # libnfp can only look up individual keys, so get the full
+        # list once from the utility.
+        _, out = _exec_cmd("%s/nfp-hwinfo -n %d" % (NFP_BIN_DIR, self.nfp_num))
+        return _parse_hwinfo(out.decode('ascii'))
+
+    def symbols(self):
+        if len(self.symtab):
+            return self.symtab
+        for idx in range(self.lib.nfp_rtsym_count(self.dev)):
+            sym = self.lib.nfp_rtsym_get(self.dev, idx)
+            if not sym:
+                continue
+            name = sym.contents.name.decode('ascii')
+            trc("%s 0x%08x 0x%08x" % (name, sym.contents.addr,
+                                      sym.contents.size))
+            self.symtab[name] = Symbol(sym.contents.addr, sym.contents.size)
+        return self.symtab
+
+    def lookup(self, name):
+        # Not cached in handles, the symbol table read on open is
+        # that of the device.
+        sym = self.lib.nfp_rtsym_lookup(self.dev, name.encode('ascii'))
+        if not sym:
+            return None
+        return Symbol(sym.contents.addr, sym.contents.size)
+
+    def read(self, name, length=None, offset=0):
+        self.reads += 1
+        length = self._length(name, length, offset)
+        # Read straight into the buffer we return
+        buf = bytearray(length)
+        cbuf = (ctypes.c_char * length).from_buffer(buf)
+        ret = self.lib.nfp_rtsym_read(self.dev, self._handle(name),
+                                      cbuf, length, offset)
+        if ret < 0:
+            err("Failed to read %d bytes from %s (%d)" % (length, name, ret))
+        return buf
+
+    def write(self, name, words):
+        self.writes += 1
+        data = struct.pack('<%uI' % len(words), *words)
+        ret = self.lib.nfp_rtsym_write(self.dev, self._handle(name),
+                                       data, len(data), 0)
+        if ret < 0:
+            err("Failed to write %d bytes to %s (%d)" % (len(data), name, ret))
+        return
+
+    def load_fw(self, fwfile):
+        Transport.load_fw(self, fwfile)
+        # The symbol table is cached by the device handle
+        self._open()
+        return
+
+    def unload_fw(self):
+        Transport.unload_fw(self)
+        self._open()
+        return
+
+    def close(self):
+        if self.dev:
+            self.lib.nfp_device_close(self.dev)
+            self.dev = None
+        return
+
+
+class FakeTransport(Transport):
+    """An in-memory transport.  @symbols is a dictionary of symbol
+    names and sizes, @hwinfo the hardware information to report."""
+
+    name = "fake"
+
+    def __init__(self, nfp_num=0, symbols=None, hwinfo=None):
+        Transport.__init__(self, nfp_num)
+        self.info = dict(hwinfo) if hwinfo else {'me.speed': '1200'}
+        self.mem = {}
+        off = 0
+        for name, size in sorted((symbols or {}).items()):
+            self.symtab[name] = Symbol(off, size)
+            self.mem[name] = bytearray(size)
+            off += (size + 7) & ~7
+        # The symbol table of the "firmware", symtab may be replaced
+        self.device_symtab = dict(self.symtab)
+        return
+
+    def hwinfo(self):
+        return dict(self.info)
+
+    def symbols(self):
+        return self.symtab
+
+    def lookup(self, name):
+        return self.device_symtab.get(name)
+
+    def read(self, name, length=None, offset=0):
+        self.reads += 1
+        length = self._length(name, length, offset)
+        return bytes(self.mem[name][offset:offset + length])
+
+    def write(self, name, words):
+        self.writes += 1
+        data = struct.pack('<%uI' % len(words), *words)
+        self.mem[name][:len(data)] = data
+        return
+
+    def load_fw(self, fwfile):
+        for name in self.mem:
+            self.mem[name][:] = bytearray(len(self.mem[name]))
+        return
+
+    def unload_fw(self):
+        return
+
+
+TRANSPORTS = {SubprocessTransport.name: SubprocessTransport,
+              LibNFPTransport.name: LibNFPTransport}
+
+
+def open_transport(nfp_num=0, kind="auto"):
+    """Open a transport for NFP @nfp_num.  @kind is one of 'auto',
+    'libnfp' or 'rtsym'.  'auto' uses libnfp if it can be loaded and
+    the device opened with it, and falls back to executing nfp-rtsym."""
+    if kind == "auto":
+        try:
+            return LibNFPTransport(nfp_num)
+        except (OSError, AttributeError, TransportError) as exc:
+            dbg("libnfp not usable (%s), falling back to nfp-rtsym" % exc)
+            return SubprocessTransport(nfp_num)
+    if kind not in TRANSPORTS:
+        err("Unknown transport %s" % kind)
+    return TRANSPORTS[kind](nfp_num)
@@ -0,0 +1,88 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Tests of the statistics comparing two runs.
+
+The samples are unsigned 32 bit cycle counts, as the results store
+returns them.
+"""
+
+import array
+import random
+import unittest
+
+from pciebench import compare
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def samples(scale=1.0, num=2000, seed=0):
+    """Return @num latency samples around 600 cycles, times @scale, in
+    the type the store returns"""
+    rng = random.Random(seed)
+    vals = [int(scale * (550 + rng.expovariate(1 / 50.0)))
+            for _ in range(num)]
+    if numpy is not None:
+        return numpy.array(vals, dtype=numpy.uint32)
+    return array.array('L', vals)
+
+
+class CompareTest(unittest.TestCase):
+    """Comparing a base sample set against shifted copies"""
+
+    def setUp(self):
+        self.base = compare.value_counts(samples())
+        self.faster = compare.value_counts(samples(0.9))
+        self.slower = compare.value_counts(samples(1.1))
+
+    def test_same(self):
+        pval, delta = compare.mann_whitney(self.base, self.base)
+        self.assertAlmostEqual(delta, 0.0)
+        self.assertGreater(pval, 0.5)
+        for low, high in compare.bootstrap(self.base, self.base,
+                                           resamples=200):
+            self.assertLessEqual(low, 0)
+            self.assertGreaterEqual(high, 0)
+            self.assertLess(high - low, 100)
+
+    def test_faster(self):
+        pval, delta = compare.mann_whitney(self.base, self.faster)
+        self.assertLess(pval, 0.01)
+        self.assertLess(delta, -0.5)
+        for low, high in compare.bootstrap(self.base, self.faster,
+                                           resamples=200):
+            self.assertLess(-200, low)
+            self.assertLess(high, 0)
+
+    def test_slower(self):
+        pval, delta = compare.mann_whitney(self.base, self.slower)
+        self.assertLess(pval, 0.01)
+        self.assertGreater(delta, 0.5)
+        for low, high in compare.bootstrap(self.base, self.slower,
+                                           resamples=200):
+            self.assertGreater(low, 0)
+            self.assertLess(high, 200)
+
+    def test_scale(self):
+        vals, cnts = compare.value_counts(samples(), scale=2.0)
+        self.assertEqual(list(vals), [2.0 * val for val in self.base[0]])
+        self.assertEqual(list(cnts), list(self.base[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Tests of the PCIe link parsing and bandwidth model.
+
+data/lspci-vvv.txt is 'lspci -vvv -D' output (as root) of a Xeon E5
+v3 system, trimmed to an Intel 82599 on a CPU root port and a NFP-6000
+on another, next to two chipset root ports.
+data/nfp6000-config.bin is a synthetic configuration space of a
+NFP-6000 (PM, MSI-X and PCI Express capabilities) trained at Gen3 x8
+with MPS 256 and MRRS 512.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from pciebench import pcie
+from pciebench.pcie import LinkConfig, PCIeModel, BW_RD, BW_WR, BW_RW
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Offset of the PCI Express capability in nfp6000-config.bin
+EXP = 0xc0
+
+
+def data(name, mode='r'):
+    """Return the contents of the test data file @name"""
+    with open(os.path.join(DATA, name), mode) as inf:
+        return inf.read()
+
+
+class LspciTest(unittest.TestCase):
+    """Parsing of 'lspci -vvv' output"""
+
+    def setUp(self):
+        self.text = data("lspci-vvv.txt")
+        self.devs = pcie.lspci_devices(self.text)
+
+    def test_devices(self):
+        self.assertEqual(sorted(self.devs),
+                         ["0000:00:00.0", "0000:00:01.0", "0000:00:03.0",
+                          "0000:00:1c.0", "0000:00:1c.4", "0000:01:00.0",
+                          "0000:04:00.0"])
+        self.assertTrue(self.devs["0000:04:00.0"].startswith(
+            "0000:04:00.0 Ethernet controller: Netronome"))
+
+    def test_parse_dev_endpoint(self):
+        self.assertEqual(pcie.parse_lspci_dev(self.devs["0000:04:00.0"]),
+                         {'gen': 3, 'width': 8, 'max_gen': 3,
+                          'max_width': 8, 'mps': 256, 'mrrs': 512,
+                          'rcb': 64})
+
+    def test_parse_dev_degraded(self):
+        self.assertEqual(pcie.parse_lspci_dev(self.devs["0000:01:00.0"]),
+                         {'gen': 2, 'width': 4, 'max_gen': 2,
+                          'max_width': 8, 'mps': 256, 'mrrs': 512,
+                          'rcb': 64})
+
+    def test_parse_dev_no_link(self):
+        # The DMI host bridge reports an unknown speed
+        res = pcie.parse_lspci_dev(self.devs["0000:00:00.0"])
+        self.assertNotIn('gen', res)
+        self.assertEqual(res['mps'], 128)
+
+    def test_parse_dev_user(self):
+        # Without root lspci doesn't show the capabilities
+        desc = self.devs["0000:04:00.0"].split("\tCapabilities:")[0]
+        self.assertEqual(pcie.parse_lspci_dev(desc), {})
+
+    def test_root_port(self):
+        # The chipset root ports sort between the CPU root port of the
+        # NFP and the NFP, the bus numbers tell which one it is on.
+        self.assertEqual(pcie._lspci_port(self.devs, "0000:04:00.0"),
+                         "0000:00:03.0")
+        self.assertEqual(pcie._lspci_port(self.devs, "0000:01:00.0"),
+                         "0000:00:01.0")
+        self.assertIsNone(pcie._lspci_port(self.devs, "0000:00:03.0"))
+
+    def test_root_port_no_bus(self):
+        # Without bus numbers, the closest root port on a lower bus
+        devs = dict((addr, desc.replace("\tBus: primary", "\tbus: primary"))
+                    for addr, desc in self.devs.items())
+        self.assertEqual(pcie._lspci_port(devs, "0000:04:00.0"),
+                         "0000:00:1c.4")
+        self.assertEqual(pcie._lspci_port(devs, "0000:01:00.0"),
+                         "0000:00:1c.4")
+
+    def test_parse_lspci(self):
+        link = pcie.parse_lspci(self.text)
+        self.assertEqual(link.addr, "0000:04:00.0")
+        self.assertEqual(link.source, "lspci")
+        self.assertEqual((link.gen, link.width, link.mps, link.mrrs,
+                          link.rcb), (3, 8, 256, 512, 64))
+        self.assertFalse(link.degraded())
+
+    def test_parse_lspci_addr(self):
+        link = pcie.parse_lspci(self.text, "01:00.0")
+        self.assertEqual(link.addr, "0000:01:00.0")
+        self.assertEqual((link.gen, link.width, link.max_width),
+                         (2, 4, 8))
+        self.assertTrue(link.degraded())
+
+    def test_parse_lspci_port_mps(self):
+        # The port's MPS limits the device's, its RCB is used
+        desc = self.devs["0000:00:03.0"]
+        port = desc.replace("MaxPayload 256 bytes, MaxReadReq",
+                            "MaxPayload 128 bytes, MaxReadReq")
+        port = port.replace("RCB 64 bytes", "RCB 128 bytes")
+        link = pcie.parse_lspci(self.text.replace(desc, port))
+        self.assertEqual((link.mps, link.mrrs, link.rcb), (128, 512, 128))
+
+    def test_parse_lspci_missing(self):
+        self.assertIsNone(pcie.parse_lspci(self.text, "0000:02:00.0"))
+        self.assertIsNone(pcie.parse_lspci(self.text, "0000:00:00.0"))
+        self.assertIsNone(pcie.parse_lspci(""))
+
+
+class ConfigTest(unittest.TestCase):
+    """Parsing of the configuration space"""
+
+    def setUp(self):
+        self.cfg = bytearray(data("nfp6000-config.bin", 'rb'))
+
+    def test_parse_config(self):
+        self.assertEqual(pcie.parse_config(bytes(self.cfg)),
+                         {'gen': 3, 'width': 8, 'max_gen': 3,
+                          'max_width': 8, 'mps': 256, 'mrrs': 512,
+                          'rcb': 64})
+
+    def test_parse_config_fields(self):
+        # Gen2 x4 of Gen3 x8, MPS 128, MRRS 4096, RCB 128
+        struct.pack_into('<H', self.cfg, EXP + 0x12, 0x1042)
+        struct.pack_into('<H', self.cfg, EXP + 0x08, 0x5000)
+        struct.pack_into('<H', self.cfg, EXP + 0x10, 0x0048)
+        self.assertEqual(pcie.parse_config(bytes(self.cfg)),
+                         {'gen': 2, 'width': 4, 'max_gen': 3,
+                          'max_width': 8, 'mps': 128, 'mrrs': 4096,
+                          'rcb': 128})
+
+    def test_parse_config_unprivileged(self):
+        # Only the first 64 bytes are readable by users
+        self.assertIsNone(pcie.parse_config(bytes(self.cfg[:64])))
+        self.assertIsNone(pcie.parse_config(b""))
+
+    def test_parse_config_no_exp(self):
+        # MSI-X is the last capability
+        self.cfg[0xb1] = 0
+        self.assertIsNone(pcie.parse_config(bytes(self.cfg)))
+
+    def test_parse_config_loop(self):
+        self.cfg[0xb1] = 0x80
+        self.assertIsNone(pcie.parse_config(bytes(self.cfg)))
+
+    def test_sysfs_link(self):
+        # The port above the device is its parent directory
+        port = bytearray(self.cfg)
+        struct.pack_into('<H', port, EXP + 0x08, 0x0000)  # MPS 128
+        struct.pack_into('<H', port, EXP + 0x10, 0x0048)  # RCB 128
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "0000:00:03.0", "0000:04:00.0")
+            os.makedirs(path)
+            for dirname, cfg in [(path, self.cfg),
+                                 (os.path.dirname(path), port)]:
+                with open(os.path.join(dirname, "config"), 'wb') as outf:
+                    outf.write(bytes(cfg))
+            link = pcie.sysfs_link(path)
+        finally:
+            shutil.rmtree(tmp)
+        self.assertEqual((link.addr, link.source), ("0000:04:00.0", "sysfs"))
+        self.assertEqual((link.gen, link.width, link.mps, link.mrrs,
+                          link.rcb), (3, 8, 128, 512, 128))
+
+
+class ModelTest(unittest.TestCase):
+    """The bandwidth model.  The expected values are worked out by
+    hand: on Gen3 a TLP carries 16 (MRd/MWr) or 12 (CplD) bytes of
+    header plus 10 bytes of sequence number, LCRC and framing, and
+    every TLP is answered with half an Ack and half an UpdateFC DLLP
+    (8 bytes each with framing)."""
+
+    def setUp(self):
+        self.gen3 = PCIeModel(LinkConfig(3, 8, 256, 512))
+
+    def test_raw(self):
+        self.assertAlmostEqual(self.gen3.raw_gbps(), 64 * 128 / 130.0)
+        self.assertAlmostEqual(PCIeModel(LinkConfig(2, 4)).raw_gbps(), 16.0)
+        self.assertAlmostEqual(PCIeModel(LinkConfig(1, 1)).raw_gbps(), 2.0)
+
+    def test_wire(self):
+        self.assertEqual(self.gen3.wire(BW_WR, 256), (282, 4))
+        self.assertEqual(self.gen3.wire(BW_RD, 256), (30, 282))
+        self.assertEqual(self.gen3.wire(BW_RD, 512), (34, 560))
+        self.assertEqual(self.gen3.wire(BW_RW, 256), (312, 286))
+
+    def test_gbps(self):
+        raw = self.gen3.raw_gbps()
+        for test, size, off, gbps in [(BW_WR, 64, 0, raw * 64 / 90),
+                                      (BW_WR, 256, 0, raw * 256 / 282),
+                                      (BW_WR, 256, 64, raw * 256 / 308),
+                                      (BW_RD, 256, 0, raw * 256 / 282),
+                                      (BW_RD, 512, 0, raw * 512 / 560),
+                                      (BW_RW, 256, 0, raw * 512 / 312)]:
+            self.assertAlmostEqual(self.gen3.gbps(test, size, off), gbps)
+        self.assertAlmostEqual(self.gen3.gbps(BW_WR, 256), 57.2055, 4)
+        self.assertAlmostEqual(self.gen3.gbps(BW_RW, 256), 103.4099, 4)
+
+    def test_gbps_rcb(self):
+        model = PCIeModel(LinkConfig(3, 8, 256, 512), cpl_rcb=True)
+        self.assertEqual(model.wire(BW_RD, 256), (42, 348))
+        self.assertAlmostEqual(model.gbps(BW_RD, 256), 46.3561, 4)
+
+    def test_gbps_gen2(self):
+        model = PCIeModel(LinkConfig(2, 4, 128, 512))
+        self.assertEqual(model.wire(BW_WR, 128), (152, 4))
+        self.assertAlmostEqual(model.gbps(BW_WR, 128), 16.0 * 128 / 152)
+
+    def test_efficiency(self):
+        gbps = self.gen3.gbps(BW_RD, 256)
+        self.assertAlmostEqual(self.gen3.efficiency(BW_RD, 256, gbps), 1.0)
+        self.assertAlmostEqual(
+            self.gen3.efficiency(BW_RD, 256, gbps / 2), 0.5)
+        self.assertEqual(PCIeModel(LinkConfig(0, 0)).efficiency(
+            BW_RD, 256, 10.0), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Tests of the HostLock shared by the tests of several devices.
+
+Each thread stands in for a device, thrashing the host cache under the
+exclusive lock and running its test under the shared lock, as
+NFPBench.run_test() does with a C helper.
+"""
+
+import threading
+import time
+import unittest
+
+from pciebench.scheduler import HostLock
+
+# Simulated thrash and test times in seconds
+THRASH = 0.002
+TEST = 0.02
+
+
+class HostLockTest(unittest.TestCase):
+    """Thrashing never overlaps a test, the tests overlap"""
+
+    def setUp(self):
+        self.lock = HostLock()
+        self.state = threading.Lock()
+        self.excl = 0
+        self.shared = 0
+        self.max_shared = 0
+        self.errors = []
+
+    def _enter(self, exclusive):
+        with self.state:
+            if self.excl or (exclusive and self.shared):
+                self.errors.append("overlap")
+            if exclusive:
+                self.excl += 1
+            else:
+                self.shared += 1
+                self.max_shared = max(self.max_shared, self.shared)
+
+    def _leave(self, exclusive):
+        with self.state:
+            if exclusive:
+                self.excl -= 1
+            else:
+                self.shared -= 1
+
+    def _device(self, rounds, warm):
+        for _ in range(rounds):
+            self.lock.acquire(True)
+            self._enter(True)
+            time.sleep(THRASH)
+            self._leave(True)
+            if warm:
+                self.lock.downgrade()
+            else:
+                self.lock.release(True)
+                self.lock.acquire(False)
+            self._enter(False)
+            time.sleep(TEST)
+            self._leave(False)
+            self.lock.release(False)
+
+    def _run(self, devices, rounds, warm=False):
+        threads = [threading.Thread(target=self._device, args=(rounds, warm))
+                   for _ in range(devices)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+    def test_cold(self):
+        # The devices thrash one after the other, then test together
+        took = self._run(3, 10)
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self.max_shared, 3)
+        self.assertLess(took, 0.6 * 3 * 10 * (THRASH + TEST))
+
+    def test_warm(self):
+        # Nothing thrashes between warming and starting a test
+        self._run(3, 5, warm=True)
+        self.assertEqual(self.errors, [])
+
+    def test_shared(self):
+        self.lock.acquire(False)
+        self.lock.acquire(False)
+        self.lock.release(False)
+        self.lock.release(False)
+        self.lock.acquire(True)
+        self.lock.release(True)
+
+
+if __name__ == '__main__':
+    unittest.main()
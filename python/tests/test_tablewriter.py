@@ -0,0 +1,40 @@
+## Copyright (C) 2015-2018 Rolf Neugebauer.  All rights reserved.
+## Copyright (C) 2015 Netronome Systems, Inc.  All rights reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##   http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+"""Tests of the unit conversions of the TableWriter"""
+
+import unittest
+
+from pciebench.tablewriter import sz2unit, ns2unit
+
+
+class UnitTest(unittest.TestCase):
+    """Sizes and times are printed the same on Python 2 and 3"""
+
+    def test_sz2unit(self):
+        self.assertEqual(sz2unit(4096), "4KB")
+        self.assertEqual(sz2unit(1536), "1.5KB")
+        self.assertEqual(sz2unit(1024 * 1024), "1MB")
+        self.assertEqual(sz2unit(1536 * 1024), "1.5MB")
+        self.assertEqual(sz2unit(1.5 * 1024 * 1024), "1.5MB")
+
+    def test_ns2unit(self):
+        self.assertEqual(ns2unit(2000), "2us")
+        self.assertEqual(ns2unit(1500), "1.50us")
+        self.assertEqual(ns2unit(2500000), "2.50ms")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,8 +15,11 @@
  * limitations under the License.
  */
 
+#define _GNU_SOURCE
+
 #include <sys/types.h>
 #include <sys/stat.h>
+#include <sys/mman.h>
 
 #include <fcntl.h>
 #include <stdlib.h>
@@ -27,6 +30,10 @@
 #include <inttypes.h>
 #include <getopt.h>
 #include <errno.h>
+#include <time.h>
+#include <dirent.h>
+#include <sched.h>
+#include <pthread.h>
 
 #include <nfp.h>
 #include <nfp_nffw.h>
@@ -35,6 +42,23 @@
 #define ARRAY_SIZE(arr) (sizeof(arr)/sizeof(*(arr)))
 #endif
 
+/* Poll defaults */
+#define DEF_ME_MHZ          1200
+#define DEF_SPIN_US         200
+#define DEF_MAX_SLEEP_US    20000
+#define MIN_SLEEP_US        10
+
+/* Cache thrashing */
+#define THRASH_NONE         0
+#define THRASH_LEGACY       1
+#define THRASH_FAST         2
+
+#define THRASH_LLC_MULT     2               /* buffer size / LLC size */
+#define THRASH_DEF_LLC      (16 * 1024 * 1024)  /* if sysfs has no info */
+#define THRASH_MAX_CPUS     1024
+
+#define NFP_PCI_VENDOR      0x19ee
+
 void usage(const char *program)
 {
     printf("Usage: "
@@ -50,11 +74,148 @@ void usage(const char *program)
            "  -c TEST_CTRL  Symbol name for test control.\n"
            "  -t TEST       Test to run.\n"
            "  -w WIN        Warm a window of WIN size.\n"
+           "  -p PARAMS     Symbol name for the test parameters. Used to\n"
+           "                estimate how long the test takes.\n"
+           "  -r RESULT     Symbol name for the test results. Used to\n"
+           "                report the test time.\n"
+           "  -f MHZ        ME clock frequency in MHz (default %d).\n"
+           "  -s USEC       Poll without sleeping for USEC (default %d).\n"
+           "  -m USEC       Maximum time to sleep between polls\n"
+           "                (default %d).\n"
+           "  -T MODE       Cache thrash mode: fast (default), legacy\n"
+           "                or none.\n"
+           "  -C CPULIST    CPUs to thrash the cache from (default: the\n"
+           "                CPUs local to the NFP).\n"
+           "  -R            Print 'helper: ready' once the cache is\n"
+           "                thrashed and warmed and wait for a line on\n"
+           "                stdin before starting the test.\n"
            "  -h            Show this help message and exit.\n"
-           "\n", program);
+           "\n"
+           "Once the test is started, the helper sleeps for most of the\n"
+           "estimated test time (if -p is given), then polls the test\n"
+           "control symbol continuously for a while before backing off\n"
+           "exponentially up to the maximum sleep time.  On completion a\n"
+           "line with the wait and test times (in microseconds) is\n"
+           "printed.\n"
+           "\n"
+           "The legacy thrash mode does random stores into a 64MB array\n"
+           "from a single thread.  The fast mode uses a buffer of %d times\n"
+           "the size of the last level cache and one thread per core.\n"
+           "\n", program, DEF_ME_MHZ, DEF_SPIN_US, DEF_MAX_SLEEP_US,
+           THRASH_LLC_MULT);
     exit(1);
 }
 
+/*
+ * Test numbers, flags and transaction counts.  Must match pciebench.h
+ */
+#define LAT_CMD_RD          1
+#define LAT_CMD_WRRD        2
+#define LAT_DMA_RD          3
+#define LAT_DMA_WRRD        4
+#define BW_DMA_RD           5
+#define BW_DMA_WR           6
+#define BW_DMA_RW           7
+
+#define LAT_FLAGS_LONG      8
+
+#define PCIEBENCH_LAT_TRANS (2 * 1024 * 1024)
+#define PCIEBENCH_BW_TRANS  (8 * 1024 * 1024)
+#define PCIEBENCH_JOURNAL_SZ (16 * 1024 * 1024)
+
+/*
+ * Optimistic per transaction costs (in ns) used to estimate the test
+ * duration.  The helper sleeps for most of the estimate, so these
+ * should be on the low side of anything seen on real systems: a
+ * short estimate only costs a few extra polls, a long one delays
+ * noticing that the test has finished.
+ */
+#define EST_CMD_LAT_NS      250
+#define EST_DMA_LAT_NS      300
+#define EST_BW_MIN_NS       5   /* ~200 Mtps */
+#define EST_BW_GBPS         64  /* Gen3 x8 raw */
+
+/* Sleep up to this fraction of the estimated test time before polling */
+#define EST_SLEEP_PCT       90
+
+/* Test parameters and results as laid out in pciebench.h */
+struct test_params {
+    uint32_t p0;    /* flags */
+    uint32_t p1;    /* transfer size */
+    uint32_t p2;    /* window size */
+    uint32_t p3;    /* host offset */
+    uint32_t p4;    /* device offset */
+};
+
+struct test_result {
+    uint32_t start_hi;
+    uint32_t start_lo;
+    uint32_t end_hi;
+    uint32_t end_lo;
+    uint32_t r0;
+    uint32_t r1;
+    uint32_t r2;
+    uint32_t r3;
+};
+
+static uint64_t
+now_ns(void)
+{
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec * 1000000000ull + ts.tv_nsec;
+}
+
+static void
+sleep_ns(uint64_t ns)
+{
+    struct timespec ts;
+
+    ts.tv_sec = ns / 1000000000ull;
+    ts.tv_nsec = ns % 1000000000ull;
+    while (nanosleep(&ts, &ts) && errno == EINTR)
+        ;
+}
+
+/*
+ * Estimate a lower bound for the duration of a test (in ns) from its
+ * parameters.  Returns 0 if no estimate can be made.
+ */
+static uint64_t
+estimate_ns(int test, const struct test_params *p)
+{
+    uint64_t trans, per_trans;
+
+    switch (test) {
+    case LAT_CMD_RD:
+    case LAT_CMD_WRRD:
+    case LAT_DMA_RD:
+    case LAT_DMA_WRRD:
+        trans = (p->p0 & LAT_FLAGS_LONG) ?
+            PCIEBENCH_JOURNAL_SZ : PCIEBENCH_LAT_TRANS;
+        per_trans = (test <= LAT_CMD_WRRD) ? EST_CMD_LAT_NS : EST_DMA_LAT_NS;
+        if (test == LAT_CMD_WRRD || test == LAT_DMA_WRRD)
+            per_trans *= 2;
+        break;
+
+    case BW_DMA_RD:
+    case BW_DMA_WR:
+    case BW_DMA_RW:
+        trans = (p->p0 & LAT_FLAGS_LONG) ?
+            PCIEBENCH_JOURNAL_SZ : PCIEBENCH_BW_TRANS;
+        per_trans = (uint64_t)p->p1 * 8 / EST_BW_GBPS;
+        if (per_trans < EST_BW_MIN_NS)
+            per_trans = EST_BW_MIN_NS;
+        break;
+
+    default:
+        return 0;
+    }
+
+    return trans * per_trans;
+}
+
 /*
  * Before starting a test we aim thrash the cache by randomly
  * writing to elements in a 64MB large array.
@@ -72,9 +233,254 @@ thrash_cache(void)
     }
 }
 
+/*
+ * The fast thrash mode sizes the buffer from the size of the last
+ * level cache and writes to it from one thread per core on the NFP's
+ * node.  Each thread writes to random cache lines in its own slice of
+ * the buffer, using a xorshift PRNG instead of rand() (which takes a
+ * lock).
+ */
+struct thrash_ctx {
+    pthread_t thread;
+    int cpu;
+    uint64_t *buf;
+    size_t lines;
+};
+
+/* Read the first line of a sysfs file into @buf */
+static int
+read_sysfs(const char *path, char *buf, size_t len)
+{
+    FILE *f;
+
+    f = fopen(path, "r");
+    if (!f)
+        return -1;
+    if (!fgets(buf, len, f)) {
+        fclose(f);
+        return -1;
+    }
+    fclose(f);
+    buf[strcspn(buf, "\n")] = 0;
+    return 0;
+}
+
+/* Parse a cpulist ("0-3,8,10-11") into @cpus.  Returns the number of
+ * CPUs */
+static int
+parse_cpulist(const char *str, int *cpus, int max)
+{
+    int n = 0, lo, hi;
+    char *cp;
+
+    while (*str) {
+        lo = hi = strtoul(str, &cp, 10);
+        if (cp == str)
+            break;
+        if (*cp == '-') {
+            str = cp + 1;
+            hi = strtoul(str, &cp, 10);
+        }
+        for (; lo <= hi && n < max; lo++)
+            cpus[n++] = lo;
+        str = (*cp == ',') ? cp + 1 : cp;
+    }
+    return n;
+}
+
+/* Find the CPUs local to NFP @nfp_no: the local_cpulist of the
+ * @nfp_no'th Netronome physical function in sysfs.  Falls back to all
+ * online CPUs. */
+static int
+nfp_local_cpus(int nfp_no, int *cpus, int max)
+{
+    char path[512], buf[4096];
+    struct dirent **devs;
+    int i, n, idx = 0, res = 0;
+
+    n = scandir("/sys/bus/pci/devices", &devs, NULL, alphasort);
+    for (i = 0; i < n; i++) {
+        if (!res && devs[i]->d_name[0] != '.') {
+            snprintf(path, sizeof(path), "/sys/bus/pci/devices/%s/vendor",
+                     devs[i]->d_name);
+            if (!read_sysfs(path, buf, sizeof(buf)) &&
+                strtoul(buf, NULL, 0) == NFP_PCI_VENDOR) {
+                /* Skip virtual functions */
+                snprintf(path, sizeof(path),
+                         "/sys/bus/pci/devices/%s/physfn", devs[i]->d_name);
+                if (access(path, F_OK) && idx++ == nfp_no) {
+                    snprintf(path, sizeof(path),
+                             "/sys/bus/pci/devices/%s/local_cpulist",
+                             devs[i]->d_name);
+                    if (!read_sysfs(path, buf, sizeof(buf)))
+                        res = parse_cpulist(buf, cpus, max);
+                }
+            }
+        }
+        free(devs[i]);
+    }
+    if (n >= 0)
+        free(devs);
+
+    if (!res &&
+        !read_sysfs("/sys/devices/system/cpu/online", buf, sizeof(buf)))
+        res = parse_cpulist(buf, cpus, max);
+    return res;
+}
+
+/* Only keep one hyperthread of each core in @cpus.  Cores are
+ * identified by the first CPU in their thread_siblings_list */
+static int
+one_cpu_per_core(int *cpus, int n)
+{
+    static int cores[THRASH_MAX_CPUS];
+    char path[256], buf[256];
+    int i, j, core, res = 0;
+
+    for (i = 0; i < n; i++) {
+        snprintf(path, sizeof(path),
+                 "/sys/devices/system/cpu/cpu%d/topology/thread_siblings_list",
+                 cpus[i]);
+        core = cpus[i];
+        if (!read_sysfs(path, buf, sizeof(buf)))
+            core = strtoul(buf, NULL, 10);
+
+        for (j = 0; j < res; j++)
+            if (cores[j] == core)
+                break;
+        if (j < res)
+            continue;
+        cores[res] = core;
+        cpus[res++] = cpus[i];
+    }
+    return res;
+}
+
+/* Size of the largest data/unified cache of @cpu according to sysfs */
+static size_t
+llc_size(int cpu)
+{
+    char path[256], buf[64];
+    int idx, level, max_level = 0;
+    size_t sz, res = 0;
+    char *cp;
+
+    for (idx = 0; ; idx++) {
+        snprintf(path, sizeof(path),
+                 "/sys/devices/system/cpu/cpu%d/cache/index%d/level", cpu, idx);
+        if (read_sysfs(path, buf, sizeof(buf)))
+            break;
+        level = strtoul(buf, NULL, 10);
+
+        snprintf(path, sizeof(path),
+                 "/sys/devices/system/cpu/cpu%d/cache/index%d/type", cpu, idx);
+        if (read_sysfs(path, buf, sizeof(buf)) ||
+            !strcmp(buf, "Instruction"))
+            continue;
+
+        snprintf(path, sizeof(path),
+                 "/sys/devices/system/cpu/cpu%d/cache/index%d/size", cpu, idx);
+        if (read_sysfs(path, buf, sizeof(buf)))
+            continue;
+        sz = strtoul(buf, &cp, 10);
+        if (*cp == 'K')
+            sz *= 1024;
+        else if (*cp == 'M')
+            sz *= 1024 * 1024;
+
+        if (level > max_level) {
+            max_level = level;
+            res = sz;
+        }
+    }
+    return res ? res : THRASH_DEF_LLC;
+}
+
+static void *
+thrash_thread(void *arg)
+{
+    struct thrash_ctx *ctx = arg;
+    uint64_t x = 0x9e3779b97f4a7c15ull ^ ((uint64_t)ctx->cpu << 32 | 1);
+    cpu_set_t set;
+    size_t i;
+
+    CPU_ZERO(&set);
+    CPU_SET(ctx->cpu, &set);
+    pthread_setaffinity_np(pthread_self(), sizeof(set), &set);
+
+    /* First touch from the pinned thread, so the pages are local.
+     * This already writes every line once, in order. Adaptive LLC
+     * replacement policies may keep some old lines on a streaming
+     * pattern, so follow up with the same number of random stores. */
+    for (i = 0; i < ctx->lines; i++)
+        ctx->buf[i * 8] = i;
+
+    for (i = 0; i < ctx->lines; i++) {
+        x ^= x << 13;
+        x ^= x >> 7;
+        x ^= x << 17;
+        ctx->buf[(x % ctx->lines) * 8] = x;
+    }
+    return NULL;
+}
+
+/* Returns the number of threads used and the buffer size in @buf_sz */
+static int
+thrash_cache_fast(int nfp_no, const char *cpulist, size_t *buf_sz)
+{
+    static int cpus[THRASH_MAX_CPUS];
+    struct thrash_ctx *ctx;
+    size_t sz, lines;
+    uint64_t *buf;
+    int i, n;
+
+    if (cpulist)
+        n = parse_cpulist(cpulist, cpus, THRASH_MAX_CPUS);
+    else
+        n = nfp_local_cpus(nfp_no, cpus, THRASH_MAX_CPUS);
+    n = one_cpu_per_core(cpus, n);
+    if (n < 1) {
+        thrash_cache();
+        *buf_sz = sizeof(large_array);
+        return 1;
+    }
+
+    sz = THRASH_LLC_MULT * llc_size(cpus[0]);
+    buf = mmap(NULL, sz, PROT_READ | PROT_WRITE,
+               MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+    ctx = calloc(n, sizeof(*ctx));
+    if (buf == MAP_FAILED || !ctx) {
+        perror("Failed to allocate thrash buffer");
+        exit(1);
+    }
+#ifdef MADV_HUGEPAGE
+    /* Fewer page faults on first touch */
+    madvise(buf, sz, MADV_HUGEPAGE);
+#endif
+
+    lines = sz / 64 / n;
+    for (i = 0; i < n; i++) {
+        ctx[i].cpu = cpus[i];
+        ctx[i].buf = buf + i * lines * 8;
+        ctx[i].lines = lines;
+        if (pthread_create(&ctx[i].thread, NULL, thrash_thread, &ctx[i])) {
+            perror("Failed to create thrash thread");
+            exit(1);
+        }
+    }
+    for (i = 0; i < n; i++)
+        pthread_join(ctx[i].thread, NULL);
+
+    munmap(buf, sz);
+    free(ctx);
+    *buf_sz = sz;
+    return n;
+}
+
 
 /* Warm the host buffers for a given window size. The window size is
- * rounded up to the nearest full page. */
+ * rounded up to the nearest full page.  The buffer is mmap()ed if the
+ * kernel module supports it, otherwise it is written through procfs. */
 static void
 warm_cache(int nfp_no, int win_sz)
 {
@@ -82,11 +488,12 @@ warm_cache(int nfp_no, int win_sz)
     int fd;
     int num_pages;
     uint32_t page[1024];
+    char *buf;
     int i, j;
 
     snprintf(fn, sizeof(fn), "/proc/pciebench_buffer-%d", nfp_no);
 
-    fd = open(fn, O_WRONLY | O_SYNC);
+    fd = open(fn, O_RDWR);
     if (fd < 0) {
         perror("Failed to open host buffer file");
         exit(1);
@@ -101,10 +508,20 @@ warm_cache(int nfp_no, int win_sz)
 
     /* Write win_sz worth of pages to the start of the host
      * buffer. repeat a number of times. */
-    for (i = 0; i < 4; i++) {
-        lseek(fd, 0, SEEK_SET);
-        for (j = 0; j < num_pages; j++)
-            write(fd, page, sizeof(page));
+    buf = mmap(NULL, num_pages * sizeof(page), PROT_READ | PROT_WRITE,
+               MAP_SHARED, fd, 0);
+    if (buf != MAP_FAILED) {
+        for (i = 0; i < 4; i++)
+            for (j = 0; j < num_pages; j++)
+                memcpy(buf + j * sizeof(page), page, sizeof(page));
+        munmap(buf, num_pages * sizeof(page));
+    } else {
+        for (i = 0; i < 4; i++) {
+            lseek(fd, 0, SEEK_SET);
+            for (j = 0; j < num_pages; j++)
+                if (write(fd, page, sizeof(page)) != sizeof(page))
+                    break;
+        }
     }
 
     close(fd);
@@ -116,12 +533,27 @@ main(int argc, char *argv[])
     char *cp;
     int r;
     int opt_nfp = 0, opt_test = -1, opt_win = 0;
-    char opt_ctrl[256];
+    int opt_mhz = DEF_ME_MHZ;
+    int opt_spin_us = DEF_SPIN_US, opt_max_us = DEF_MAX_SLEEP_US;
+    char opt_ctrl[256] = "";
+    char opt_params[256] = "";
+    char opt_result[256] = "";
+    int opt_thrash = THRASH_FAST;
+    char *opt_cpulist = NULL;
+    int opt_ready = 0;
 
     struct nfp_device *nfp;
     const struct nfp_rtsym *sym;
-
-    while ((r = getopt(argc, argv, "n:c:t:w:h")) != -1) {
+    const struct nfp_rtsym *sym_params = NULL, *sym_result = NULL;
+    struct test_params params;
+    struct test_result result;
+    int test_no, polls = 0;
+    uint64_t est_ns = 0, start_ns, spin_end_ns, wait_ns, test_ns = 0;
+    uint64_t delay_ns, thrash_ns, warm_ns, slept_ns = 0;
+    size_t thrash_sz = 0;
+    int thrash_threads = 0;
+
+    while ((r = getopt(argc, argv, "n:c:t:w:p:r:f:s:m:T:C:Rh")) != -1) {
         switch(r) {
         case 'n':
             opt_nfp = strtoul(optarg, &cp, 0);
@@ -130,7 +562,7 @@ main(int argc, char *argv[])
             break;
 
         case 'c':
-            strncpy(opt_ctrl, optarg, sizeof(opt_ctrl));
+            strncpy(opt_ctrl, optarg, sizeof(opt_ctrl) - 1);
             break;
 
         case 't':
@@ -145,6 +577,51 @@ main(int argc, char *argv[])
                 usage(argv[0]);
             break;
 
+        case 'p':
+            strncpy(opt_params, optarg, sizeof(opt_params) - 1);
+            break;
+
+        case 'r':
+            strncpy(opt_result, optarg, sizeof(opt_result) - 1);
+            break;
+
+        case 'f':
+            opt_mhz = strtoul(optarg, &cp, 0);
+            if ((cp == optarg) || (*cp != 0) || !opt_mhz)
+                usage(argv[0]);
+            break;
+
+        case 's':
+            opt_spin_us = strtoul(optarg, &cp, 0);
+            if ((cp == optarg) || (*cp != 0))
+                usage(argv[0]);
+            break;
+
+        case 'm':
+            opt_max_us = strtoul(optarg, &cp, 0);
+            if ((cp == optarg) || (*cp != 0) || opt_max_us < MIN_SLEEP_US)
+                usage(argv[0]);
+            break;
+
+        case 'T':
+            if (!strcmp(optarg, "fast"))
+                opt_thrash = THRASH_FAST;
+            else if (!strcmp(optarg, "legacy"))
+                opt_thrash = THRASH_LEGACY;
+            else if (!strcmp(optarg, "none"))
+                opt_thrash = THRASH_NONE;
+            else
+                usage(argv[0]);
+            break;
+
+        case 'C':
+            opt_cpulist = optarg;
+            break;
+
+        case 'R':
+            opt_ready = 1;
+            break;
+
         default:
             usage(argv[0]);
             break;
@@ -167,22 +644,99 @@ main(int argc, char *argv[])
         return -1;
     }
 
-    /* Always thrash the cache */
-    thrash_cache();
+    if (opt_params[0]) {
+        sym_params = nfp_rtsym_lookup(nfp, opt_params);
+        if (!sym_params) {
+            perror("Lookup params symbol");
+            return -1;
+        }
+        nfp_rtsym_read(nfp, sym_params, &params, sizeof(params), 0);
+        est_ns = estimate_ns(opt_test, &params);
+    }
+
+    if (opt_result[0]) {
+        sym_result = nfp_rtsym_lookup(nfp, opt_result);
+        if (!sym_result) {
+            perror("Lookup result symbol");
+            return -1;
+        }
+    }
+
+    /* Always thrash the cache (unless told otherwise) */
+    thrash_ns = now_ns();
+    if (opt_thrash == THRASH_FAST) {
+        thrash_threads = thrash_cache_fast(opt_nfp, opt_cpulist, &thrash_sz);
+    } else if (opt_thrash == THRASH_LEGACY) {
+        thrash_cache();
+        thrash_threads = 1;
+        thrash_sz = sizeof(large_array);
+    }
+    thrash_ns = now_ns() - thrash_ns;
 
     /* Warm the host buffers if requested */
+    warm_ns = now_ns();
     if (opt_win)
         warm_cache(opt_nfp, opt_win);
+    warm_ns = now_ns() - warm_ns;
+
+    /* Tell the caller, who may let other devices use the host
+     * before telling us to go on */
+    if (opt_ready) {
+        char go[16];
+
+        printf("helper: ready\n");
+        fflush(stdout);
+        if (!fgets(go, sizeof(go), stdin)) {
+            fprintf(stderr, "No go-ahead to start the test\n");
+            return -1;
+        }
+    }
 
     /* start the test */
-    nfp_rtsym_write(nfp, sym, &opt_test, sizeof(opt_test), 0);
+    start_ns = now_ns();
+    test_no = opt_test;
+    nfp_rtsym_write(nfp, sym, &test_no, sizeof(test_no), 0);
+
+    /* Sleep through most of the expected test time */
+    if (est_ns) {
+        sleep_ns(est_ns / 100 * EST_SLEEP_PCT);
+        slept_ns = now_ns() - start_ns;
+    }
 
-    /* Poll for the test to finish */
-    while (opt_test > 0) {
-        sleep(2);
-        nfp_rtsym_read(nfp, sym, &opt_test, sizeof(opt_test), 0);
+    /* Poll for the test to finish: spin for a while, then back off
+     * exponentially up to the maximum sleep time */
+    spin_end_ns = now_ns() + (uint64_t)opt_spin_us * 1000;
+    delay_ns = MIN_SLEEP_US * 1000;
+    for (;;) {
+        nfp_rtsym_read(nfp, sym, &test_no, sizeof(test_no), 0);
+        polls++;
+        if (test_no <= 0)
+            break;
+        if (now_ns() < spin_end_ns)
+            continue;
+        sleep_ns(delay_ns);
+        delay_ns *= 2;
+        if (delay_ns > (uint64_t)opt_max_us * 1000)
+            delay_ns = (uint64_t)opt_max_us * 1000;
+    }
+    wait_ns = now_ns() - start_ns;
+
+    /* The ME timestamp counter increments every 16 cycles */
+    if (sym_result) {
+        nfp_rtsym_read(nfp, sym_result, &result, sizeof(result), 0);
+        test_ns = ((((uint64_t)result.end_hi << 32) | result.end_lo) -
+                   (((uint64_t)result.start_hi << 32) | result.start_lo)) *
+            16 * 1000 / opt_mhz;
     }
 
+    printf("helper: test=%d expected_us=%" PRIu64 " test_us=%" PRIu64
+           " wait_us=%" PRIu64 " polls=%d thrash_us=%" PRIu64
+           " thrash_kb=%zu thrash_threads=%d warm_us=%" PRIu64
+           " sleep_us=%" PRIu64 "\n", opt_test,
+           est_ns / 1000, test_ns / 1000, wait_ns / 1000, polls,
+           thrash_ns / 1000, thrash_sz / 1024, thrash_threads,
+           warm_ns / 1000, slept_ns / 1000);
+
     return 0;
 }
 